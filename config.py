@@ -4,6 +4,9 @@ import streamlit as st
 import tempfile
 from rag.chat_history import generate_session_id
 from rag.utils import load_indexed_files
+from rag.embeddings import preload_embeddings
+from rag.llm_loader import warm_up_async
+from settings import EMBEDDING_PRELOAD, LLM_WARMUP
 
 def setup_app():
 
@@ -28,6 +31,9 @@ def setup_app():
     logger.info("✅ Aplicativo iniciado.")
 
 
+    preload_embeddings(EMBEDDING_PRELOAD)
+    warm_up_async(LLM_WARMUP)
+
     if "indexed_files" not in st.session_state:
         st.session_state["indexed_files"] = load_indexed_files()
 
@@ -4,6 +4,7 @@ import logging
 import streamlit as st
 from rag.utils import save_uploaded_files
 from rag.vectorstore import create_vectorstore
+from settings import INDEX_TYPE, IVF_NPROBE, HNSW_EF_SEARCH
 
 def handle_upload_and_reindex(embed_model_name):
     st.sidebar.header("📄 Enviar documentos")
@@ -21,12 +22,20 @@ def handle_upload_and_reindex(embed_model_name):
         logging.info("Iniciando reindexação manual...")
         try:
             with st.spinner("🔄 Indexando documentos e criando vetor..."):
-                db, metrics = create_vectorstore(embed_model_name)
+                db, metrics = create_vectorstore(
+                    embed_model_name,
+                    index_type=st.session_state.get("index_type", INDEX_TYPE),
+                    nprobe=st.session_state.get("ivf_nprobe", IVF_NPROBE),
+                    ef_search=st.session_state.get("hnsw_ef_search", HNSW_EF_SEARCH),
+                )
                 if db is None:
                     st.error("❌ A indexação falhou. Nenhum vetor foi criado.")
                 else:
                     st.success("✅ Vetor criado com sucesso!")
                     st.session_state["index_metrics"] = metrics
+                    if metrics.get("relatorio_indice"):
+                        st.sidebar.markdown(f"📏 **Relatório do índice {metrics['tipo_indice']}:**")
+                        st.sidebar.json(metrics["relatorio_indice"])
         except Exception as e:
             st.error(f"❌ Erro ao criar o vetor: {e}")
             logging.exception("Erro durante criação da base vetorial.")
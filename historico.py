@@ -2,30 +2,26 @@ import os
 import json
 import streamlit as st
 import codecs
+from rag.chat_history import list_sessions, load_chat
 
 st.set_page_config(page_title="Histórico de Sessões", page_icon="📜")
 st.title("📜 Histórico de Sessões de Chat")
 
-# Caminho dos arquivos
-SESSIONS_DIR = "chat_sessions"
-
-if not os.path.exists(SESSIONS_DIR):
+if not list_sessions():
     st.warning("Nenhuma sessão registrada ainda.")
     st.stop()
 
-# Carrega sessões
-arquivos = sorted(os.listdir(SESSIONS_DIR), reverse=True)
+# Carrega sessões (log .jsonl ou arquivo .json antigo)
 dados = []
 
-for nome in arquivos:
-    if nome.endswith(".json"):
-        with open(os.path.join(SESSIONS_DIR, nome), encoding="utf-8") as f:
-            try:
-                sessao = json.load(f)
-                if isinstance(sessao, dict):
-                    dados.append(sessao)
-            except Exception:
-                continue
+for session_id in list_sessions():
+    try:
+        sessao = load_chat(session_id)
+        if isinstance(sessao, dict) and sessao:
+            sessao.pop("turnos", None)
+            dados.append(sessao)
+    except Exception:
+        continue
 
 # Filtros
 st.sidebar.header("🔎 Filtros")
@@ -1,67 +1,59 @@
-import time
-import logging
 import streamlit as st
-from rag.chat_history import save_chat
-from rag.reranker_local import rerank_local_reranker 
-
-def process_query(user_input, qa_chain):
-    # Recupera os últimos 3 turnos (user + bot) do histórico
-    chat_history = st.session_state.chat_history[-6:]
-    history = "\n".join([f"{role}: {msg}" for role, msg in chat_history])
-    full_query = f"Histórico:\n{history}\n\nNova pergunta:\n{user_input}"
-
-    logging.info(f"Usuário perguntou: {user_input}")
-
-    start = time.time()
-
-    # Etapa de geração com recuperação de contexto
-    result = qa_chain.invoke({"query": full_query})
-    resposta = result["result"]
-    fontes = result["source_documents"]
-
-    if st.session_state.get("usar_reranker_debug", False):
-    # Aplicar rerank com modelo local
-        fontes = rerank_local_reranker(user_input, fontes, top_k=st.session_state["retriever_k"])
-    else:
-        fontes = result["source_documents"]
-
-
-    elapsed = time.time() - start
-    logging.info(f"Resposta gerada em {elapsed:.2f}s")
-
-    # Atualizar histórico
-    st.session_state.chat_history.append(("user", user_input))
-    st.session_state.chat_history.append(("bot", resposta))
-    st.session_state.last_contexts = fontes
-
-    # Metadados para salvamento do chat
-    chat_metadata = {
-        "modelo_llm": st.session_state["modelo_llm"],
-        "modelo_embedding": st.session_state["embedding_model"],
-        "retriever_k": st.session_state["retriever_k"],
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "prompt_template": st.session_state.get("prompt_template", "")
-    }
+from rag.engine import get_engine, EngineConfig, ChatSession
+
+def engine_config():
+    """Configuração do motor a partir das escolhas da barra lateral."""
+    return EngineConfig(
+        indices=st.session_state.get("faiss_selecionados", []),
+        embedding_model=st.session_state["embedding_model"],
+        modelo_llm=st.session_state["modelo_llm"],
+        temperature=st.session_state.get("llm_temperature"),
+        k=st.session_state["retriever_k"],
+        prompt_name=st.session_state.get("prompt_name", "teste"),
+        filtro=st.session_state.get("filtro_metadados", ""),
+        usar_reranker=st.session_state.get("usar_reranker_debug", False),
+    )
 
-    save_chat(
-        st.session_state.chat_session_id,
-        st.session_state.chat_history,
-        metadata=chat_metadata
+def chat_session():
+    """
+    Sessão do motor que compartilha a lista de histórico guardada no Streamlit.
+    Fica no session_state para que o resumo acumulado sobreviva às reexecuções;
+    é recriada quando a conversa é limpa ou trocada.
+    """
+    session = st.session_state.get("engine_session")
+    if (session is None or session.history is not st.session_state.chat_history
+            or session.session_id != st.session_state.chat_session_id):
+        session = ChatSession(
+            session_id=st.session_state.chat_session_id,
+            history=st.session_state.chat_history,
+        )
+        st.session_state["engine_session"] = session
+    return session
+
+def process_query(user_input, pipeline, config, on_sources=None, on_token=None):
+    """
+    Envia a pergunta ao motor e desenha o resultado. As fontes chegam a
+    `on_sources` assim que a recuperação termina e cada trecho gerado a
+    `on_token`. Retorna (resposta, fontes, elapsed, metricas).
+    """
+    result = get_engine().ask(
+        chat_session(), config, user_input,
+        on_sources=on_sources, on_token=on_token, pipeline=pipeline
     )
+    st.session_state.last_contexts = result.fontes
+    st.session_state["last_cache_hit"] = result.cache
 
     # DEBUG: Comparar fontes antes e depois do rerank
-    if st.session_state.get("usar_reranker_debug", False):
+    if config.usar_reranker:
         st.subheader("🔍 Comparação: Chunks Antes vs. Depois do Rerank")
 
         st.markdown("### Antes do Reranker")
-        for i, doc in enumerate(result["source_documents"]):
+        for i, doc in enumerate(result.documentos):
             st.markdown(f"**[{i+1}]** {doc.page_content[:300]}...")
 
         st.markdown("### Depois do Reranker")
-        for i, doc in enumerate(fontes):
+        for i, doc in enumerate(result.fontes):
             st.markdown(f"**[{i+1}]** {doc.page_content[:300]}...")
 
 
-    return resposta, fontes, elapsed
-
-
+    return result.resposta, result.fontes, result.elapsed, result.metricas
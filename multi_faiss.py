@@ -1,23 +1,329 @@
 # multi_faiss.py
 
-from typing import List
+import asyncio
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+import faiss
+import numpy as np
 from langchain.schema import BaseRetriever, Document
 from langchain_core.documents import Document  # compatível com algumas versões
 from pydantic import Field
+from settings import RETRIEVER_MAX_WORKERS, RETRIEVER_TIMEOUT, HYBRID_SEARCH, RRF_K, FILTER_EXACT_MAX, FILTER_EXACT_CHUNK
+from rag.normalizador import normalizar
+from rag import retrieval_cache
+from rag.embeddings import embed_query, aembed_query
+
+# Pool compartilhado pelas buscas de todas as sessões
+_executor = ThreadPoolExecutor(max_workers=RETRIEVER_MAX_WORKERS, thread_name_prefix="faiss")
+
+
+def _normalize(store, results: List[Tuple[Document, float, str]]) -> List[Tuple[float, Document, str]]:
+    """Converte a distância do FAISS em relevância comparável entre índices (maior = melhor)."""
+    relevance_fn = store._select_relevance_score_fn()
+    normalized = []
+    for doc, distance, doc_id in results:
+        score = float(relevance_fn(distance))
+        doc = Document(page_content=doc.page_content, metadata={**doc.metadata, "score": score})
+        normalized.append((score, doc, doc_id))
+    return normalized
+
+
+def _prepare_query(store, vector) -> np.ndarray:
+    """Vetor da pergunta como o FAISS do LangChain o usaria (normalizado se o índice for de cosseno)."""
+    query = np.asarray([vector], dtype="float32")
+    if getattr(store, "_normalize_L2", False):
+        faiss.normalize_L2(query)
+    return query[0]
+
+
+def _hits_to_docs(store, hits, k: int, matches=None) -> List[Tuple[Document, float, str]]:
+    """(distância, posição) -> (documento, distância, id no docstore), até k documentos."""
+    results = []
+    for distance, pos in hits:
+        if pos == -1:
+            continue
+        doc_id = store.index_to_docstore_id[int(pos)]
+        doc = store.docstore.search(doc_id)
+        if isinstance(doc, Document) and (matches is None or matches(doc.metadata)):
+            results.append((doc, float(distance), doc_id))
+            if len(results) >= k:
+                break
+    return results
+
+
+def _search_dense(store, vector, k: int, matches=None, fetch_k: Optional[int] = None):
+    """Busca densa no índice inteiro, mantendo o id do docstore de cada resultado."""
+    query = _prepare_query(store, vector)
+    distances, found = store.index.search(query[None, :], fetch_k or k)
+    return _hits_to_docs(store, zip(distances[0], found[0]), k, matches)
+
+
+def _positions(store, ids: Set[str]) -> np.ndarray:
+    """Posições FAISS dos chunk_ids permitidos (mapa reverso calculado uma vez por índice carregado)."""
+    reverse = getattr(store, "_posicao_por_id", None)
+    if reverse is None:
+        reverse = {doc_id: pos for pos, doc_id in store.index_to_docstore_id.items()}
+        store._posicao_por_id = reverse
+    return np.array(sorted(reverse[i] for i in ids if i in reverse), dtype="int64")
+
+
+def _search_params(index, selector):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _exact_top_k(index, query: np.ndarray, positions: np.ndarray, k: int):
+    """
+    Distâncias exatas só das posições permitidas, em blocos de FILTER_EXACT_CHUNK
+    vetores com top-k acumulado, para a memória por consulta ficar limitada.
+    """
+    best_d = np.empty(0, dtype="float32")
+    best_p = np.empty(0, dtype="int64")
+    for start in range(0, len(positions), FILTER_EXACT_CHUNK):
+        block = positions[start:start + FILTER_EXACT_CHUNK]
+        vectors = index.reconstruct_batch(block)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        best_d = np.concatenate([best_d, distances])
+        best_p = np.concatenate([best_p, block])
+        if len(best_d) > k:
+            keep = np.argpartition(best_d, k)[:k]
+            best_d, best_p = best_d[keep], best_p[keep]
+    order = np.argsort(best_d)
+    return zip(best_d[order], best_p[order])
+
+
+def _search_allowed(store, vector, positions: np.ndarray, k: int) -> List[Tuple[Document, float, str]]:
+    """
+    Busca restrita às posições permitidas. Listas pequenas têm as distâncias
+    calculadas só para seus vetores; listas grandes usam um IDSelector do FAISS.
+    """
+    if len(positions) == 0:
+        return []
+    query = _prepare_query(store, vector)
+    hits = None
+
+    if len(positions) <= FILTER_EXACT_MAX:
+        try:
+            hits = _exact_top_k(store.index, query, positions, k)
+        except RuntimeError:
+            hits = None  # índice sem reconstrução (ex.: IVF sem direct map)
+
+    if hits is None:
+        selector = faiss.IDSelectorBatch(len(positions), faiss.swig_ptr(positions))
+        distances, found = store.index.search(query[None, :], k, params=_search_params(store.index, selector))
+        hits = zip(distances[0], found[0])
+    return _hits_to_docs(store, hits, k)
+
+
+def _metadata_matcher(filtro: Dict[str, List[str]]):
+    """Filtro de metadados para índices legados (sem índice invertido), aplicado após a busca."""
+    def matches(metadata):
+        normalizados = {normalizar(str(c)): normalizar(str(v)) for c, v in metadata.items()}
+        return all(normalizados.get(campo) in valores for campo, valores in filtro.items())
+    return matches
+
 
 class MultiFAISSRetriever(BaseRetriever):
-    retrievers: List[BaseRetriever] = Field(...)
+    vectorstores: List[Any] = Field(...)
     k: int = Field(default=5)
+    timeout: float = Field(default=RETRIEVER_TIMEOUT)
+    hybrid: bool = Field(default=HYBRID_SEARCH)
+    filtro: Dict[str, List[str]] = Field(default_factory=dict)
+
+    def _merge(self, dense: Dict[int, List[Tuple[float, Document, str]]]) -> List[Tuple[int, str, Document]]:
+        """Top-k global da busca densa, pela relevância normalizada."""
+        candidates = ((score, i, doc_id, doc) for i, items in dense.items() for score, doc, doc_id in items)
+        return [(i, doc_id, doc) for _, i, doc_id, doc in heapq.nlargest(self.k, candidates, key=lambda x: x[0])]
+
+    def _fuse(self, dense: Dict[int, List[Tuple[float, Document, str]]],
+              lexical: Dict[int, List[Tuple[str, float]]]) -> List[Tuple[int, str, Document]]:
+        """
+        Reciprocal rank fusion entre o ranking denso global e o ranking BM25 de
+        cada índice, com os dois lados identificados pelo id do docstore.
+        Documentos que só aparecem na busca lexical são lidos do docstore
+        apenas se entrarem no top-k final.
+        """
+        ranked_dense = self._merge(dense)
+        if not lexical:
+            return ranked_dense
+
+        fused, docs = {}, {}
+        for rank, (i, doc_id, doc) in enumerate(ranked_dense):
+            key = (i, doc_id)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs[key] = doc
+        for i, hits in lexical.items():
+            for rank, (doc_id, _) in enumerate(hits):
+                key = (i, doc_id)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+        results = []
+        for key in heapq.nlargest(self.k, fused, key=fused.get):
+            doc = docs.get(key)
+            if doc is None:
+                doc = self.vectorstores[key[0]].docstore.search(key[1])
+                if not isinstance(doc, Document):
+                    continue
+            results.append((key[0], key[1], Document(page_content=doc.page_content, metadata={**doc.metadata, "rrf": fused[key]})))
+        return results
+
+    def _cache_key(self, query: str):
+        """Chave do cache de recuperação, ou None se algum índice não tem versão conhecida."""
+        versions = [getattr(store, "_versao_indice", None) for store in self.vectorstores]
+        if None in versions:
+            return None
+        return retrieval_cache.retrieval_key(query, versions, self.k, self.hybrid, self.filtro)
+
+    def _from_cache(self, key) -> Optional[List[Document]]:
+        """Reconstrói o resultado em cache a partir dos ids do docstore e pontuações guardados."""
+        cached = retrieval_cache.get(key) if key else None
+        if cached is None:
+            return None
+        docs = []
+        for i, doc_id, scores in cached:
+            doc = self.vectorstores[i].docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                return None
+            docs.append(Document(page_content=doc.page_content, metadata={**doc.metadata, **scores}))
+        return docs
+
+    def _finish(self, key, ranked: List[Tuple[int, str, Document]], complete: bool) -> List[Document]:
+        """Guarda o ranking no cache (só buscas completas) e devolve os documentos."""
+        if key and complete:
+            retrieval_cache.put(key, [
+                (i, doc_id, {c: doc.metadata[c] for c in ("score", "rrf") if c in doc.metadata})
+                for i, doc_id, doc in ranked
+            ])
+        return [doc for _, _, doc in ranked]
+
+    def _lexical_stores(self, allowed: Dict[int, Optional[Set[str]]]) -> List[int]:
+        """Índices com busca lexical; com filtro, só os que sabem restringi-la (índice de metadados)."""
+        if not self.hybrid:
+            return []
+        return [i for i, store in enumerate(self.vectorstores)
+                if hasattr(store.docstore, "lexical_search") and (allowed[i] is not None or not self.filtro)]
+
+    def _embedding_groups(self):
+        """Agrupa os índices por modelo de embeddings, para vetorizar a pergunta uma vez por modelo."""
+        groups = {}
+        for i, store in enumerate(self.vectorstores):
+            embeddings = store.embeddings
+            model = getattr(embeddings, "model_name", None) or id(embeddings)
+            groups.setdefault(model, (model, embeddings, []))[2].append(i)
+        return list(groups.values())
+
+    def _check_dimension(self, store, vector) -> bool:
+        if store.index.d != len(vector):
+            logging.error(f"[ERRO] Dimensão da pergunta ({len(vector)}) difere do índice ({store.index.d})")
+            return False
+        return True
 
-    def get_relevant_documents(self, query: str) -> List[Document]:
-        all_docs = []
-        for retriever in self.retrievers:
+    def _allowed_ids(self) -> Dict[int, Optional[Set[str]]]:
+        """
+        chunk_ids permitidos pelo filtro em cada índice com índice de metadados
+        (None = sem restrição prévia; com filtro, ele é aplicado após a busca).
+        """
+        allowed = {}
+        for i, store in enumerate(self.vectorstores):
+            if self.filtro and hasattr(store.docstore, "filter_ids"):
+                allowed[i] = store.docstore.filter_ids(self.filtro)
+            else:
+                allowed[i] = None
+        return allowed
+
+    def _search(self, store, vector, allowed: Optional[Set[str]]) -> List[Tuple[float, Document, str]]:
+        if allowed is not None:
+            return _normalize(store, _search_allowed(store, vector, _positions(store, allowed), self.k))
+        if self.filtro:
+            results = _search_dense(store, vector, self.k, _metadata_matcher(self.filtro), fetch_k=self.k * 20)
+            return _normalize(store, results)
+        return _normalize(store, _search_dense(store, vector, self.k))
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        key = self._cache_key(query)
+        cached = self._from_cache(key)
+        if cached is not None:
+            return cached
+
+        futures = {}
+        allowed = self._allowed_ids()
+        # A busca lexical começa antes, em paralelo com a vetorização da pergunta
+        for i in self._lexical_stores(allowed):
+            lexical_search = self.vectorstores[i].docstore.lexical_search
+            futures[_executor.submit(lexical_search, query, self.k, allowed[i])] = ("lexical", i)
+        for _, embeddings, indices in self._embedding_groups():
+            vector = embed_query(embeddings, query)
+            for i in indices:
+                store = self.vectorstores[i]
+                if self._check_dimension(store, vector):
+                    futures[_executor.submit(self._search, store, vector, allowed[i])] = ("denso", i)
+        done, pending = wait(futures, timeout=self.timeout)
+
+        for future in pending:
+            logging.warning(f"[TIMEOUT] Busca {futures[future]} excedeu {self.timeout}s")
+            future.cancel()
+
+        dense, lexical = {}, {}
+        complete = not pending
+        for future in done:
+            kind, i = futures[future]
             try:
-                docs = retriever.get_relevant_documents(query)
-                all_docs.extend(docs)
+                (dense if kind == "denso" else lexical)[i] = future.result()
             except Exception as e:
-                print(f"[ERRO] Retriever falhou: {e}")
-        return all_docs[:self.k]
+                complete = False
+                logging.error(f"[ERRO] Busca {kind} no índice {i} falhou: {e}")
+        return self._finish(key, self._fuse(dense, lexical), complete)
+
+    async def _asearch(self, store, vector, allowed: Optional[Set[str]]) -> List[Tuple[float, Document, str]]:
+        return await asyncio.wait_for(asyncio.to_thread(self._search, store, vector, allowed), self.timeout)
+
+    async def _alexical(self, store, query: str, allowed: Optional[Set[str]]) -> List[Tuple[str, float]]:
+        return await asyncio.wait_for(
+            asyncio.to_thread(store.docstore.lexical_search, query, self.k, allowed), self.timeout
+        )
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return await self.aretrieve(query)
+
+    async def aretrieve(self, query: str, query_vectors: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        Busca assíncrona. `query_vectors` ({modelo: vetor}) traz embeddings da
+        pergunta já calculados, que não são refeitos para os índices desse modelo.
+        """
+        query_vectors = query_vectors or {}
+        key = self._cache_key(query)
+        cached = await asyncio.to_thread(self._from_cache, key)
+        if cached is not None:
+            return cached
+
+        allowed = await asyncio.to_thread(self._allowed_ids)
+        # Tarefas lexicais já disparadas, rodando enquanto a pergunta é vetorizada
+        searches = [
+            (("lexical", i), asyncio.create_task(self._alexical(self.vectorstores[i], query, allowed[i])))
+            for i in self._lexical_stores(allowed)
+        ]
+        for model, embeddings, indices in self._embedding_groups():
+            vector = query_vectors.get(model)
+            if vector is None:
+                vector = await aembed_query(embeddings, query)
+            searches.extend(
+                (("denso", i), self._asearch(self.vectorstores[i], vector, allowed[i])) for i in indices
+                if self._check_dimension(self.vectorstores[i], vector)
+            )
+        results = await asyncio.gather(*(coro for _, coro in searches), return_exceptions=True)
 
-    async def aget_relevant_documents(self, query: str) -> List[Document]:
-        return self.get_relevant_documents(query)
+        dense, lexical = {}, {}
+        complete = True
+        for ((kind, i), _), result in zip(searches, results):
+            if isinstance(result, BaseException):
+                complete = False
+                logging.error(f"[ERRO] Busca {kind} no índice {i} falhou: {result!r}")
+            else:
+                (dense if kind == "denso" else lexical)[i] = result
+        return self._finish(key, self._fuse(dense, lexical), complete)
@@ -0,0 +1,116 @@
+# rag/ann_index.py
+
+import time
+import logging
+
+import faiss
+import numpy as np
+from settings import (
+    IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    INDEX_REPORT_QUERIES, INDEX_REPORT_K
+)
+
+INDEX_TYPES = ["Flat", "IVF-Flat", "HNSW"]
+
+# Só o índice Flat renumera as posições ao remover vetores, como o FAISS.delete
+# do LangChain espera; nos demais, remoções exigem reconstruir o índice.
+IN_PLACE_REMOVAL = {"Flat"}
+
+
+def training_size(index_type):
+    """Quantos vetores acumular antes de criar o índice (IVF precisa treinar os centróides)."""
+    return IVF_NLIST * 39 if index_type == "IVF-Flat" else 0
+
+
+def build_index(index_type, sample, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """Cria o índice do tipo escolhido, treinado com `sample` quando necessário."""
+    dim = sample.shape[1]
+
+    if index_type == "Flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "IVF-Flat":
+        nlist = min(IVF_NLIST, max(1, len(sample) // 39))
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+        index.train(sample)
+        index.nprobe = min(nprobe, nlist)
+        logging.info(f"IVF treinado com {len(sample)} vetores e {nlist} centróides")
+        return index
+
+    if index_type == "HNSW":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = ef_search
+        return index
+
+    raise ValueError(f"Tipo de índice desconhecido: {index_type}")
+
+
+def tune_index(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """Ajusta os parâmetros de busca (gravados junto com o index.faiss)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def _exact_search(index, queries, k, block=20000):
+    """Top-k exato percorrendo os vetores do índice em blocos (memória limitada)."""
+    best_d = np.full((len(queries), k), np.inf, dtype="float32")
+    best_i = np.full((len(queries), k), -1, dtype="int64")
+
+    for start in range(0, index.ntotal, block):
+        xb = index.reconstruct_n(start, min(block, index.ntotal - start))
+        flat = faiss.IndexFlatL2(xb.shape[1])
+        flat.add(xb)
+        d, i = flat.search(queries, min(k, len(xb)))
+        all_d = np.hstack([best_d, d])
+        all_i = np.hstack([best_i, i + start])
+        order = np.argsort(all_d, axis=1)[:, :k]
+        best_d = np.take_along_axis(all_d, order, axis=1)
+        best_i = np.take_along_axis(all_i, order, axis=1)
+    return best_i
+
+
+def recall_report(index, k=INDEX_REPORT_K, n_queries=INDEX_REPORT_QUERIES):
+    """
+    Mede recall@k do índice contra a busca exata (Flat) e a latência por
+    consulta, usando uma amostra dos próprios vetores indexados como perguntas.
+    """
+    total = index.ntotal
+    if total == 0:
+        return {}
+    k = min(k, total)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    try:
+        rng = np.random.default_rng(0)
+        sample_ids = rng.choice(total, size=min(n_queries, total), replace=False)
+        queries = np.vstack([index.reconstruct(int(i)) for i in sample_ids]).astype("float32")
+
+        start = time.perf_counter()
+        exact = _exact_search(index, queries, k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, exact):
+            start = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found[0].tolist()) & set(expected.tolist()))
+    finally:
+        if ivf is not None:
+            ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+
+    return {
+        "vetores": total,
+        "consultas": len(queries),
+        "k": k,
+        f"recall@{k}": hits / (k * len(queries)),
+        "latencia_p50_ms": float(np.percentile(latencies, 50)),
+        "latencia_p95_ms": float(np.percentile(latencies, 95)),
+        "latencia_exata_ms": exact_ms,
+    }
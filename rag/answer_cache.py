@@ -0,0 +1,223 @@
+# rag/answer_cache.py
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+from langchain.schema import Document
+from settings import (
+    ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_HOURS, ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_CALIBRATION_PATH
+)
+from rag.normalizador import normalizar
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS respostas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    escopo TEXT NOT NULL,
+    pergunta TEXT NOT NULL,
+    vetor BLOB NOT NULL,
+    resposta TEXT NOT NULL,
+    fontes TEXT NOT NULL,
+    criado REAL NOT NULL,
+    acessado REAL NOT NULL,
+    acertos INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS respostas_escopo ON respostas (escopo);
+"""
+
+
+def cache_scope(**partes):
+    """
+    Escopo de validade de uma resposta: versões dos índices, hash do prompt,
+    modelo, temperatura e parâmetros de recuperação. Qualquer mudança isola as entradas.
+    """
+    serializado = json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(serializado.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(prompt_text):
+    return hashlib.sha1((prompt_text or "").encode("utf-8")).hexdigest()[:16]
+
+
+_TOKEN_CHAVE = re.compile(r"\w*\d[\w./-]*")
+
+
+def key_tokens(pergunta):
+    """
+    Números e códigos da pergunta (programas, ações, anos, ids). Perguntas que
+    diferem só neles têm embeddings quase iguais, então precisam coincidir
+    exatamente para que uma reaproveite a resposta da outra.
+    """
+    return sorted({normalizar(t).strip("./-") for t in _TOKEN_CHAVE.findall(pergunta or "")} - {""})
+
+
+def _escopo_da_pergunta(escopo, pergunta):
+    return f"{escopo}|{','.join(key_tokens(pergunta))}"
+
+
+_calibracao = {"mtime": None, "dados": {}}  # arquivo de calibração lido, relido só se mudar
+
+
+def _calibration():
+    try:
+        mtime = os.stat(ANSWER_CACHE_CALIBRATION_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if _calibracao["mtime"] != mtime:
+        try:
+            with open(ANSWER_CACHE_CALIBRATION_PATH, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            dados = {}
+        _calibracao.update(mtime=mtime, dados=dados if isinstance(dados, dict) else {})
+    return _calibracao["dados"]
+
+
+def calibrated_threshold(embedding_model):
+    """Limiar calibrado para o modelo de embeddings (rag.calibrate_cache) ou o padrão de settings."""
+    try:
+        return float(_calibration()[embedding_model]["limiar"])
+    except (KeyError, ValueError, TypeError):
+        return ANSWER_CACHE_THRESHOLD
+
+
+class AnswerCache:
+    """
+    Cache semântico de respostas: uma pergunta nova reaproveita a resposta de
+    uma anterior do mesmo escopo se a similaridade de cosseno dos embeddings
+    passar do limiar e os números/códigos das duas forem os mesmos.
+    Persistido em SQLite, com expiração por TTL e LRU.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl_hours=ANSWER_CACHE_TTL_HOURS, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.threshold = threshold
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._matrizes = {}  # escopo -> (ids, matriz de vetores normalizados)
+        self.hits = 0
+        self.misses = 0
+
+    def _matriz(self, escopo):
+        if escopo not in self._matrizes:
+            rows = self._conn.execute(
+                "SELECT id, vetor FROM respostas WHERE escopo = ? AND criado >= ?",
+                (escopo, time.time() - self.ttl)
+            ).fetchall()
+            ids = np.array([r[0] for r in rows], dtype="int64")
+            matriz = np.vstack([np.frombuffer(r[1], dtype="float32") for r in rows]) if rows else None
+            self._matrizes[escopo] = (ids, matriz)
+        return self._matrizes[escopo]
+
+    def lookup(self, escopo, vetor, pergunta, threshold=None):
+        """Resposta em cache mais parecida com `vetor` acima do limiar, com os mesmos códigos de `pergunta`, ou None."""
+        threshold = self.threshold if threshold is None else threshold
+        escopo = _escopo_da_pergunta(escopo, pergunta)
+        consulta = np.asarray(vetor, dtype="float32")
+        consulta = consulta / (np.linalg.norm(consulta) or 1.0)
+
+        with self._lock:
+            ids, matriz = self._matriz(escopo)
+            if matriz is None:
+                self.misses += 1
+                return None
+            similaridades = matriz @ consulta
+            melhor = int(np.argmax(similaridades))
+            if similaridades[melhor] < threshold:
+                self.misses += 1
+                return None
+
+            entrada_id = int(ids[melhor])
+            row = self._conn.execute(
+                "SELECT pergunta, resposta, fontes, criado FROM respostas WHERE id = ?", (entrada_id,)
+            ).fetchone()
+            if row is None or row[3] < time.time() - self.ttl:
+                self._matrizes.pop(escopo, None)
+                self.misses += 1
+                return None
+
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE respostas SET acessado = ?, acertos = acertos + 1 WHERE id = ?",
+                    (time.time(), entrada_id)
+                )
+            self.hits += 1
+
+        fontes = [Document(page_content=f["page_content"], metadata=f["metadata"]) for f in json.loads(row[2])]
+        return {
+            "pergunta_original": row[0],
+            "resposta": row[1],
+            "fontes": fontes,
+            "similaridade": float(similaridades[melhor]),
+        }
+
+    def store(self, escopo, pergunta, vetor, resposta, fontes):
+        escopo = _escopo_da_pergunta(escopo, pergunta)
+        vetor = np.asarray(vetor, dtype="float32")
+        vetor = vetor / (np.linalg.norm(vetor) or 1.0)
+        fontes_json = json.dumps(
+            [{"page_content": d.page_content, "metadata": d.metadata} for d in fontes],
+            ensure_ascii=False, default=str
+        )
+        agora = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO respostas (escopo, pergunta, vetor, resposta, fontes, criado, acessado) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (escopo, pergunta, vetor.tobytes(), resposta, fontes_json, agora, agora)
+                )
+            self._evict()
+            self._matrizes.pop(escopo, None)
+
+    def _evict(self):
+        with self._conn:
+            removidas = self._conn.execute(
+                "DELETE FROM respostas WHERE criado < ?", (time.time() - self.ttl,)
+            ).rowcount
+            excesso = self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - self.max_entries
+            if excesso > 0:
+                removidas += self._conn.execute(
+                    "DELETE FROM respostas WHERE id IN (SELECT id FROM respostas ORDER BY acessado LIMIT ?)",
+                    (excesso,)
+                ).rowcount
+        if removidas:
+            self._matrizes.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            entradas, acertos = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(acertos), 0) FROM respostas"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entradas": entradas,
+            "acertos_acumulados": acertos,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Cache de respostas compartilhado pelo processo."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
@@ -0,0 +1,72 @@
+# rag/async_runtime.py
+
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import ASYNC_MAX_WORKERS, ASYNC_CPU_WORKERS
+
+# Um único event loop por processo, em thread própria, compartilhado por todas as sessões.
+_loop = None
+_lock = threading.Lock()
+
+# Trabalho de CPU (reranker, embeddings) fica num pool separado e limitado,
+# para não disputar threads com as chamadas de E/S do pool padrão do loop.
+_cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="rag-cpu")
+
+_FIM = object()
+
+
+def get_loop():
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="rag-io"))
+                threading.Thread(target=loop.run_forever, name="rag-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro, timeout=None):
+    """Executa a corrotina no loop compartilhado e espera o resultado (para código síncrono)."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def iterate(agen):
+    """
+    Consome um gerador assíncrono no loop compartilhado, entregando os itens
+    na thread chamadora (ex.: o script do Streamlit, que precisa desenhar a tela).
+    """
+    itens = queue.Queue()
+
+    async def produzir():
+        try:
+            async for item in agen:
+                itens.put(item)
+        except BaseException as e:
+            itens.put(e)
+            raise
+        finally:
+            itens.put(_FIM)
+
+    future = asyncio.run_coroutine_threadsafe(produzir(), get_loop())
+    try:
+        while True:
+            item = itens.get()
+            if item is _FIM:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Executa uma função bloqueante de CPU no pool limitado, sem travar o loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_executor, lambda: func(*args, **kwargs))
@@ -0,0 +1,159 @@
+# rag/bench_concurrency.py
+"""
+Benchmark de concorrência do pipeline de perguntas.
+
+Compara QueryEngine.ask (uma thread por sessão, como o Streamlit faz) com
+QueryEngine.aask (todas as sessões no loop compartilhado), no mesmo motor,
+pipeline e configuração, para vários níveis de concorrência, medindo vazão,
+latência e tempo até o primeiro token.
+
+    python -m rag.bench_concurrency ./vectors/vectordb_multilingual_e5_large/indice \
+        --perguntas perguntas.txt --concorrencia 1 4 16 --llm "Ollama (servidor)"
+
+Com --sem-llm mede só a recuperação, retriever.invoke vs. ainvoke (não
+precisa de servidor de LLM).
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from settings import EMBEDDING_OPTIONS, RETRIEVER_TOP_K
+from rag.embeddings import load_embeddings
+from rag.index_registry import get_vectorstore
+from rag.async_runtime import run
+from rag.engine import get_engine, EngineConfig, ChatSession
+from multi_faiss import MultiFAISSRetriever
+
+PERGUNTAS_PADRAO = [
+    "Quais são os programas finalísticos da área de saúde?",
+    "Qual o valor total previsto para o programa de educação básica?",
+    "Quais metas estão associadas à segurança pública?",
+    "Que órgão é responsável pelo programa de infraestrutura rodoviária?",
+]
+
+
+def _consulta_sincrona(retriever, pipeline, config, pergunta):
+    """QueryEngine.ask numa thread (como o Streamlit); sem LLM, só a recuperação."""
+    start = time.perf_counter()
+    if pipeline is None:
+        retriever.invoke(pergunta)
+        return time.perf_counter() - start, None
+    result = get_engine().ask(ChatSession(persist=False), config, pergunta, pipeline=pipeline)
+    return time.perf_counter() - start, result.metricas["ttft"]
+
+
+async def _consulta_assincrona(retriever, pipeline, config, pergunta):
+    """QueryEngine.aask no loop compartilhado, com a mesma sessão efêmera e configuração."""
+    start = time.perf_counter()
+    if pipeline is None:
+        await retriever.ainvoke(pergunta)
+        return time.perf_counter() - start, None
+    result = await get_engine().aask(ChatSession(persist=False), config, pergunta, pipeline=pipeline)
+    return time.perf_counter() - start, result.metricas["ttft"]
+
+
+def bench_sync(retriever, pipeline, config, perguntas, concorrencia):
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        return list(pool.map(lambda p: _consulta_sincrona(retriever, pipeline, config, p), perguntas))
+
+
+async def bench_async(retriever, pipeline, config, perguntas, concorrencia):
+    limite = asyncio.Semaphore(concorrencia)
+
+    async def uma(pergunta):
+        async with limite:
+            return await _consulta_assincrona(retriever, pipeline, config, pergunta)
+
+    return await asyncio.gather(*(uma(p) for p in perguntas))
+
+
+def _resumo(modo, concorrencia, resultados, total, threads):
+    latencias = [r[0] for r in resultados]
+    ttfts = [r[1] for r in resultados if r[1] is not None]
+    return {
+        "modo": modo,
+        "concorrencia": concorrencia,
+        "consultas": len(resultados),
+        "vazao_qps": len(resultados) / total,
+        "latencia_p50_s": float(np.percentile(latencias, 50)),
+        "latencia_p95_s": float(np.percentile(latencias, 95)),
+        "ttft_p50_s": float(np.percentile(ttfts, 50)) if ttfts else None,
+        "threads_max": threads,
+    }
+
+
+def _medir(func, *args):
+    pico = [threading.active_count()]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(0.05):
+            pico[0] = max(pico[0], threading.active_count())
+
+    monitor = threading.Thread(target=amostrar, daemon=True)
+    monitor.start()
+    start = time.perf_counter()
+    resultados = func(*args)
+    total = time.perf_counter() - start
+    parar.set()
+    return resultados, total, pico[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vazão do pipeline síncrono vs. assíncrono")
+    parser.add_argument("indices", nargs="+", help="pastas dos índices FAISS")
+    parser.add_argument("--embedding", default=EMBEDDING_OPTIONS["E5 (multilingual)"])
+    parser.add_argument("--llm", default="Ollama (servidor)")
+    parser.add_argument("--prompt", default="teste")
+    parser.add_argument("--k", type=int, default=RETRIEVER_TOP_K)
+    parser.add_argument("--perguntas", help="arquivo com uma pergunta por linha")
+    parser.add_argument("--repeticoes", type=int, default=4, help="vezes que a lista de perguntas é repetida")
+    parser.add_argument("--concorrencia", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--sem-llm", action="store_true", help="mede só a recuperação")
+    args = parser.parse_args(argv)
+
+    if args.perguntas:
+        with open(args.perguntas, "r", encoding="utf-8") as f:
+            perguntas = [linha.strip() for linha in f if linha.strip()]
+    else:
+        perguntas = PERGUNTAS_PADRAO
+    perguntas = perguntas * args.repeticoes
+
+    # Cache de respostas desligado: toda consulta percorre o pipeline inteiro
+    config = EngineConfig(indices=args.indices, embedding_model=args.embedding, modelo_llm=args.llm,
+                          k=args.k, prompt_name=args.prompt, usar_cache=False)
+    if args.sem_llm:
+        embeddings = load_embeddings(args.embedding)
+        vectorstores = [get_vectorstore(path, embeddings, args.embedding) for path in args.indices]
+        retriever = MultiFAISSRetriever(vectorstores=vectorstores, k=args.k)
+        pipeline = None
+    else:
+        pipeline = get_engine().prepare(config)
+        retriever = pipeline.qa_chain.retriever
+
+    # Aquecimento: carrega modelos e páginas do índice antes de medir
+    _consulta_sincrona(retriever, pipeline, config, perguntas[0])
+
+    print(f"{'modo':<6} {'conc.':>5} {'qps':>7} {'p50 s':>7} {'p95 s':>7} {'ttft s':>7} {'threads':>8}")
+    for concorrencia in args.concorrencia:
+        for modo in ("sync", "async"):
+            if modo == "sync":
+                resultados, total, threads = _medir(bench_sync, retriever, pipeline, config, perguntas, concorrencia)
+            else:
+                resultados, total, threads = _medir(
+                    lambda: run(bench_async(retriever, pipeline, config, perguntas, concorrencia))
+                )
+            r = _resumo(modo, concorrencia, resultados, total, threads)
+            ttft = f"{r['ttft_p50_s']:7.2f}" if r["ttft_p50_s"] is not None else f"{'-':>7}"
+            print(f"{modo:<6} {concorrencia:>5} {r['vazao_qps']:7.2f} {r['latencia_p50_s']:7.2f} "
+                  f"{r['latencia_p95_s']:7.2f} {ttft} {r['threads_max']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+# rag/bench_llm.py
+"""
+Benchmark dos backends de LLM com os mesmos prompts.
+
+Mede o tempo de aquecimento (carga do modelo), o tempo até o primeiro token,
+o tempo total e tokens/s de cada prompt, com o prompt salvo da aplicação e
+um contexto fixo, de forma que o prefixo se repita entre as perguntas (como
+acontece no uso real) e o cache de prefixo do GGUF possa ser aproveitado.
+
+    python -m rag.bench_llm --backends "GGUF (offline)" "Ollama (servidor)" --contexto trecho.txt
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from settings import LLM_MAX_TOKENS
+from rag.llm_loader import load_llm, warm_up
+from rag.prompt import get_prompt
+from rag.bench_concurrency import PERGUNTAS_PADRAO
+
+
+def _medir_prompt(llm, prompt_text):
+    start = time.perf_counter()
+    ttft, tokens = None, 0
+    for _ in llm.stream(prompt_text):
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        tokens += 1
+    total = time.perf_counter() - start
+    geracao = total - (ttft or total)
+    return {
+        "ttft_s": ttft if ttft is not None else total,
+        "total_s": total,
+        "tokens": tokens,
+        "tokens_por_segundo": tokens / geracao if tokens > 1 and geracao > 0 else None,
+    }
+
+
+def bench_backend(backend, prompts, max_tokens):
+    start = time.perf_counter()
+    warm_up(backend)
+    aquecimento = time.perf_counter() - start
+
+    llm = load_llm(backend, temperature=0.0, max_tokens=max_tokens)
+    medidas = [_medir_prompt(llm, p) for p in prompts]
+    velocidades = [m["tokens_por_segundo"] for m in medidas if m["tokens_por_segundo"]]
+    return {
+        "backend": backend,
+        "aquecimento_s": aquecimento,
+        "ttft_primeiro_s": medidas[0]["ttft_s"],
+        "ttft_p50_s": float(np.percentile([m["ttft_s"] for m in medidas[1:] or medidas], 50)),
+        "total_p50_s": float(np.percentile([m["total_s"] for m in medidas], 50)),
+        "tokens_por_segundo": float(np.mean(velocidades)) if velocidades else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara os backends de LLM nos mesmos prompts")
+    parser.add_argument("--backends", nargs="+", default=["GGUF (offline)", "Ollama (servidor)"])
+    parser.add_argument("--prompt", default="teste", help="nome do prompt salvo (com {context} e {question})")
+    parser.add_argument("--contexto", help="arquivo de texto usado como {context} em todas as perguntas")
+    parser.add_argument("--perguntas", help="arquivo com uma pergunta por linha")
+    parser.add_argument("--max-tokens", type=int, default=LLM_MAX_TOKENS or 256)
+    args = parser.parse_args(argv)
+
+    template = get_prompt(args.prompt) or "{context}\n\nPergunta: {question}\nResposta:"
+    contexto = ""
+    if args.contexto:
+        with open(args.contexto, "r", encoding="utf-8") as f:
+            contexto = f.read()
+    perguntas = PERGUNTAS_PADRAO
+    if args.perguntas:
+        with open(args.perguntas, "r", encoding="utf-8") as f:
+            perguntas = [linha.strip() for linha in f if linha.strip()]
+    prompts = [template.format(context=contexto, question=p) for p in perguntas]
+
+    print(f"{'backend':<20} {'carga s':>8} {'1º ttft':>8} {'ttft p50':>9} {'total p50':>10} {'tok/s':>7}")
+    for backend in args.backends:
+        try:
+            r = bench_backend(backend, prompts, args.max_tokens)
+        except Exception as e:
+            print(f"{backend:<20} falhou: {e}")
+            continue
+        velocidade = f"{r['tokens_por_segundo']:7.1f}" if r["tokens_por_segundo"] else f"{'-':>7}"
+        print(f"{backend:<20} {r['aquecimento_s']:8.2f} {r['ttft_primeiro_s']:8.2f} {r['ttft_p50_s']:9.2f} "
+              f"{r['total_p50_s']:10.2f} {velocidade}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
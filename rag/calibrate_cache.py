@@ -0,0 +1,106 @@
+# rag/calibrate_cache.py
+"""
+Calibra o limiar do cache de respostas para um modelo de embeddings.
+
+Mede a similaridade de pares de perguntas equivalentes (paráfrases) e de
+pares parecidos mas com respostas diferentes (quase acertos), e escolhe o
+menor limiar que deixa todos os quase acertos de fora. O resultado fica em
+ANSWER_CACHE_CALIBRATION_PATH, por modelo, e é usado pelo motor no lugar
+de ANSWER_CACHE_THRESHOLD.
+
+    python -m rag.calibrate_cache --modelo "E5 (multilingual)" --pares pares.jsonl
+
+O arquivo de pares tem uma linha JSON por par: {"a": ..., "b": ..., "equivalente": true|false}.
+Sem --pares, usa os pares de PARES_PADRAO.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from settings import EMBEDDING_OPTIONS, ANSWER_CACHE_CALIBRATION_PATH
+from rag.embeddings import load_embeddings
+from rag.answer_cache import key_tokens
+
+# (pergunta a, pergunta b, equivalentes?)
+PARES_PADRAO = [
+    ("Quais são os programas da área de saúde?", "Que programas o PPA prevê para a saúde?", True),
+    ("Qual órgão é responsável pela infraestrutura rodoviária?",
+     "Quem responde pelo programa de rodovias?", True),
+    ("Quais metas estão associadas à segurança pública?", "Quais as metas da segurança pública?", True),
+    ("Qual o valor previsto para educação básica?", "Quanto está previsto para a educação básica?", True),
+    ("Quais os objetivos do programa de saneamento?", "Quais os objetivos do programa de habitação?", False),
+    ("Quais metas estão associadas à segurança pública?", "Quais indicadores medem a segurança pública?", False),
+    ("Qual o valor previsto para educação básica?", "Qual o valor previsto para o ensino superior?", False),
+    ("Quais programas são da Secretaria de Saúde?", "Quais programas são da Secretaria de Educação?", False),
+    ("Qual o público-alvo do programa de assistência social?",
+     "Qual o órgão responsável pelo programa de assistência social?", False),
+]
+
+_MARGEM = 0.005
+
+
+def _similaridades(embeddings, pares):
+    textos = sorted({t for a, b, _ in pares for t in (a, b)})
+    vetores = np.asarray(embeddings.embed_documents(textos), dtype="float32")
+    vetores /= np.linalg.norm(vetores, axis=1, keepdims=True)
+    posicao = {t: i for i, t in enumerate(textos)}
+    return [float(vetores[posicao[a]] @ vetores[posicao[b]]) for a, b, _ in pares]
+
+
+def calibrate(embeddings, pares):
+    """
+    Limiar = maior similaridade entre quase acertos + margem. Pares cujos
+    números/códigos diferem são ignorados, pois o cache já os separa pela chave.
+    Retorna o limiar e quantas paráfrases ele aceita.
+    """
+    pares = [(a, b, eq) for a, b, eq in pares if key_tokens(a) == key_tokens(b)]
+    sims = _similaridades(embeddings, pares)
+    positivos = [s for s, (_, _, eq) in zip(sims, pares) if eq]
+    negativos = [s for s, (_, _, eq) in zip(sims, pares) if not eq]
+    if not positivos or not negativos:
+        raise ValueError("São necessários pares equivalentes e não equivalentes.")
+    limiar = min(max(negativos) + _MARGEM, 1.0)
+    return {
+        "limiar": limiar,
+        "max_negativos": max(negativos),
+        "min_positivos": min(positivos),
+        "recall": sum(s >= limiar for s in positivos) / len(positivos),
+        "pares": len(pares),
+    }
+
+
+def _ler_pares(path):
+    with open(path, "r", encoding="utf-8") as f:
+        registros = [json.loads(linha) for linha in f if linha.strip()]
+    return [(r["a"], r["b"], bool(r["equivalente"])) for r in registros]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibra o limiar do cache de respostas")
+    parser.add_argument("--modelo", default="E5 (multilingual)", choices=list(EMBEDDING_OPTIONS))
+    parser.add_argument("--pares", help="arquivo JSONL com pares {a, b, equivalente}")
+    args = parser.parse_args(argv)
+
+    model_name = EMBEDDING_OPTIONS[args.modelo]
+    pares = _ler_pares(args.pares) if args.pares else PARES_PADRAO
+    resultado = calibrate(load_embeddings(model_name), pares)
+
+    calibracao = {}
+    if os.path.exists(ANSWER_CACHE_CALIBRATION_PATH):
+        with open(ANSWER_CACHE_CALIBRATION_PATH, "r", encoding="utf-8") as f:
+            calibracao = json.load(f)
+    calibracao[model_name] = resultado
+    os.makedirs(os.path.dirname(ANSWER_CACHE_CALIBRATION_PATH) or ".", exist_ok=True)
+    with open(ANSWER_CACHE_CALIBRATION_PATH, "w", encoding="utf-8") as f:
+        json.dump(calibracao, f, ensure_ascii=False, indent=2)
+
+    print(f"limiar {resultado['limiar']:.4f} (quase acertos até {resultado['max_negativos']:.4f}, "
+          f"paráfrases a partir de {resultado['min_positivos']:.4f}, recall {resultado['recall']:.0%})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
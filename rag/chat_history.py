@@ -1,39 +1,327 @@
 # rag/chat_history.py
+"""
+Histórico das sessões de chat.
+
+Cada sessão é um log JSONL só de acréscimo (`<id>.jsonl`): um registro por
+turno, com pergunta, resposta e metadados. O custo de gravar um turno não
+depende do tamanho da conversa, e cada registro sai numa única escrita em
+modo append, de modo que gravadores concorrentes não se misturam. De tempos
+em tempos o log é compactado num registro de snapshot. Entre processos, os
+acréscimos seguram um flock compartilhado do log e a compactação um
+exclusivo (sem fcntl, como no Windows, só um processo deve gravar cada
+sessão). Turnos ainda sem fsync são gravados ao fechar o log, na saída do
+processo e, para sessões que ficam quietas, por uma thread de fundo a cada
+CHAT_FSYNC_INTERVAL. Sessões antigas em `<id>.json` continuam legíveis.
+"""
 
 import os
+import re
 import json
+import time
 import uuid
+import atexit
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+from settings import CHAT_FSYNC_EVERY, CHAT_FSYNC_INTERVAL, CHAT_COMPACT_MIN_RECORDS, CHAT_MAX_OPEN_LOGS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 CHAT_DIR = "./chat_sessions"
 os.makedirs(CHAT_DIR, exist_ok=True)
 
+_SESSION_ID = re.compile(r"[\w-]+", re.ASCII)
+
+_lock = threading.Lock()
+_logs = OrderedDict()   # session_id -> _SessionLog aberto, do menos para o mais recente
+_flusher = None         # thread que faz o fsync pendente das sessões quietas
+
+
 def generate_session_id():
     """Gera um ID único baseado em timestamp e UUID curto."""
     return datetime.now().strftime("%Y%m%d_%H%M%S_") + str(uuid.uuid4())[:8]
 
-def save_chat(session_id, chat_history, metadata=None):
-    """Salva histórico de chat com metadados opcionais."""
-    data = {
+
+def valid_session_id(session_id) -> bool:
+    """IDs de sessão viram nomes de arquivo: só letras, dígitos, '_' e '-'."""
+    return isinstance(session_id, str) and bool(_SESSION_ID.fullmatch(session_id))
+
+
+def _check_id(session_id):
+    if not valid_session_id(session_id):
+        raise ValueError(f"ID de sessão inválido: {session_id!r}")
+    return session_id
+
+
+def _log_path(session_id):
+    return os.path.join(CHAT_DIR, f"{_check_id(session_id)}.jsonl")
+
+
+def _legacy_path(session_id):
+    return os.path.join(CHAT_DIR, f"{_check_id(session_id)}.json")
+
+
+class _SessionLog:
+    """Descritor em append de um log de sessão, com fsync em lote e compactação."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.path = _log_path(session_id)
+        self.lock = threading.Lock()
+        self.fd = None
+        if not os.path.exists(self.path) and os.path.exists(_legacy_path(session_id)):
+            _migrate_legacy(session_id)
+        self._open()
+        # Registros desde o último snapshot e turnos que o snapshot já contém
+        self.records, self.snapshot_turns = _count_records(self.path)
+        self.last_fsync = time.monotonic()
+        self.unsynced = 0
+
+    def _open(self):
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(self.path, flags, 0o644)
+
+    def _replaced(self):
+        try:
+            return os.fstat(self.fd).st_ino != os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _acquire(self, exclusivo=False):
+        """
+        flock do log atual (compartilhado para acrescentar, exclusivo para
+        compactar). Se outro processo trocou o arquivo numa compactação enquanto
+        esperávamos, reabre o novo e tenta de novo, para não escrever no antigo.
+        """
+        while True:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+            if not self._replaced():
+                return
+            self._release()
+            os.close(self.fd)
+            self._open()
+            self.records, self.snapshot_turns = _count_records(self.path)
+
+    def _release(self):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def append(self, record):
+        linha = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self.lock:
+            if self.fd is None:
+                self._open()   # fechado ao sair do LRU enquanto esta thread o usava
+            self._acquire()
+            try:
+                os.write(self.fd, linha)  # uma única escrita por registro
+            finally:
+                self._release()
+            self.records += 1
+            self.unsynced += 1
+            if (self.unsynced >= CHAT_FSYNC_EVERY
+                    or time.monotonic() - self.last_fsync >= CHAT_FSYNC_INTERVAL):
+                self._fsync()
+            if self.records > max(CHAT_COMPACT_MIN_RECORDS, self.snapshot_turns):
+                self._compact()
+
+    def flush_due(self):
+        """fsync dos turnos pendentes há CHAT_FSYNC_INTERVAL ou mais (sessão sem novos acréscimos)."""
+        with self.lock:
+            if self.unsynced and time.monotonic() - self.last_fsync >= CHAT_FSYNC_INTERVAL:
+                self._fsync()
+
+    def _fsync(self):
+        if self.unsynced and self.fd is not None:
+            os.fsync(self.fd)
+            self.unsynced = 0
+        self.last_fsync = time.monotonic()
+
+    def _compact(self):
+        """
+        Reescreve o log como um único snapshot. Só acontece quando o nº de
+        registros desde o último snapshot passa o de turnos que ele contém,
+        o que mantém o custo amortizado por turno constante. O flock exclusivo
+        impede que outro processo acrescente um turno entre a leitura e a troca.
+        """
+        self._acquire(exclusivo=True)
+        try:
+            dados = _replay(self.path)
+            _write_snapshot(self.session_id, dados)
+        finally:
+            self._release()
+        os.close(self.fd)
+        self._open()
+        self.records, self.snapshot_turns = 0, len(dados["turnos"])
+        self.unsynced = 0
+        logging.info(f"🗜️ Log da sessão {self.session_id} compactado ({self.snapshot_turns} turnos)")
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self._fsync()
+                os.close(self.fd)
+                self.fd = None
+
+
+def _write_snapshot(session_id, dados):
+    """Substitui o log da sessão, de forma atômica, por um único registro de snapshot."""
+    snapshot = {
+        "tipo": "snapshot",
         "session_id": session_id,
-        "chat_history": chat_history,
-        "metadata": metadata or {}
+        "chat_history": dados["chat_history"],
+        "metadata": dados["metadata"],
+        "turnos": dados["turnos"],
     }
-    os.makedirs(CHAT_DIR, exist_ok=True)
-    with open(os.path.join(CHAT_DIR, f"{session_id}.json"), "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    path = _log_path(session_id)
+    fd, tmp_path = tempfile.mkstemp(dir=CHAT_DIR, prefix=f".{session_id}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _migrate_legacy(session_id):
+    """Sessão antiga retomada: o conteúdo do `.json` vira o snapshot inicial do log."""
+    with open(_legacy_path(session_id), "r", encoding="utf-8") as f:
+        antigo = json.load(f)
+    metadata = antigo.get("metadata", {})
+    history = antigo.get("chat_history", [])
+    _write_snapshot(session_id, {
+        "chat_history": history,
+        "metadata": metadata,
+        "turnos": [metadata] * (len(history) // 2),
+    })
+
+
+def _count_records(path):
+    registros, turnos = 0, 0
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for linha in f:
+                if linha.startswith('{"tipo": "snapshot"'):
+                    registros, turnos = 0, len(json.loads(linha).get("turnos", []))
+                elif linha.strip():
+                    registros += 1
+    return registros, turnos
+
+
+def _replay(path):
+    """Reconstrói a sessão a partir do log: último snapshot seguido dos turnos posteriores."""
+    chat_history, metadata, turnos = [], {}, []
+    with open(path, "r", encoding="utf-8") as f:
+        for linha in f:
+            if not linha.strip():
+                continue
+            try:
+                registro = json.loads(linha)
+            except json.JSONDecodeError:
+                continue  # última linha incompleta (queda durante a escrita)
+            if registro.get("tipo") == "snapshot":
+                chat_history = [list(item) for item in registro.get("chat_history", [])]
+                metadata = registro.get("metadata", {})
+                turnos = registro.get("turnos", [])
+            elif registro.get("tipo") == "turno":
+                chat_history.append(["user", registro["pergunta"]])
+                chat_history.append(["bot", registro["resposta"]])
+                metadata = registro.get("metadata", {})
+                turnos.append(metadata)
+    return {"chat_history": chat_history, "metadata": metadata, "turnos": turnos}
+
+
+def _flush_loop():
+    while True:
+        time.sleep(CHAT_FSYNC_INTERVAL)
+        with _lock:
+            logs = list(_logs.values())
+        for log in logs:
+            try:
+                log.flush_due()
+            except OSError as e:
+                logging.error(f"Falha ao gravar log da sessão {log.session_id}: {e}")
+
+
+def _session_log(session_id):
+    """Log aberto da sessão; no máximo CHAT_MAX_OPEN_LOGS ficam abertos (os menos usados são fechados)."""
+    global _flusher
+    fechar = []
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="chat-fsync", daemon=True)
+            _flusher.start()
+        log = _logs.get(session_id)
+        if log is None:
+            log = _logs[session_id] = _SessionLog(session_id)
+        _logs.move_to_end(session_id)
+        while len(_logs) > CHAT_MAX_OPEN_LOGS:
+            fechar.append(_logs.popitem(last=False)[1])
+    for antigo in fechar:
+        antigo.close()
+    return log
+
+
+def append_turn(session_id, pergunta, resposta, metadata=None):
+    """Acrescenta um turno (pergunta, resposta e metadados) ao log da sessão."""
+    log = _session_log(session_id)
+    log.append({
+        "tipo": "turno",
+        "session_id": session_id,
+        "pergunta": pergunta,
+        "resposta": resposta,
+        "metadata": metadata or {},
+    })
+    with _lock:
+        ativo = _logs.get(session_id) is log
+    if not ativo:
+        log.close()   # saiu do LRU durante a escrita: não deixa o descritor reaberto para trás
+
+
+def close_all():
+    """Grava o pendente e fecha todos os logs abertos (chamado também na saída do processo)."""
+    with _lock:
+        logs = list(_logs.values())
+        _logs.clear()
+    for log in logs:
+        try:
+            log.close()
+        except OSError as e:
+            logging.error(f"Falha ao gravar log da sessão {log.session_id}: {e}")
+
+
+atexit.register(close_all)
+
 
 def load_chat(session_id):
-    """Carrega uma sessão de chat salva, incluindo metadados."""
-    path = os.path.join(CHAT_DIR, f"{session_id}.json")
+    """Carrega uma sessão de chat salva (log JSONL ou JSON antigo), incluindo metadados."""
+    path = _log_path(session_id)
+    if os.path.exists(path):
+        return {"session_id": session_id, **_replay(path)}
+    path = _legacy_path(session_id)
     if os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     return {}
 
+
 def list_sessions():
-    """Lista todos os arquivos de sessão disponíveis (ordenado decrescente)."""
-    return sorted([
-        fname[:-5] for fname in os.listdir(CHAT_DIR)
-        if fname.endswith(".json")
-    ], reverse=True)
+    """Lista todas as sessões disponíveis, nos dois formatos (ordenado decrescente)."""
+    nomes = set()
+    for fname in os.listdir(CHAT_DIR):
+        if fname.endswith(".jsonl"):
+            nomes.add(fname[:-6])
+        elif fname.endswith(".json"):
+            nomes.add(fname[:-5])
+    return sorted((n for n in nomes if valid_session_id(n)), reverse=True)
@@ -0,0 +1,81 @@
+# rag/cli.py
+"""
+Linha de comando do motor de perguntas.
+
+    python -m rag.cli ./vectors/vectordb_multilingual_e5_large/indice -p "Quais programas atendem a saúde?"
+
+Sem -p, abre uma conversa interativa (linha vazia ou Ctrl+D encerra).
+"""
+
+import sys
+import json
+import argparse
+
+from settings import EMBEDDING_OPTIONS, RETRIEVER_TOP_K, TEMPERATURE
+from rag.engine import get_engine, EngineConfig, ChatSession
+from rag.server import result_to_json
+from rag.chat_history import load_chat, valid_session_id
+
+
+def _perguntar(engine, session, config, pipeline, pergunta, como_json):
+    if como_json:
+        result = engine.ask(session, config, pergunta, pipeline=pipeline)
+        print(json.dumps(result_to_json(session, result), ensure_ascii=False, default=str))
+        return
+
+    result = engine.ask(
+        session, config, pergunta, pipeline=pipeline,
+        on_token=lambda token: print(token, end="", flush=True)
+    )
+    print()
+    for doc in result.fontes:
+        print(f"  📚 {doc.metadata.get('origem', 'desconhecido')}")
+    print(f"  ⏱️ {result.elapsed:.2f}s (primeiro token em {result.metricas['ttft']:.2f}s)"
+          + (" ⚡ cache" if result.cache else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perguntas ao PPA pela linha de comando")
+    parser.add_argument("indices", nargs="+", help="pastas dos índices FAISS")
+    parser.add_argument("-p", "--pergunta", help="pergunta única; sem ela, abre uma conversa interativa")
+    parser.add_argument("--embedding", default=EMBEDDING_OPTIONS["E5 (multilingual)"])
+    parser.add_argument("--llm", default="Ollama (servidor)")
+    parser.add_argument("--prompt", default="teste")
+    parser.add_argument("--k", type=int, default=RETRIEVER_TOP_K)
+    parser.add_argument("--temperatura", type=float, default=TEMPERATURE)
+    parser.add_argument("--filtro", default="", help="ex.: origem=Programa.xls; aba=Plan1|Plan2")
+    parser.add_argument("--sessao", help="continua uma sessão salva")
+    parser.add_argument("--json", action="store_true", help="imprime o resultado como JSON")
+    args = parser.parse_args(argv)
+
+    config = EngineConfig(indices=args.indices, embedding_model=args.embedding, modelo_llm=args.llm,
+                          temperature=args.temperatura, k=args.k, prompt_name=args.prompt, filtro=args.filtro)
+    engine = get_engine()
+    pipeline = engine.prepare(config)
+    for aviso in pipeline.avisos:
+        print(f"⚠️ {aviso}", file=sys.stderr)
+
+    session = ChatSession()
+    if args.sessao and not valid_session_id(args.sessao):
+        parser.error("--sessao aceita só letras, dígitos, '_' e '-'")
+    if args.sessao:
+        history = [tuple(turno) for turno in load_chat(args.sessao).get("chat_history", [])]
+        session = ChatSession(session_id=args.sessao, history=history)
+
+    if args.pergunta:
+        _perguntar(engine, session, config, pipeline, args.pergunta, args.json)
+        return
+
+    print(f"💬 Sessão {session.session_id} (linha vazia encerra)")
+    while True:
+        try:
+            pergunta = input("> ").strip()
+        except EOFError:
+            break
+        if not pergunta:
+            break
+        _perguntar(engine, session, config, pipeline, pergunta, args.json)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+# rag/coalescer.py
+
+import time
+import queue
+import asyncio
+import bisect
+import logging
+import threading
+from concurrent.futures import Future
+
+# Limites superiores dos intervalos dos histogramas
+WAIT_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 250, 1000]
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class _Histogram:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+
+    def add(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+
+    def as_dict(self):
+        rotulos = [f"≤{l}" for l in self.limites] + [f">{self.limites[-1]}"]
+        return dict(zip(rotulos, self.contagens))
+
+
+class MicroBatcher:
+    """
+    Junta pedidos concorrentes de várias sessões num único lote: o primeiro
+    pedido espera até `max_wait_ms` por outros, até `max_batch` itens, e o lote
+    inteiro passa por `batch_fn(itens) -> resultados` numa thread dedicada.
+    """
+
+    def __init__(self, nome, batch_fn, max_batch, max_wait_ms):
+        self.nome = nome
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._fila = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._espera = _Histogram(WAIT_BUCKETS_MS)
+        self._tamanho = _Histogram(BATCH_BUCKETS)
+        self._lotes = 0
+        self._itens = 0
+        threading.Thread(target=self._worker, name=f"lote-{nome}", daemon=True).start()
+        with _registry_lock:
+            _registry.append(self)
+
+    def submit_many(self, itens):
+        """Enfileira os itens e espera todos os resultados, na mesma ordem."""
+        futures = []
+        for item in itens:
+            future = Future()
+            self._fila.put((item, future, time.perf_counter()))
+            futures.append(future)
+        return [f.result() for f in futures]
+
+    def submit(self, item):
+        return self.submit_many([item])[0]
+
+    async def asubmit(self, item):
+        future = Future()
+        self._fila.put((item, future, time.perf_counter()))
+        return await asyncio.wrap_future(future)
+
+    def _worker(self):
+        while True:
+            pedidos = [self._fila.get()]
+            prazo = time.perf_counter() + self.max_wait
+            while len(pedidos) < self.max_batch:
+                restante = prazo - time.perf_counter()
+                try:
+                    pedidos.append(self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            inicio = time.perf_counter()
+            with self._stats_lock:
+                for _, _, chegada in pedidos:
+                    self._espera.add((inicio - chegada) * 1000)
+                self._tamanho.add(len(pedidos))
+                self._lotes += 1
+                self._itens += len(pedidos)
+
+            try:
+                resultados = self.batch_fn([item for item, _, _ in pedidos])
+            except Exception as e:
+                logging.error(f"[ERRO] Lote {self.nome} falhou: {e}")
+                for _, future, _ in pedidos:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), resultado in zip(pedidos, resultados):
+                future.set_result(resultado)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "nome": self.nome,
+                "lotes": self._lotes,
+                "itens": self._itens,
+                "media_por_lote": self._itens / self._lotes if self._lotes else 0.0,
+                "espera_ms": self._espera.as_dict(),
+                "tamanho_lote": self._tamanho.as_dict(),
+            }
+
+
+def batcher_stats():
+    """Histogramas de espera na fila e tamanho de lote de todos os agrupadores do processo."""
+    with _registry_lock:
+        batchers = list(_registry)
+    return [b.stats() for b in batchers]
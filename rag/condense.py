@@ -0,0 +1,133 @@
+# rag/condense.py
+"""
+Separa a pergunta usada na busca do histórico da conversa.
+
+A recuperação recebe uma pergunta autônoma curta (a pergunta atual,
+completada com os termos do turno anterior quando ela depende dele), e o
+prompt recebe o histórico de forma limitada: um resumo acumulado da sessão,
+atualizado só com o turno mais recente, mais a última troca abreviada.
+"""
+
+import re
+
+from settings import (
+    STANDALONE_MODE, SUMMARY_MAX_LINES, SUMMARY_ANSWER_CHARS, HISTORY_LAST_TURN_CHARS
+)
+from rag.normalizador import normalizar, STOPWORDS
+
+# Palavras que indicam que a pergunta depende do turno anterior
+_REFERENCIAS = set("""
+ele ela eles elas dele dela deles delas nele nela neles nelas isso isto aquilo disso disto daquilo
+nisso nisto esse essa esses essas desse dessa desses dessas nesse nessa nesses nessas
+este esta estes estas deste desta destes destas neste nesta mesmo mesma tambem anterior acima
+""".split())
+
+_MIN_TERMOS = 3
+
+_ANO = re.compile(r"(19|20)\d{2}")
+# Palavras que, antes de um número, indicam código (e não ano): "programa 2035"
+_PREFIXOS_CODIGO = {"programa", "acao", "codigo", "projeto", "atividade", "objetivo", "meta"}
+
+_REWRITE_PROMPT = (
+    "Reescreva a última pergunta do usuário como uma pergunta autônoma e curta, "
+    "sem depender da conversa. Responda apenas com a pergunta reescrita.\n\n"
+    "Conversa:\n{historico}\n\nÚltima pergunta: {pergunta}\n\nPergunta autônoma:"
+)
+
+
+def _termos(texto):
+    """Termos de conteúdo: sem stopwords nem as palavras que só remetem ao turno anterior."""
+    return [t for t in re.findall(r"\w+", texto)
+            if normalizar(t) not in STOPWORDS and normalizar(t) not in _REFERENCIAS and len(t) > 2]
+
+
+def _has_code(question: str) -> bool:
+    """Se a pergunta cita um código de programa/ação; anos soltos ("E para 2025?") não contam."""
+    palavras = re.findall(r"\w+", normalizar(question))
+    for i, palavra in enumerate(palavras):
+        if any(c.isdigit() for c in palavra):
+            if not _ANO.fullmatch(palavra) or (i > 0 and palavras[i - 1] in _PREFIXOS_CODIGO):
+                return True
+    return False
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Pergunta que depende do turno anterior: curta (menos de _MIN_TERMOS termos)
+    e com uma referência a ele ("dele", "esse", ... ou começando por "e").
+    Perguntas com código próprio de programa/ação se sustentam.
+    """
+    if _has_code(question):
+        return False
+    palavras = [normalizar(p) for p in re.findall(r"\w+", question)]
+    referencia = any(p in _REFERENCIAS for p in palavras) or palavras[:1] == ["e"]
+    return referencia and len(_termos(question)) < _MIN_TERMOS
+
+
+def _last_user_question(history):
+    for role, msg in reversed(history):
+        if role == "user":
+            return msg
+    return None
+
+
+def standalone_question(question: str, history, llm=None) -> str:
+    """
+    Pergunta autônoma para a recuperação. Perguntas que já se sustentam passam
+    sem mudança; as que dependem do turno anterior são completadas com os termos
+    dele (heurística) ou reescritas pelo LLM (STANDALONE_MODE = "llm").
+    """
+    anterior = _last_user_question(history)
+    if not anterior or not is_follow_up(question):
+        return question
+
+    if STANDALONE_MODE == "llm" and llm is not None:
+        ultima_troca = "\n".join(f"{role}: {msg[:HISTORY_LAST_TURN_CHARS]}" for role, msg in history[-2:])
+        reescrita = llm.invoke(_REWRITE_PROMPT.format(historico=ultima_troca, pergunta=question))
+        reescrita = getattr(reescrita, "content", reescrita).strip()
+        if reescrita:
+            return reescrita.splitlines()[0]
+
+    vistos = {normalizar(t) for t in _termos(question)}
+    extras = []
+    for termo in _termos(anterior):
+        if normalizar(termo) not in vistos:
+            vistos.add(normalizar(termo))
+            extras.append(termo)
+    return f"{question} ({' '.join(extras)})" if extras else question
+
+
+def _first_sentence(texto: str) -> str:
+    texto = " ".join(texto.split())
+    frase = re.split(r"(?<=[.!?])\s", texto, maxsplit=1)[0]
+    return frase[:SUMMARY_ANSWER_CHARS] + ("…" if len(frase) > SUMMARY_ANSWER_CHARS else "")
+
+
+def update_summary(session) -> str:
+    """
+    Resumo acumulado da sessão: cada troca ainda não resumida vira uma linha
+    (pergunta e primeira frase da resposta); as mais antigas saem ao passar
+    de SUMMARY_MAX_LINES. Só o que entrou desde a última chamada é processado.
+    """
+    novas = session.history[session.summarized_turns:]
+    linhas = session.summary.splitlines() if session.summary else []
+    pergunta = None
+    for role, msg in novas:
+        if role == "user":
+            pergunta = msg
+        elif pergunta is not None:
+            linhas.append(f"- {pergunta.strip()} → {_first_sentence(msg)}")
+            pergunta = None
+    # Uma pergunta sem resposta fica para a próxima atualização
+    session.summarized_turns = len(session.history) - (1 if pergunta is not None else 0)
+    session.summary = "\n".join(linhas[-SUMMARY_MAX_LINES:])
+    return session.summary
+
+
+def prompt_question(question: str, session) -> str:
+    """Pergunta do prompt: resumo da conversa e última troca abreviada, depois a pergunta atual."""
+    if not session.history:
+        return question
+    resumo = update_summary(session)
+    ultima = "\n".join(f"{role}: {msg[:HISTORY_LAST_TURN_CHARS]}" for role, msg in session.history[-2:])
+    return f"Resumo da conversa:\n{resumo}\n\nÚltima troca:\n{ultima}\n\nNova pergunta:\n{question}"
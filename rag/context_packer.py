@@ -0,0 +1,148 @@
+# rag/context_packer.py
+
+import logging
+from typing import List, Tuple
+
+from langchain.schema import Document
+from langchain_core.language_models import BaseLanguageModel
+from settings import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET_DEFAULT, CONTEXT_WINDOW, CONTEXT_ANSWER_RESERVE,
+    CHARS_PER_TOKEN, MMR_LAMBDA, DUPLICATE_THRESHOLD
+)
+from rag.normalizador import tokenizar
+
+
+def _has_own_tokenizer(llm) -> bool:
+    """
+    Se o cliente conta tokens com o tokenizador do próprio modelo (LlamaCpp,
+    ChatOpenAI via tiktoken). Os demais, como o OllamaLLM, herdam a contagem
+    padrão do LangChain, que usa o tokenizador do GPT-2 e não serve de medida.
+    """
+    cls = type(llm)
+    return (getattr(cls, "get_num_tokens", None) is not BaseLanguageModel.get_num_tokens
+            or getattr(cls, "get_token_ids", None) is not BaseLanguageModel.get_token_ids)
+
+
+def count_tokens(llm, text: str) -> int:
+    """Tokens do texto no tokenizador do modelo; sem ele, estimativa de CHARS_PER_TOKEN caracteres por token."""
+    if llm is not None and _has_own_tokenizer(llm):
+        try:
+            return llm.get_num_tokens(text)
+        except Exception:
+            pass
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def token_budget(modelo_llm: str, llm=None, overhead: str = "", max_tokens=None) -> int:
+    """
+    Tokens disponíveis para os trechos: o teto do modo, limitado ao que sobra
+    da janela de contexto depois de `overhead` (template, resumo e pergunta)
+    e da reserva para a resposta.
+    """
+    teto = CONTEXT_TOKEN_BUDGET.get(modelo_llm, CONTEXT_TOKEN_BUDGET_DEFAULT)
+    janela = CONTEXT_WINDOW.get(modelo_llm)
+    if janela is None:
+        return teto
+    livre = janela - count_tokens(llm, overhead) - (max_tokens or CONTEXT_ANSWER_RESERVE)
+    return max(0, min(teto, livre))
+
+
+def _truncate(doc: Document, llm, budget: int) -> Document:
+    """Corta o texto do trecho até caber em `budget` tokens."""
+    texto = doc.page_content[:int(budget * CHARS_PER_TOKEN)]
+    while texto and count_tokens(llm, texto) > budget:
+        texto = texto[:int(len(texto) * 0.9)]
+    return Document(page_content=texto, metadata={**doc.metadata, "truncado": True})
+
+
+def _shingles(text: str) -> frozenset:
+    termos = tokenizar(text)
+    return frozenset(zip(termos, termos[1:])) or frozenset(termos)
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _relevance(docs: List[Document]) -> List[float]:
+    """Relevância de 0 a 1: pontuação RRF/densa quando existe, senão a posição no ranking."""
+    n = len(docs)
+    scores = [d.metadata.get("rrf", d.metadata.get("score")) for d in docs]
+    if any(s is None for s in scores):
+        return [1.0 - i / n for i in range(n)]
+    maior, menor = max(scores), min(scores)
+    if maior == menor:
+        return [1.0] * n
+    return [(s - menor) / (maior - menor) for s in scores]
+
+
+def pack_context(docs: List[Document], llm, budget: int,
+                 lambda_mult: float = MMR_LAMBDA,
+                 duplicate_threshold: float = DUPLICATE_THRESHOLD) -> Tuple[List[Document], dict]:
+    """
+    Monta o contexto do prompt dentro de `budget` tokens: descarta trechos
+    quase idênticos a outros já escolhidos, escolhe por MMR (relevância menos
+    redundância, com similaridade de Jaccard entre bigramas de termos) e devolve
+    os escolhidos em ordem de relevância.
+    """
+    if not docs:
+        return [], {"tokens_recuperados": 0, "tokens_contexto": 0, "tokens_economizados": 0,
+                    "trechos_recuperados": 0, "trechos_usados": 0}
+
+    relevancia = _relevance(docs)
+    tokens = [count_tokens(llm, d.page_content) for d in docs]
+    shingles = [_shingles(d.page_content) for d in docs]
+
+    escolhidos, usados = [], 0
+    restantes = list(range(len(docs)))
+    duplicados, grandes = 0, []
+    while restantes:
+        def mmr(i):
+            redundancia = max((_similarity(shingles[i], shingles[j]) for j in escolhidos), default=0.0)
+            return lambda_mult * relevancia[i] - (1 - lambda_mult) * redundancia, redundancia
+
+        melhor = max(restantes, key=lambda i: mmr(i)[0])
+        restantes.remove(melhor)
+        if mmr(melhor)[1] >= duplicate_threshold:
+            duplicados += 1
+            continue
+        if usados + tokens[melhor] > budget:
+            grandes.append(melhor)
+            continue  # não cabe; um trecho menor ainda pode caber
+        escolhidos.append(melhor)
+        usados += tokens[melhor]
+
+    docs = list(docs)
+    total = sum(tokens)
+    truncados = 0
+    if not escolhidos and grandes and budget > 0:
+        # Nenhum trecho coube: o mais relevante entra cortado no orçamento, para não responder sem contexto
+        melhor = max(grandes, key=lambda i: relevancia[i])
+        docs[melhor] = _truncate(docs[melhor], llm, budget)
+        tokens[melhor] = count_tokens(llm, docs[melhor].page_content)
+        grandes.remove(melhor)
+        escolhidos.append(melhor)
+        usados = tokens[melhor]
+        truncados = 1
+        logging.warning(f"✂️ Nenhum trecho cabia no orçamento de {budget} tokens: o mais relevante foi truncado")
+    if grandes:
+        logging.info(f"📦 {len(grandes)} trecho(s) maiores que o orçamento restante ficaram de fora")
+
+    escolhidos.sort(key=lambda i: relevancia[i], reverse=True)
+    stats = {
+        "tokens_recuperados": total,
+        "tokens_contexto": usados,
+        "tokens_economizados": total - usados,
+        "trechos_recuperados": len(docs),
+        "trechos_usados": len(escolhidos),
+        "trechos_duplicados": duplicados,
+        "trechos_grandes_demais": len(grandes),
+        "trechos_truncados": truncados,
+    }
+    logging.info(
+        f"📦 Contexto: {len(escolhidos)}/{len(docs)} trechos, {usados}/{total} tokens "
+        f"({total - usados} economizados, {duplicados} quase duplicados, orçamento {budget})"
+    )
+    return [docs[i] for i in escolhidos], stats
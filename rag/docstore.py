@@ -0,0 +1,397 @@
+# rag/docstore.py
+"""
+Docstore em SQLite para os índices FAISS.
+
+Substitui o index.pkl: os textos e metadados ficam em docstore.sqlite, junto
+com o mapeamento posição FAISS -> chunk_id, e cada documento só é lido do
+disco quando aparece entre os resultados de uma busca.
+
+Também guarda o índice lexical (BM25) dos chunks, usado na busca híbrida, e
+um índice invertido dos campos de METADATA_INDEX_FIELDS, usado nos filtros.
+
+Migração de pastas antigas (index.pkl, ou docstore com índices desatualizados):
+    python -m rag.docstore ./vectors
+"""
+
+import os
+import sys
+import json
+import math
+import heapq
+import pickle
+import shutil
+import sqlite3
+import logging
+import threading
+from collections import Counter
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+from settings import FAISS_MMAP, METADATA_INDEX_FIELDS
+from rag.normalizador import tokenizar, normalizar
+
+DOCSTORE_FILE = "docstore.sqlite"
+BUILD_SUFFIX = ".build"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documentos (id TEXT PRIMARY KEY, conteudo TEXT NOT NULL, metadados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS posicoes (pos INTEGER PRIMARY KEY, id TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS lex_postings (
+    termo TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL, tamanho INTEGER NOT NULL,
+    PRIMARY KEY (termo, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lex_postings_id ON lex_postings (id);
+CREATE TABLE IF NOT EXISTS lex_docs (id TEXT PRIMARY KEY, tamanho INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta_index (
+    campo TEXT NOT NULL, valor TEXT NOT NULL, id TEXT NOT NULL,
+    PRIMARY KEY (campo, valor, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS meta_index_id ON meta_index (id);
+"""
+
+# Versão dos índices auxiliares (lexical e de metadados); docstores mais antigos são reconstruídos
+SCHEMA_VERSION = 2
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore com leitura preguiçosa: uma consulta por documento retornado.
+    Mantém também o índice lexical (BM25) dos mesmos chunks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._lex_stats = None
+        self.metadata_indexed = True   # False em docstores anteriores ao índice de metadados (ver load_faiss)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        if conn.execute("SELECT 1 FROM documentos LIMIT 1").fetchone() is None:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def search(self, search: str):
+        row = self._conn().execute(
+            "SELECT conteudo, metadados FROM documentos WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts):
+        rows = [
+            (doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for doc_id, doc in texts.items()
+        ]
+        conn = self._conn()
+        try:
+            with conn:
+                conn.executemany("INSERT INTO documentos VALUES (?, ?, ?)", rows)
+                self._index_lexical(conn, texts)
+                self._index_metadata(conn, texts)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Tentativa de adicionar ids já existentes: {e}")
+        self._lex_stats = None
+
+    def delete(self, ids):
+        conn = self._conn()
+        params = [(i,) for i in ids]
+        with conn:
+            conn.executemany("DELETE FROM documentos WHERE id = ?", params)
+            conn.executemany("DELETE FROM lex_postings WHERE id = ?", params)
+            conn.executemany("DELETE FROM lex_docs WHERE id = ?", params)
+            conn.executemany("DELETE FROM meta_index WHERE id = ?", params)
+        self._lex_stats = None
+
+    def _index_lexical(self, conn, texts):
+        postings, docs = [], []
+        for doc_id, doc in texts.items():
+            termos = Counter(tokenizar(doc.page_content))
+            tamanho = sum(termos.values())
+            docs.append((doc_id, tamanho))
+            postings.extend((termo, doc_id, tf, tamanho) for termo, tf in termos.items())
+        conn.executemany("INSERT INTO lex_docs VALUES (?, ?)", docs)
+        conn.executemany("INSERT INTO lex_postings VALUES (?, ?, ?, ?)", postings)
+
+    def _index_metadata(self, conn, texts):
+        rows = []
+        for doc_id, doc in texts.items():
+            metadados = {normalizar(str(c)): v for c, v in doc.metadata.items()}
+            for campo in METADATA_INDEX_FIELDS:
+                valor = metadados.get(normalizar(campo))
+                if valor not in (None, ""):
+                    rows.append((normalizar(campo), normalizar(str(valor)), doc_id))
+        conn.executemany("INSERT OR IGNORE INTO meta_index VALUES (?, ?, ?)", rows)
+
+    def schema_version(self):
+        return self._conn().execute("PRAGMA user_version").fetchone()[0]
+
+    def rebuild_search_indexes(self):
+        """Recria os índices lexical e de metadados a partir dos documentos (docstores antigos)."""
+        conn = self._conn()
+        with conn:
+            for tabela in ("lex_postings", "lex_docs", "meta_index"):
+                conn.execute(f"DELETE FROM {tabela}")
+            lote = {}
+            for doc_id, doc in self.iter_documents():
+                lote[doc_id] = doc
+                if len(lote) >= 1000:
+                    self._index_lexical(conn, lote)
+                    self._index_metadata(conn, lote)
+                    lote = {}
+            self._index_lexical(conn, lote)
+            self._index_metadata(conn, lote)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._lex_stats = None
+
+    def filter_ids(self, filtro):
+        """
+        Conjunto de chunk_ids que atendem ao filtro {campo: [valores]} (já
+        normalizados), ou None se o docstore não tem o índice de metadados.
+        """
+        if not self.metadata_indexed:
+            return None
+        permitidos = None
+        for campo, valores in filtro.items():
+            marcadores = ",".join("?" * len(valores))
+            rows = self._conn().execute(
+                f"SELECT id FROM meta_index WHERE campo = ? AND valor IN ({marcadores})", [campo, *valores]
+            ).fetchall()
+            ids = {row[0] for row in rows}
+            permitidos = ids if permitidos is None else permitidos & ids
+            if not permitidos:
+                break
+        return permitidos or set()
+
+    def lexical_search(self, query: str, k: int = 10, allowed=None):
+        """
+        BM25 sobre os termos da pergunta; lê só as listas de postings desses
+        termos. `allowed` restringe o resultado a um conjunto de chunk_ids.
+        """
+        termos = list(set(tokenizar(query)))
+        if not termos:
+            return []
+
+        conn = self._conn()
+        if self._lex_stats is None:
+            total, media = conn.execute("SELECT COUNT(*), AVG(tamanho) FROM lex_docs").fetchone()
+            self._lex_stats = (total, media or 1.0)
+        total, media = self._lex_stats
+        if not total:
+            return []
+
+        marcadores = ",".join("?" * len(termos))
+        rows = conn.execute(
+            f"SELECT termo, id, tf, tamanho FROM lex_postings WHERE termo IN ({marcadores})", termos
+        ).fetchall()
+
+        df = Counter(termo for termo, _, _, _ in rows)
+        scores = Counter()
+        for termo, doc_id, tf, tamanho in rows:
+            if allowed is not None and doc_id not in allowed:
+                continue
+            idf = math.log(1 + (total - df[termo] + 0.5) / (df[termo] + 0.5))
+            scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * tamanho / media))
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM documentos").fetchone()[0]
+
+    def iter_documents(self):
+        """Percorre (id, Document) de todo o docstore, sem materializá-lo inteiro."""
+        cursor = self._conn().execute("SELECT id, conteudo, metadados FROM documentos")
+        for doc_id, conteudo, metadados in cursor:
+            yield doc_id, Document(page_content=conteudo, metadata=json.loads(metadados))
+
+    def load_positions(self):
+        rows = self._conn().execute("SELECT pos, id FROM posicoes").fetchall()
+        return {pos: doc_id for pos, doc_id in rows}
+
+    def save_positions(self, index_to_docstore_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM posicoes")
+            conn.executemany("INSERT INTO posicoes VALUES (?, ?)", list(index_to_docstore_id.items()))
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def __del__(self):
+        # Índices removidos do cache de índices podem seguir em uso por consultas
+        # em andamento: as conexões só fecham quando o último dono o descarta.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def cache_mb(self):
+        """Memória do cache de páginas do SQLite: uma por conexão aberta, limitada ao tamanho do arquivo."""
+        with self._lock:
+            conexoes = len(self._connections)
+            if not conexoes:
+                return 0.0
+            conn = self._connections[0]   # não abre uma conexão nova só para medir
+        paginas = conn.execute("PRAGMA cache_size").fetchone()[0]
+        tamanho_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        # cache_size negativo é em KiB; positivo, em páginas
+        por_conexao = -paginas * 1024 if paginas < 0 else paginas * tamanho_pagina
+        arquivo = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return conexoes * min(por_conexao, arquivo) / (1024 * 1024)
+
+
+def has_docstore(path):
+    return os.path.exists(os.path.join(path, DOCSTORE_FILE))
+
+
+def read_index_mmap(index_file):
+    """
+    Lê o index.faiss mapeado em memória, somente leitura, para que processos
+    diferentes compartilhem as páginas pelo cache do sistema. Se a versão do
+    FAISS não suporta mmap para esse tipo de índice, lê normalmente.
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(index_file, flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        logging.info(f"mmap indisponível para {index_file} ({e}); lendo em memória.")
+        return faiss.read_index(index_file)
+
+
+def load_faiss(path, embeddings, mmap=FAISS_MMAP):
+    """
+    Carrega o índice de `path` para busca (somente leitura): docstore SQLite se
+    existir, senão o index.pkl legado.
+    """
+    index_file = os.path.join(path, "index.faiss")
+    index = read_index_mmap(index_file) if mmap else faiss.read_index(index_file)
+
+    if not has_docstore(path):
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_FILE))
+    if docstore.schema_version() < SCHEMA_VERSION:
+        # Sem o índice invertido, filter_ids devolveria um conjunto vazio e o
+        # filtro não acharia nada: a busca filtra os resultados depois, como nos índices legados
+        docstore.metadata_indexed = False
+        logging.warning(
+            f"Docstore de {path} sem o índice de metadados (versão {docstore.schema_version()} < {SCHEMA_VERSION}); "
+            f"filtros serão aplicados após a busca. Rode `python -m rag.docstore <pasta dos índices>` (migrate_all) "
+            f"para recriá-lo."
+        )
+    return FAISS(embeddings, index, docstore, docstore.load_positions())
+
+
+def open_for_build(path, embeddings):
+    """
+    Abre uma cópia editável do índice para reindexação. As alterações vão para
+    docstore.sqlite.build e só substituem o docstore em uso em save_faiss.
+    """
+    build_path = os.path.join(path, DOCSTORE_FILE + BUILD_SUFFIX)
+    if os.path.exists(build_path):
+        os.remove(build_path)
+
+    if has_docstore(path):
+        shutil.copyfile(os.path.join(path, DOCSTORE_FILE), build_path)
+        index = faiss.read_index(os.path.join(path, "index.faiss"))
+        docstore = SQLiteDocstore(build_path)
+        return FAISS(embeddings, index, docstore, docstore.load_positions())
+
+    legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    return _to_sqlite(legacy, build_path)
+
+
+def new_build_docstore(path):
+    """Docstore vazio para construir um índice do zero."""
+    build_path = os.path.join(path, DOCSTORE_FILE + BUILD_SUFFIX)
+    if os.path.exists(build_path):
+        os.remove(build_path)
+    return SQLiteDocstore(build_path)
+
+
+def _to_sqlite(db, build_path):
+    docstore = SQLiteDocstore(build_path)
+    docs = getattr(db.docstore, "_dict", {})
+    docstore.add(docs)
+    db.docstore = docstore
+    return db
+
+
+def save_faiss(db, path):
+    """Grava index.faiss e promove o docstore de construção a docstore.sqlite."""
+    docstore = db.docstore
+    if not isinstance(docstore, SQLiteDocstore):
+        db = _to_sqlite(db, os.path.join(path, DOCSTORE_FILE + BUILD_SUFFIX))
+        docstore = db.docstore
+
+    docstore.save_positions(db.index_to_docstore_id)
+    docstore.close()
+
+    tmp_index = os.path.join(path, "index.faiss.tmp")
+    faiss.write_index(db.index, tmp_index)
+    os.replace(tmp_index, os.path.join(path, "index.faiss"))
+    os.replace(docstore.path, os.path.join(path, DOCSTORE_FILE))
+
+    legacy = os.path.join(path, "index.pkl")
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+def migrate_folder(path):
+    """Converte o index.pkl de uma pasta em docstore.sqlite (o .pkl vira .pkl.bak)."""
+    legacy = os.path.join(path, "index.pkl")
+    with open(legacy, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    build_path = os.path.join(path, DOCSTORE_FILE + BUILD_SUFFIX)
+    if os.path.exists(build_path):
+        os.remove(build_path)
+    sqlite_store = SQLiteDocstore(build_path)
+    sqlite_store.add(docstore._dict)
+    sqlite_store.save_positions(index_to_docstore_id)
+    sqlite_store.close()
+
+    os.replace(build_path, os.path.join(path, DOCSTORE_FILE))
+    os.replace(legacy, legacy + ".bak")
+    return len(index_to_docstore_id)
+
+
+def migrate_all(root):
+    for folder, _, files in os.walk(root):
+        try:
+            if "index.faiss" in files and "index.pkl" in files and DOCSTORE_FILE not in files:
+                total = migrate_folder(folder)
+                print(f"✅ {folder}: {total} documentos migrados")
+            elif DOCSTORE_FILE in files:
+                store = SQLiteDocstore(os.path.join(folder, DOCSTORE_FILE))
+                if store.schema_version() < SCHEMA_VERSION:
+                    store.rebuild_search_indexes()
+                    print(f"✅ {folder}: índices lexical e de metadados recriados")
+                store.close()
+        except Exception as e:
+            logging.exception(f"Falha ao migrar {folder}")
+            print(f"⚠️ {folder}: {e}")
+
+
+if __name__ == "__main__":
+    migrate_all(sys.argv[1] if len(sys.argv) > 1 else "./vectors")
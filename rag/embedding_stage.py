@@ -0,0 +1,88 @@
+# rag/embedding_stage.py
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from settings import EMBED_BATCH_SIZE, EMBED_WORKERS
+
+CHECKPOINT_DIR = ".checkpoint"
+
+
+def _batch_key(model_name, ids):
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for chunk_id in ids:
+        digest.update(chunk_id.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _batches(chunks, batch_size):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_stream(chunks, embeddings, model_name, vectordb_path, on_progress=None,
+                 batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS):
+    """
+    Vetoriza um iterável de chunks em lotes e devolve (lote, vetores) na ordem
+    de entrada, mantendo no máximo alguns lotes em memória. Cada lote é gravado
+    em disco assim que fica pronto: se a construção for interrompida, a próxima
+    execução reaproveita os lotes já gravados (os chunk_ids são determinísticos).
+    `on_progress(feitos, chunks_por_segundo)` é chamado na thread de quem chamou.
+    """
+    checkpoint_path = os.path.join(vectordb_path, CHECKPOINT_DIR)
+    os.makedirs(checkpoint_path, exist_ok=True)
+
+    def run(batch, file_path):
+        if os.path.exists(file_path):
+            return np.load(file_path), False
+        vectors = np.asarray(embeddings.embed_documents([c.page_content for c in batch]), dtype="float32")
+        tmp_path = file_path + ".tmp.npy"
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, file_path)
+        return vectors, True
+
+    start = time.time()
+    feitos, retomados = 0, 0
+    max_in_flight = max(1, workers) * 2
+    in_flight = deque()
+
+    def collect():
+        nonlocal feitos, retomados
+        batch, future = in_flight.popleft()
+        vectors, computed = future.result()
+        feitos += len(batch)
+        if not computed:
+            retomados += len(batch)
+        if on_progress:
+            on_progress(feitos, (feitos - retomados) / max(time.time() - start, 1e-6))
+        return batch, vectors
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch in _batches(chunks, batch_size):
+            key = _batch_key(model_name, [c.metadata["chunk_id"] for c in batch])
+            file_path = os.path.join(checkpoint_path, f"{key}.npy")
+            in_flight.append((batch, executor.submit(run, batch, file_path)))
+            if len(in_flight) >= max_in_flight:
+                yield collect()
+        while in_flight:
+            yield collect()
+
+    if retomados:
+        logging.info(f"♻️ Retomado do checkpoint: {retomados} chunks já vetorizados.")
+
+
+def clear_checkpoint(vectordb_path):
+    """Remove os lotes gravados depois que o índice foi salvo com sucesso."""
+    shutil.rmtree(os.path.join(vectordb_path, CHECKPOINT_DIR), ignore_errors=True)
@@ -1,8 +1,17 @@
+import threading
+import logging
 from langchain_huggingface import HuggingFaceEmbeddings
 import torch
+from settings import EMBED_QUERY_MAX_BATCH, EMBED_QUERY_MAX_WAIT_MS
+from rag.coalescer import MicroBatcher
 
+# Um modelo residente por nome, compartilhado por todas as sessões e índices do processo.
+_pool = {}
+_lock = threading.Lock()
+_batchers = {}  # id(embeddings) -> (embeddings, agrupador das perguntas)
 
-def load_embeddings(model_name: str):
+
+def _build_embeddings(model_name: str):
     return HuggingFaceEmbeddings(
         model_name=model_name,
         model_kwargs={
@@ -10,3 +19,64 @@ def load_embeddings(model_name: str):
         },
         encode_kwargs={"normalize_embeddings": True}
     )
+
+
+def load_embeddings(model_name: str):
+    """Retorna o modelo de embeddings compartilhado, carregando-o só na primeira chamada."""
+    embeddings = _pool.get(model_name)
+    if embeddings is not None:
+        return embeddings
+
+    with _lock:
+        if model_name not in _pool:
+            logging.info(f"📦 Carregando modelo de embeddings: {model_name}")
+            _pool[model_name] = _build_embeddings(model_name)
+        return _pool[model_name]
+
+
+def query_batcher(embeddings):
+    """Agrupador que junta as perguntas simultâneas de todas as sessões num único forward."""
+    entry = _batchers.get(id(embeddings))
+    if entry is None:
+        with _lock:
+            entry = _batchers.get(id(embeddings))
+            if entry is None:
+                nome = getattr(embeddings, "model_name", None) or type(embeddings).__name__
+                batcher = MicroBatcher(f"embeddings:{nome}", embeddings.embed_documents,
+                                       EMBED_QUERY_MAX_BATCH, EMBED_QUERY_MAX_WAIT_MS)
+                entry = _batchers[id(embeddings)] = (embeddings, batcher)
+    return entry[1]
+
+
+def embed_query(embeddings, text):
+    """Vetoriza uma pergunta passando pelo agrupador (bloqueia a thread chamadora)."""
+    return query_batcher(embeddings).submit(text)
+
+
+async def aembed_query(embeddings, text):
+    return await query_batcher(embeddings).asubmit(text)
+
+
+def preload_embeddings(model_names):
+    """Carrega antecipadamente os modelos indicados (ex.: na inicialização do app)."""
+    for model_name in model_names:
+        try:
+            load_embeddings(model_name)
+        except Exception as e:
+            logging.error(f"Falha ao pré-carregar embeddings {model_name}: {e}")
+
+
+def _model_ram_mb(embeddings):
+    client = getattr(embeddings, "_client", None)
+    if client is None:
+        return 0.0
+    total = sum(p.numel() * p.element_size() for p in client.parameters())
+    total += sum(b.numel() * b.element_size() for b in client.buffers())
+    return total / (1024 * 1024)
+
+
+def loaded_embeddings_report():
+    """Lista os modelos de embeddings residentes e a memória ocupada pelos pesos."""
+    with _lock:
+        items = list(_pool.items())
+    return [{"modelo": name, "ram_mb": _model_ram_mb(emb)} for name, emb in items]
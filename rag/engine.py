@@ -0,0 +1,256 @@
+# rag/engine.py
+"""
+Motor de perguntas independente do Streamlit.
+
+Toda a configuração chega por `EngineConfig` e o estado da conversa por
+`ChatSession`; o mesmo motor atende a interface web, o servidor HTTP
+(rag.server) e a linha de comando (rag.cli).
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import (
+    EMBEDDING_OPTIONS, RETRIEVER_TOP_K, TEMPERATURE, ANSWER_CACHE_ENABLED, LLM_MAX_TOKENS
+)
+from rag.embeddings import load_embeddings, aembed_query
+from rag.index_registry import get_vectorstore, index_version
+from rag.filtros import parse_filter
+from rag.llm_loader import load_llm, is_cold, record_call
+from rag.prompt import get_prompt
+from rag.qa_chain import build_qa_chain, aretrieve_documents, astream_answer
+from rag.reranker_local import rerank_local_reranker
+from rag.answer_cache import get_answer_cache, cache_scope, prompt_hash, calibrated_threshold
+from rag.async_runtime import iterate, run_cpu
+from rag.context_packer import pack_context, token_budget
+from rag.condense import standalone_question, prompt_question
+from rag.chat_history import generate_session_id, append_turn
+from multi_faiss import MultiFAISSRetriever
+
+
+@dataclass
+class EngineConfig:
+    """Parâmetros de uma pergunta (o que antes vinha da barra lateral)."""
+    indices: List[str]
+    embedding_model: str = EMBEDDING_OPTIONS["E5 (multilingual)"]
+    modelo_llm: str = "Ollama (servidor)"
+    temperature: float = TEMPERATURE
+    max_tokens: Optional[int] = LLM_MAX_TOKENS
+    k: int = RETRIEVER_TOP_K
+    prompt_name: str = "teste"
+    filtro: str = ""
+    usar_reranker: bool = False
+    usar_cache: bool = ANSWER_CACHE_ENABLED
+    context_budget: Optional[int] = None   # None = calculado pela janela do modelo (token_budget)
+
+
+@dataclass
+class ChatSession:
+    """Estado de uma conversa: histórico (papel, mensagem), resumo acumulado e últimas fontes usadas."""
+    session_id: str = field(default_factory=generate_session_id)
+    history: List[Tuple[str, str]] = field(default_factory=list)
+    last_contexts: List[Any] = field(default_factory=list)
+    summary: str = ""
+    summarized_turns: int = 0    # mensagens do histórico já incorporadas ao resumo
+    persist: bool = True
+
+
+@dataclass
+class QueryResult:
+    resposta: str
+    fontes: List[Any]            # fontes exibidas (reordenadas, se o reranker estiver ativo)
+    documentos: List[Any]        # fontes recuperadas e entregues ao LLM
+    elapsed: float
+    metricas: Dict[str, Any]
+    cache: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class _Pipeline:
+    qa_chain: Any
+    index_versions: Dict[str, str]
+    avisos: List[str]
+
+
+class QueryEngine:
+
+    def prepare(self, config: EngineConfig) -> _Pipeline:
+        """Monta retriever e cadeia para a configuração; índices e modelos vêm dos caches do processo."""
+        embeddings = load_embeddings(config.embedding_model)
+        vectorstores, versions, avisos = [], {}, []
+        for path in config.indices:
+            if not os.path.exists(os.path.join(path, "index.faiss")):
+                avisos.append(f"Índice FAISS não encontrado em {path}")
+                continue
+            try:
+                vectorstores.append(get_vectorstore(path, embeddings, config.embedding_model))
+                versions[os.path.abspath(path)] = index_version(path)
+            except Exception as e:
+                avisos.append(f"Erro ao carregar índice FAISS em {path}: {e}")
+        if not vectorstores:
+            raise ValueError("Nenhum índice FAISS válido selecionado.")
+
+        retriever = MultiFAISSRetriever(vectorstores=vectorstores, k=config.k, filtro=parse_filter(config.filtro))
+        llm = load_llm(config.modelo_llm, temperature=config.temperature, max_tokens=config.max_tokens)
+        return _Pipeline(build_qa_chain(retriever, llm, config.prompt_name), versions, avisos)
+
+    def answer_scope(self, config: EngineConfig, index_versions: Dict[str, str]) -> str:
+        """Escopo do cache de respostas para a configuração."""
+        return cache_scope(
+            indices=index_versions,
+            prompt=prompt_hash(get_prompt(config.prompt_name)),
+            modelo_llm=config.modelo_llm,
+            temperatura=config.temperature,
+            max_tokens=config.max_tokens,
+            k=config.k,
+            orcamento=config.context_budget,
+            filtro=config.filtro,
+        )
+
+    async def astream(self, session: ChatSession, config: EngineConfig, question: str, pipeline=None):
+        """
+        Responde `question` na conversa `session`, emitindo ("fontes", docs) ao
+        fim da recuperação, ("token", texto) durante a geração e, por último,
+        ("resultado", QueryResult). Atualiza e persiste o histórico da sessão.
+        """
+        pipeline = pipeline or await asyncio.to_thread(self.prepare, config)
+        qa_chain = pipeline.qa_chain
+
+        logging.info(f"Usuário perguntou: {question}")
+        start = time.time()
+
+        # A busca usa uma pergunta autônoma; o prompt recebe o histórico resumido
+        llm = qa_chain.combine_documents_chain.llm_chain.llm
+        busca = await asyncio.to_thread(standalone_question, question, session.history, llm)
+        full_query = prompt_question(question, session)
+        if busca != question:
+            logging.info(f"Pergunta de busca: {busca}")
+
+        # Cache semântico pela pergunta autônoma, só no primeiro turno: nos
+        # seguintes a resposta depende do resumo e da última troca da conversa
+        usar_cache = config.usar_cache and not session.history
+        cached, vetores = None, None
+        if usar_cache:
+            escopo = self.answer_scope(config, pipeline.index_versions)
+            vetor = await aembed_query(load_embeddings(config.embedding_model), busca)
+            cached = await asyncio.to_thread(
+                get_answer_cache().lookup, escopo, vetor, busca, calibrated_threshold(config.embedding_model)
+            )
+            # O retriever reaproveita o embedding em vez de vetorizar a pergunta de novo
+            vetores = {config.embedding_model: vetor}
+
+        tokens, ttft, retrieval_time, contexto = 0, None, None, {}
+        rerank_k = config.k if config.usar_reranker else None
+        if cached:
+            logging.info(f"⚡ Resposta do cache (similaridade {cached['similaridade']:.3f})")
+            resposta = cached["resposta"]
+            documentos = fontes = cached["fontes"]
+            yield "fontes", documentos
+            ttft = time.time() - start
+            yield "token", resposta
+            if rerank_k:
+                fontes = await run_cpu(rerank_local_reranker, busca, documentos, top_k=rerank_k)
+        else:
+            recuperados = await aretrieve_documents(qa_chain, busca, vetores)
+            retrieval_time = time.time() - start
+
+            # Só os trechos que cabem no orçamento, sem quase duplicados, vão para o prompt
+            budget = config.context_budget or token_budget(
+                config.modelo_llm, llm, overhead=(get_prompt(config.prompt_name) or "") + full_query,
+                max_tokens=config.max_tokens
+            )
+            documentos, contexto = await run_cpu(pack_context, recuperados, llm, budget)
+            fontes = documentos
+            yield "fontes", documentos
+
+            # O reranker roda no pool de CPU enquanto o LLM gera
+            rerank = None
+            if rerank_k:
+                rerank = asyncio.create_task(run_cpu(rerank_local_reranker, busca, documentos, top_k=rerank_k))
+
+            partes = []
+            frio = is_cold(config.modelo_llm)
+            inicio_geracao = time.time()
+            async for token in astream_answer(qa_chain, full_query, documentos):
+                if ttft is None:
+                    ttft = time.time() - start
+                    record_call(config.modelo_llm, time.time() - inicio_geracao, frio)
+                partes.append(token)
+                tokens += 1
+                yield "token", token
+            resposta = "".join(partes)
+
+            if rerank:
+                fontes = await rerank
+            if usar_cache:
+                await asyncio.to_thread(get_answer_cache().store, escopo, busca, vetor, resposta, documentos)
+
+        elapsed = time.time() - start
+        geracao = elapsed - (ttft or elapsed)
+        metricas = {
+            "ttft": ttft if ttft is not None else elapsed,
+            "tokens": tokens,
+            "tokens_por_segundo": tokens / geracao if tokens > 1 and geracao > 0 else None,
+            "recuperacao": retrieval_time,
+            "pergunta_busca": busca,
+            **contexto,
+        }
+        logging.info(
+            f"Resposta gerada em {elapsed:.2f}s (primeiro token em {metricas['ttft']:.2f}s, {tokens} tokens)"
+        )
+
+        # Atualizar histórico
+        session.history.append(("user", question))
+        session.history.append(("bot", resposta))
+        session.last_contexts = fontes
+
+        if session.persist:
+            # Metadados para salvamento do chat
+            chat_metadata = {
+                "modelo_llm": config.modelo_llm,
+                "modelo_embedding": config.embedding_model,
+                "retriever_k": config.k,
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "prompt_template": get_prompt(config.prompt_name),
+                "cache": bool(cached),
+                "pergunta_busca": busca,
+                "resumo": session.summary,
+                "elapsed": round(elapsed, 3),
+                "ttft": round(metricas["ttft"], 3),
+                "tokens_por_segundo": round(metricas["tokens_por_segundo"], 2) if metricas["tokens_por_segundo"] else None
+            }
+            await asyncio.to_thread(append_turn, session.session_id, question, resposta, chat_metadata)
+
+        yield "resultado", QueryResult(resposta, fontes, documentos, elapsed, metricas, cached)
+
+    async def aask(self, session: ChatSession, config: EngineConfig, question: str, pipeline=None) -> QueryResult:
+        async for tipo, valor in self.astream(session, config, question, pipeline):
+            if tipo == "resultado":
+                return valor
+
+    def ask(self, session: ChatSession, config: EngineConfig, question: str,
+            on_sources=None, on_token=None, pipeline=None) -> QueryResult:
+        """
+        Versão síncrona para código fora do event loop: roda o pipeline no loop
+        compartilhado e chama `on_sources`/`on_token` na thread chamadora.
+        """
+        resultado = None
+        for tipo, valor in iterate(self.astream(session, config, question, pipeline)):
+            if tipo == "fontes" and on_sources:
+                on_sources(valor)
+            elif tipo == "token" and on_token:
+                on_token(valor)
+            elif tipo == "resultado":
+                resultado = valor
+        return resultado
+
+
+_engine = QueryEngine()
+
+
+def get_engine() -> QueryEngine:
+    return _engine
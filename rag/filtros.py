@@ -0,0 +1,22 @@
+# rag/filtros.py
+
+from rag.normalizador import normalizar
+
+
+def parse_filter(expressao: str) -> dict:
+    """
+    Converte "campo=valor; campo2=valor1|valor2" em {campo: [valores]}.
+    Condições separadas por ';' são combinadas com E; valores separados por
+    '|' com OU. Campos e valores são comparados sem acento e sem caixa.
+    """
+    filtro = {}
+    for condicao in (expressao or "").split(";"):
+        if not condicao.strip():
+            continue
+        if "=" not in condicao:
+            raise ValueError(f"Condição inválida no filtro: '{condicao.strip()}' (use campo=valor)")
+        campo, valores = condicao.split("=", 1)
+        valores = [normalizar(v.strip()) for v in valores.split("|") if v.strip()]
+        if valores:
+            filtro.setdefault(normalizar(campo.strip()), []).extend(valores)
+    return filtro
@@ -0,0 +1,162 @@
+# rag/index_registry.py
+
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from settings import INDEX_CACHE_MAX_MB
+from rag.docstore import load_faiss, DOCSTORE_FILE
+from rag import retrieval_cache
+
+# Arquivos que compõem um índice salvo; qualquer alteração neles muda a versão.
+INDEX_FILES = ("index.faiss", "index.pkl", DOCSTORE_FILE)
+
+_lock = threading.Lock()
+_key_locks = {}
+_indices = OrderedDict()  # (caminho, modelo) -> {"assinatura", "store", "tamanho_mb"}
+
+
+def index_signature(path):
+    """Assinatura (nome, mtime, tamanho) dos arquivos do índice em disco."""
+    signature = []
+    for name in INDEX_FILES:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _version(signature):
+    return hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()[:16]
+
+
+def index_version(path):
+    """Identificador curto da versão em disco do índice (muda a cada reindexação)."""
+    return _version(index_signature(path))
+
+
+def mapped_memory_mb(file_path):
+    """
+    (mapeado, residente) em MB das regiões do processo mapeadas a partir de
+    `file_path`, lidas de /proc/self/smaps. (0, 0) fora do Linux ou sem mmap.
+    """
+    target = os.path.realpath(file_path)
+    mapped_kb, resident_kb, inside = 0, 0, False
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                parts = line.split(None, 5)
+                if "-" in parts[0] and len(parts) >= 5:
+                    inside = len(parts) == 6 and parts[5].rstrip("\n") == target
+                elif inside and parts[0] == "Size:":
+                    mapped_kb += int(parts[1])
+                elif inside and parts[0] == "Rss:":
+                    resident_kb += int(parts[1])
+    except OSError:
+        pass
+    return mapped_kb / 1024, resident_kb / 1024
+
+
+def _heap_mb(path):
+    """Memória própria do índice em disco que é lida inteira (index.pkl e index.faiss sem mmap)."""
+    heap = ["index.pkl"]
+    index_file = os.path.join(path, "index.faiss")
+    if os.path.exists(index_file) and mapped_memory_mb(index_file)[0] == 0:
+        heap.append("index.faiss")
+    return sum(os.path.getsize(os.path.join(path, n)) for n in heap
+               if os.path.exists(os.path.join(path, n))) / (1024 * 1024)
+
+
+def _resident_mb(key, entry):
+    """
+    Memória residente atual do índice: a própria, as páginas mapeadas do
+    index.faiss que estão na memória e o cache de páginas do docstore SQLite.
+    """
+    residente = mapped_memory_mb(os.path.join(key[0], "index.faiss"))[1]
+    cache_mb = getattr(entry["store"].docstore, "cache_mb", None)
+    return entry["tamanho_mb"] + residente + (cache_mb() if cache_mb else 0.0)
+
+
+def _release(entry):
+    # Só descarta o cache de recuperação: o docstore pode seguir em uso por um
+    # retriever ou motor em andamento e fecha sozinho quando for coletado.
+    retrieval_cache.invalidate_version(entry["store"]._versao_indice)
+
+
+def _evict_if_needed():
+    """Remove os índices menos usados até caber no orçamento (mantém ao menos um)."""
+    tamanhos = {key: _resident_mb(key, entry) for key, entry in _indices.items()}
+    total = sum(tamanhos.values())
+    while total > INDEX_CACHE_MAX_MB and len(_indices) > 1:
+        key, entry = _indices.popitem(last=False)
+        _release(entry)
+        total -= tamanhos[key]
+        logging.info(f"♻️ Índice removido do cache (LRU): {key[0]}")
+
+
+def get_vectorstore(path, embeddings, model_name):
+    """
+    Retorna o índice FAISS de `path`, carregando do disco apenas na primeira vez
+    ou quando os arquivos mudaram. Compartilhado por todas as sessões do processo.
+    """
+    key = (os.path.abspath(path), model_name)
+
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        signature = index_signature(path)
+        with _lock:
+            entry = _indices.get(key)
+            if entry and entry["assinatura"] == signature:
+                _indices.move_to_end(key)
+                return entry["store"]
+
+        logging.info(f"📂 Carregando índice FAISS: {path}")
+        store = load_faiss(path, embeddings)
+        # Versão usada nas chaves do cache de recuperação
+        store._versao_indice = _version(signature)
+
+        with _lock:
+            anterior = _indices.get(key)
+            if anterior:
+                # A versão antiga pode seguir em uso por outras sessões; só o cache dela é descartado
+                retrieval_cache.invalidate_version(anterior["store"]._versao_indice)
+            _indices[key] = {
+                "assinatura": signature,
+                "store": store,
+                "tamanho_mb": _heap_mb(path),
+            }
+            _indices.move_to_end(key)
+            _evict_if_needed()
+        return store
+
+
+def invalidate(path):
+    """Descarta do cache todas as entradas do índice em `path` (os arquivos fecham quando deixarem de ser usados)."""
+    abs_path = os.path.abspath(path)
+    with _lock:
+        for key in [k for k in _indices if k[0] == abs_path]:
+            _release(_indices.pop(key))
+
+
+def registry_stats():
+    """Lista os índices carregados (mais recente por último) com memória própria, mapeada, residente e do docstore."""
+    with _lock:
+        items = list(_indices.items())
+    stats = []
+    for key, entry in items:
+        mapeado, residente = mapped_memory_mb(os.path.join(key[0], "index.faiss"))
+        cache_mb = getattr(entry["store"].docstore, "cache_mb", None)
+        stats.append({
+            "caminho": key[0],
+            "modelo": key[1],
+            "tamanho_mb": entry["tamanho_mb"],
+            "mapeado_mb": mapeado,
+            "residente_mapeado_mb": residente,
+            "docstore_cache_mb": cache_mb() if cache_mb else 0.0,
+        })
+    return stats
@@ -1,38 +1,123 @@
 # rag/llm_loader.py
 
 import os
+import time
+import queue
+import logging
+import threading
 from dotenv import load_dotenv
 from langchain_community.llms import LlamaCpp
 from langchain_ollama import OllamaLLM
 from langchain_openai import ChatOpenAI
-from settings import TEMPERATURE, LLM_MODEL, OPENAI_MODEL,LLM_GGUF
-import streamlit as st
+from ollama import Client
+from settings import (
+    TEMPERATURE, LLM_MODEL, OPENAI_MODEL, LLM_GGUF, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, LLM_MAX_TOKENS,
+    GGUF_N_CTX, GGUF_N_BATCH, GGUF_N_THREADS, GGUF_N_GPU_LAYERS, GGUF_USE_MMAP, GGUF_USE_MLOCK,
+    GGUF_PROMPT_CACHE_MB
+)
 
 load_dotenv()
 openai_key = os.getenv("OPENAI_API_KEY")
 
-@st.cache_resource(show_spinner="🔄 Carregando modelo LLM...")
-def load_llm(modelo_llm: str, temperature=0.0):
+# Um cliente por modo de execução, compartilhado pelo processo. Cada pergunta
+# recebe uma cópia rasa (model_copy) com seus parâmetros de geração, que
+# reaproveita as conexões HTTP do cliente base.
+_clients = {}
+_lock = threading.Lock()
+_metrics = {}       # modo -> medições de aquecimento e de chamadas frias/quentes
+_last_use = {}      # modo -> instante da última chamada
+_warming = set()
+_gguf_lock = threading.Lock()
 
+
+_FIM = object()
+
+
+class _LockedLlamaCpp(LlamaCpp):
+    """
+    LlamaCpp compartilhado entre sessões: o modelo llama.cpp não aceita chamadas
+    simultâneas, então cada geração segura o lock do processo até terminar.
+    No streaming, a geração roda numa thread própria que segura o lock e passa
+    os trechos por uma fila: se o consumidor abandona o stream (cliente
+    desconectado, tarefa cancelada), a geração para no próximo trecho e o lock
+    é liberado sem depender da coleta do gerador.
+    """
+
+    def _stream(self, *args, **kwargs):
+        fila = queue.Queue()
+        cancelado = threading.Event()
+        stream = super()._stream
+
+        def gerar():
+            try:
+                with _gguf_lock:
+                    for chunk in stream(*args, **kwargs):
+                        if cancelado.is_set():
+                            break
+                        fila.put(chunk)
+            except BaseException as e:
+                fila.put(e)
+            finally:
+                fila.put(_FIM)
+
+        threading.Thread(target=gerar, name="gguf-geracao", daemon=True).start()
+        try:
+            while True:
+                item = fila.get()
+                if item is _FIM:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            cancelado.set()
+
+    def _call(self, *args, **kwargs):
+        if self.streaming:
+            return super()._call(*args, **kwargs)   # passa por _stream
+        with _gguf_lock:
+            return super()._call(*args, **kwargs)
+
+
+def _build_gguf():
     assert os.path.exists(LLM_GGUF), "Modelo não encontrado!"
 
-    #if modelo_llm == "GGUF (offline)":
-    #    return LlamaCpp(
-    #        model_path=LLM_GGUF,
+    llm = _LockedLlamaCpp(
+        model_path=LLM_GGUF,
+        n_ctx=GGUF_N_CTX,
+        n_batch=GGUF_N_BATCH,
+        n_threads=GGUF_N_THREADS,
+        n_gpu_layers=GGUF_N_GPU_LAYERS,
+        use_mmap=GGUF_USE_MMAP,
+        use_mlock=GGUF_USE_MLOCK,
+        temperature=TEMPERATURE,
+        streaming=True,
+        verbose=False
+    )
+    if GGUF_PROMPT_CACHE_MB:
+        # Reaproveita o KV cache de prefixos já vistos (instruções do prompt, contexto repetido)
+        from llama_cpp import LlamaRAMCache
+        llm.client.set_cache(LlamaRAMCache(capacity_bytes=GGUF_PROMPT_CACHE_MB * 1024 * 1024))
+    return llm
+
+
+# Nome do parâmetro de limite de tokens em cada cliente
+_MAX_TOKENS_FIELD = {OllamaLLM: "num_predict", ChatOpenAI: "max_tokens", _LockedLlamaCpp: "max_tokens"}
+
 
-    #        n_ctx=4096,
-    #        n_batch=64,
-    #        temperature=TEMPERATURE,
-    #        verbose=False
-    #    )
+def _build_client(modelo_llm: str):
 
-    #el
-    if modelo_llm == "Ollama (servidor)":
+    if modelo_llm == "GGUF (offline)":
+        return _build_gguf()
+
+    elif modelo_llm == "Ollama (servidor)":
         base_url = os.getenv("OLLAMA_HOST", "http://localhost:11434")
         return OllamaLLM(
             model=LLM_MODEL,
             base_url=base_url,
-            temperature=TEMPERATURE
+            temperature=TEMPERATURE,
+            num_ctx=OLLAMA_NUM_CTX,
+            keep_alive=OLLAMA_KEEP_ALIVE
         )
 
     elif modelo_llm == "OpenAI (API)":
@@ -46,3 +131,93 @@ def load_llm(modelo_llm: str, temperature=0.0):
 
     else:
         raise ValueError(f"Modelo LLM desconhecido: {modelo_llm}")
+
+
+def get_client(modelo_llm: str):
+    """Cliente base do modo de execução, criado uma única vez por processo."""
+    client = _clients.get(modelo_llm)
+    if client is None:
+        with _lock:
+            if modelo_llm not in _clients:
+                logging.info(f"🔄 Criando cliente LLM: {modelo_llm}")
+                _clients[modelo_llm] = _build_client(modelo_llm)
+            client = _clients[modelo_llm]
+    return client
+
+
+def load_llm(modelo_llm: str, temperature=TEMPERATURE, max_tokens=LLM_MAX_TOKENS):
+    """LLM com os parâmetros de geração desta pergunta, sobre o cliente compartilhado do modo."""
+    client = get_client(modelo_llm)
+    update = {"temperature": TEMPERATURE if temperature is None else temperature}
+    campo = _MAX_TOKENS_FIELD.get(type(client))
+    if max_tokens and campo:
+        update[campo] = max_tokens
+    return client.model_copy(update=update)
+
+
+def warm_up(modelo_llm: str):
+    """
+    Aquece o modo de execução: cria o cliente (no GGUF, carrega o modelo no
+    processo) e, no Ollama, carrega o modelo na memória do servidor (prompt
+    vazio) para que a primeira pergunta não pague a carga. O tempo gasto fica registrado como latência fria.
+    """
+    start = time.perf_counter()
+    client = get_client(modelo_llm)   # no GGUF, a carga do modelo acontece aqui
+    if isinstance(client, OllamaLLM):
+        # Mesmo num_ctx das perguntas; com outro valor o servidor recarregaria o modelo
+        Client(host=client.base_url).generate(
+            model=client.model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE, options={"num_ctx": OLLAMA_NUM_CTX}
+        )
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _metrics.setdefault(modelo_llm, {})["aquecimento_s"] = elapsed
+        _last_use[modelo_llm] = time.time()
+    logging.info(f"🔥 LLM aquecido ({modelo_llm}) em {elapsed:.2f}s")
+
+
+def warm_up_async(model_names):
+    """Aquece os modos indicados em segundo plano, uma vez por processo."""
+    def run(modelo_llm):
+        try:
+            warm_up(modelo_llm)
+        except Exception as e:
+            logging.error(f"Falha ao aquecer LLM {modelo_llm}: {e}")
+
+    with _lock:
+        pendentes = [m for m in model_names if m not in _warming]
+        _warming.update(pendentes)
+    for modelo_llm in pendentes:
+        threading.Thread(target=run, args=(modelo_llm,), name=f"aquecer-{modelo_llm}", daemon=True).start()
+
+
+def is_cold(modelo_llm: str) -> bool:
+    """Se a próxima chamada provavelmente encontrará o modelo descarregado (nunca usado ou ocioso além do keep-alive)."""
+    last = _last_use.get(modelo_llm)
+    if last is None:
+        return True
+    return isinstance(_clients.get(modelo_llm), OllamaLLM) and time.time() - last > OLLAMA_KEEP_ALIVE
+
+
+def record_call(modelo_llm: str, ttft: float, cold: bool):
+    """Registra o tempo até o primeiro token de uma chamada, separando frias de quentes."""
+    tipo = "fria" if cold else "quente"
+    with _lock:
+        stats = _metrics.setdefault(modelo_llm, {})
+        stats[f"chamadas_{tipo}s"] = stats.get(f"chamadas_{tipo}s", 0) + 1
+        stats[f"ttft_{tipo}_total_s"] = stats.get(f"ttft_{tipo}_total_s", 0.0) + ttft
+        _last_use[modelo_llm] = time.time()
+
+
+def llm_report():
+    """Por modo: tempo de aquecimento e TTFT médio das chamadas frias e quentes."""
+    with _lock:
+        items = {m: dict(s) for m, s in _metrics.items()}
+    report = []
+    for modelo_llm, stats in items.items():
+        linha = {"modelo": modelo_llm, "aquecimento_s": stats.get("aquecimento_s")}
+        for tipo in ("fria", "quente"):
+            n = stats.get(f"chamadas_{tipo}s", 0)
+            linha[f"chamadas_{tipo}s"] = n
+            linha[f"ttft_{tipo}_medio_s"] = stats[f"ttft_{tipo}_total_s"] / n if n else None
+        report.append(linha)
+    return report
@@ -0,0 +1,258 @@
+# rag/loaders.py
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+from langchain_community.document_loaders import (
+    TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader,
+    UnstructuredExcelLoader, UnstructuredHTMLLoader
+)
+from langchain.schema import Document
+from settings import LOADER_WORKERS, LOADER_TIMEOUT
+
+READ_BLOCK = 64 * 1024
+
+# Formatos de parsing pesado (CPU), lidos em processos próprios
+PARALLEL_EXTENSIONS = {".pdf", ".txt", ".docx", ".xlsx", ".html"}
+
+# Sem fork: o processo pai já tem threads (loop assíncrono, agrupadores,
+# torch) e locks de logging que, copiados no meio do uso, travam o filho
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _row_to_document(linha):
+    if not isinstance(linha, dict):
+        return Document(page_content=str(linha), metadata={})
+    texto = linha.get("text", "")
+    if not texto:
+        texto = " ".join(str(v) for v in linha.values() if isinstance(v, (str, int, float)))
+    metadados = linha.get("metadata", {})
+    return Document(page_content=texto, metadata=metadados)
+
+
+def _iter_json_array(f):
+    """Percorre um array JSON item a item, sem carregar o arquivo inteiro."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(READ_BLOCK)
+    pos = buffer.index("[") + 1
+    eof = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            if end == len(buffer) and not eof:
+                raise json.JSONDecodeError("item pode continuar no próximo bloco", buffer, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Item incompleto: descarta o que já foi lido e busca mais dados
+            more = f.read(READ_BLOCK)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+        yield item
+        pos = end
+        if pos > READ_BLOCK:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def _opens_multiline_object(line):
+    """Primeira linha de um objeto JSON formatado em várias linhas ('{' sozinho ou linha que continua)."""
+    line = line.strip()
+    return line == "{" or (line.startswith("{") and line.endswith(("{", "[", ",", ":")))
+
+
+def iter_json_documents(file, log):
+    """
+    Lê .json/.jsonl de forma preguiçosa. O formato é detectado pelo primeiro
+    caractere: '[' é um array JSON; '{' é tratado como JSONL, e o arquivo só é
+    lido como um único objeto se tiver uma linha só ou se a primeira linha abrir
+    um objeto formatado em várias linhas. Linhas JSONL inválidas são puladas.
+    """
+    filename = os.path.basename(file)
+    with open(file, "r", encoding="utf-8-sig") as f:
+        head = f.read(READ_BLOCK).lstrip()[:1]
+        f.seek(0)
+
+        if head == "[":
+            for linha in _iter_json_array(f):
+                yield _row_to_document(linha)
+            return
+
+        first_line = f.readline()
+        while first_line and not first_line.strip():
+            first_line = f.readline()
+        try:
+            json.loads(first_line)
+        except json.JSONDecodeError:
+            # Objeto único (em uma linha ou formatado em várias); senão é JSONL
+            # com a primeira linha inválida, tratada como as demais
+            if _opens_multiline_object(first_line) or not any(line.strip() for line in f):
+                f.seek(0)
+                yield _row_to_document(json.load(f))
+                return
+
+        f.seek(0)
+        for idx, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield _row_to_document(json.loads(line))
+                except Exception as e:
+                    log(f"⚠️ Linha {idx} inválida em `{filename}`: {e}")
+
+
+def load_file(file, log):
+    """Documents de um arquivo (lista ou iterador); None se a extensão não é suportada."""
+    ext = os.path.splitext(file)[1].lower()
+    filename = os.path.basename(file)
+
+    if ext == ".pdf":
+        return PyPDFLoader(file).load()
+
+    elif ext == ".txt":
+        return TextLoader(file, encoding="utf-8").load()
+
+    elif ext == ".docx":
+        return UnstructuredWordDocumentLoader(file).load()
+
+    elif ext == ".xlsx":
+        return UnstructuredExcelLoader(file).load()
+
+    elif ext == ".html":
+        return UnstructuredHTMLLoader(file).load()
+
+    elif ext in [".json", ".jsonl"]:
+        log(f"📑 Lendo `{filename}`...")
+        return iter_json_documents(file, log)
+
+    return None
+
+
+def _load_in_worker(conn, file):
+    """Processo de leitura de um arquivo: devolve (documentos, erro) pelo pipe."""
+    try:
+        resultado = (load_file(file, logging.info), None)
+    except Exception as e:
+        resultado = (None, e)
+    try:
+        conn.send(resultado)
+    except Exception as e:  # documentos ou exceção que não passam pelo pickle
+        conn.send((None, RuntimeError(f"{type(e).__name__}: {e}")))
+    finally:
+        conn.close()
+
+
+class _FileTask:
+    """Um arquivo lido num processo próprio; o tempo limite conta a partir do início da leitura."""
+
+    def __init__(self, file):
+        self.file = file
+        self.process = None
+        self.conn = None
+        self.inicio = None
+        self.resultado = None   # (documentos, erro) quando termina
+
+    def start(self):
+        self.conn, filho = _MP_CONTEXT.Pipe(duplex=False)
+        self.process = _MP_CONTEXT.Process(target=_load_in_worker, args=(filho, self.file), daemon=True)
+        self.process.start()
+        filho.close()
+        self.inicio = time.monotonic()
+
+    def receive(self):
+        try:
+            self.resultado = self.conn.recv()
+        except EOFError:
+            self.process.join(1)
+            self.resultado = (None, RuntimeError(f"processo de leitura encerrou (código {self.process.exitcode})"))
+        self._finish()
+
+    def kill(self, erro):
+        self.process.kill()
+        self.resultado = (None, erro)
+        self._finish()
+
+    def _finish(self):
+        self.conn.close()
+        self.process.join(5)
+
+
+def iter_loaded_files(files, log, workers=LOADER_WORKERS, timeout=LOADER_TIMEOUT):
+    """
+    Gera (arquivo, documentos, erro) na ordem de `files`. Os formatos de
+    PARALLEL_EXTENSIONS são lidos em processos próprios, no máximo `workers`
+    ao mesmo tempo e com alguns arquivos adiantados. Cada um tem `timeout`
+    segundos desde o início da sua leitura: um arquivo que trava é encerrado
+    (só o processo dele) e conta como falha só dele. JSON/JSONL seguem em
+    streaming no processo atual.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = 2 * workers
+    queue = deque()        # arquivos na ordem de entrega: _FileTask ou None (leitura local)
+    waiting = deque()      # tarefas ainda não iniciadas
+    running = []
+    remaining = iter(files)
+
+    def refill():
+        while len(queue) < max_in_flight:
+            file = next(remaining, None)
+            if file is None:
+                return
+            task = _FileTask(file) if os.path.splitext(file)[1].lower() in PARALLEL_EXTENSIONS else None
+            queue.append((file, task))
+            if task:
+                waiting.append(task)
+
+    def start_waiting():
+        while waiting and len(running) < workers:
+            task = waiting.popleft()
+            task.start()
+            running.append(task)
+
+    def advance(wait_for):
+        """Inicia tarefas até `workers`, recolhe as que terminaram e encerra as que estouraram o tempo."""
+        start_waiting()
+        while wait_for.resultado is None:
+            agora = time.monotonic()
+            for task in [t for t in running if agora - t.inicio >= timeout]:
+                task.kill(TimeoutError(f"tempo limite de {timeout}s excedido"))
+                running.remove(task)
+            if wait_for.resultado is not None:
+                break
+            prazo = min(t.inicio + timeout for t in running) - agora
+            for conn in wait([t.conn for t in running], timeout=max(prazo, 0)):
+                task = next(t for t in running if t.conn is conn)
+                task.receive()
+                running.remove(task)
+            start_waiting()
+
+    try:
+        refill()
+        while queue:
+            file, task = queue.popleft()
+            if task is None:
+                try:
+                    docs, erro = load_file(file, log), None
+                except Exception as e:
+                    docs, erro = None, e
+            else:
+                advance(task)
+                docs, erro = task.resultado
+            yield file, docs, erro
+            refill()
+    finally:
+        # Encerra leituras ainda em andamento (ex.: consumidor interrompido)
+        for task in running:
+            task.kill(None)
@@ -1,3 +1,6 @@
+import re
+import unicodedata
+
 def normalize_query(text: str) -> str:
     """
     Normaliza sinônimos comuns para melhorar recuperação semântica.
@@ -6,3 +9,53 @@ def normalize_query(text: str) -> str:
     #text = text.replace("pecuária", "agropecuária")
     #text = text.replace("desenvolvimento sustentável", "sustentabilidade")
     return text
+
+def normalizar(texto: str) -> str:
+    """Remove acentos e coloca em minúsculas (mesma regra dos conversores)."""
+    return unicodedata.normalize("NFKD", texto).encode("ASCII", "ignore").decode("ASCII").lower()
+
+STOPWORDS = set("""
+a ao aos as com como da das de do dos e em entre na nas no nos o os ou para pela pelas pelo pelos
+por qual quais que se sem seu sua seus suas sobre um uma umas uns ja nao mais muito tambem ser sao
+foi esta estao este esse essa isso isto ate passage query
+""".split())
+
+# Plural -> singular, aplicado antes dos sufixos derivacionais
+PLURAIS = [("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ns", "m")]
+_PLURAIS_LONGOS = {"ais", "eis"}
+
+# Sufixos derivacionais, do mais longo para o mais curto
+SUFIXOS = [
+    "amento", "imento", "idade", "mente", "acao", "icao", "ismo", "ista",
+    "avel", "ivel", "ador", "edor",
+]
+
+def stem(token: str) -> str:
+    """Stemmer leve para português (plural, sufixo derivacional e vogal final), mantendo ao menos 3 letras."""
+    if token.isdigit() or len(token) <= 3:
+        return token
+
+    for plural, singular in PLURAIS:
+        if token.endswith(plural):
+            # -ais/-eis curtos são em geral singulares (país, mais): ficam como estão
+            if plural in _PLURAIS_LONGOS and len(token) <= len(plural) + 3:
+                break
+            token = token[:-len(plural)] + singular
+            break
+    else:
+        if token.endswith("es") and len(token) > 4 and token[-3] in "rsz":
+            token = token[:-2]
+        elif token.endswith("s"):
+            token = token[:-1]
+
+    for sufixo in SUFIXOS:
+        if token.endswith(sufixo) and len(token) - len(sufixo) >= 3:
+            return token[:-len(sufixo)]
+
+    if token[-1] in "aeo" and len(token) > 4:
+        token = token[:-1]
+    return token
+
+def tokenizar(texto: str) -> list:
+    """Termos para o índice lexical: sem acento, sem stopwords, com stemming; números são mantidos."""
+    return [stem(t) for t in re.findall(r"[a-z0-9]+", normalizar(texto)) if t not in STOPWORDS]
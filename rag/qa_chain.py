@@ -3,12 +3,10 @@
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from rag.prompt import get_prompt
-import streamlit as st
-from rag.reranker_local import LocalReranker
+from rag.reranker_local import get_reranker
 
-def rerank_documents(query, docs):
-    reranker = LocalReranker()
-    return reranker.rerank(query, docs, top_k=st.session_state["retriever_k"])
+def rerank_documents(query, docs, top_k):
+    return get_reranker().rerank(query, docs, top_k=top_k)
 
 def build_qa_chain(retriever, llm, prompt_template_name="teste"):
     prompt_text = get_prompt(prompt_template_name)
@@ -29,3 +27,32 @@ def build_qa_chain(retriever, llm, prompt_template_name="teste"):
     )
 
     return chain
+
+def retrieve_documents(qa_chain, query):
+    """Etapa de recuperação da cadeia, isolada para exibir as fontes antes da geração."""
+    return qa_chain.retriever.invoke(query)
+
+def stream_answer(qa_chain, query, docs):
+    """
+    Gera a resposta token a token com o mesmo prompt "stuff" da cadeia.
+    Aceita LLMs de texto (Ollama, que emite str) e de chat (OpenAI, que emite mensagens).
+    """
+    stuff_chain = qa_chain.combine_documents_chain
+    inputs = stuff_chain._get_inputs(docs, question=query)
+    prompt_text = stuff_chain.llm_chain.prompt.format(**inputs)
+    for chunk in stuff_chain.llm_chain.llm.stream(prompt_text):
+        yield getattr(chunk, "content", chunk)
+
+async def aretrieve_documents(qa_chain, query, query_vectors=None):
+    """`query_vectors` ({modelo: vetor}) reaproveita embeddings da pergunta já calculados."""
+    if query_vectors:
+        return await qa_chain.retriever.aretrieve(query, query_vectors)
+    return await qa_chain.retriever.ainvoke(query)
+
+async def astream_answer(qa_chain, query, docs):
+    """Versão assíncrona de stream_answer (astream do Ollama/OpenAI, sem ocupar uma thread por sessão)."""
+    stuff_chain = qa_chain.combine_documents_chain
+    inputs = stuff_chain._get_inputs(docs, question=query)
+    prompt_text = stuff_chain.llm_chain.prompt.format(**inputs)
+    async for chunk in stuff_chain.llm_chain.llm.astream(prompt_text):
+        yield getattr(chunk, "content", chunk)
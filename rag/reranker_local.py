@@ -1,22 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 from langchain.schema import Document
 from typing import List, Tuple
+from settings import RERANKER_MODEL, RERANKER_BATCH_SIZE, RERANKER_CACHE_SIZE, RERANKER_MAX_WAIT_MS
+from rag.coalescer import MicroBatcher
+
+
+def chunk_key(doc: Document) -> str:
+    """Identificador estável do chunk: chunk_id dos metadados ou hash do conteúdo."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return str(chunk_id)
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
 
 class LocalReranker:
-    def __init__(self, model_name="BAAI/bge-reranker-large"):
+    def __init__(self, model_name=RERANKER_MODEL, batch_size=RERANKER_BATCH_SIZE,
+                 cache_size=RERANKER_CACHE_SIZE):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(self.device)
+        self.model.eval()
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (hash da pergunta, chunk_id) -> score
+        self._cache_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        # Pares de sessões simultâneas são pontuados juntos, em lotes de até batch_size
+        self._batcher = MicroBatcher("reranker", self._score_batch, batch_size, RERANKER_MAX_WAIT_MS)
 
     def rerank(self, query: str, docs: List[Document], top_k: int = 5) -> List[Document]:
-        pairs = [(query, doc.page_content) for doc in docs]
-        scores = self._score_pairs(pairs)
+        scores = self.score(query, docs)
         doc_scores = list(zip(docs, scores))
         doc_scores.sort(key=lambda x: x[1], reverse=True)
         return [doc for doc, _ in doc_scores[:top_k]]
 
+    def score(self, query: str, docs: List[Document]) -> List[float]:
+        """Scores de (query, doc), consultando o cache antes de rodar o modelo."""
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        keys = [(query_hash, chunk_key(doc)) for doc in docs]
+        scores = [None] * len(docs)
+
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            computed = self._score_pairs([(query, docs[i].page_content) for i in missing])
+            with self._cache_lock:
+                for i, value in zip(missing, computed):
+                    scores[i] = value
+                    self._cache[keys[i]] = value
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
     def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        # Enfileira em ordem de tamanho para que cada lote tenha pouco padding
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
+        scores = [0.0] * len(pairs)
+        for i, value in zip(order, self._batcher.submit_many([pairs[i] for i in order])):
+            scores[i] = value
+        return scores
+
+    def _score_batch(self, pairs: List[Tuple[str, str]]) -> List[float]:
         encoded = self.tokenizer(
             [q for q, d in pairs],
             [d for q, d in pairs],
@@ -26,12 +79,25 @@ class LocalReranker:
             max_length=512
         ).to(self.device)
 
-        with torch.no_grad():
+        with self._model_lock, torch.no_grad():
             outputs = self.model(**encoded)
             scores = outputs.logits[:, 0].tolist()
         return scores
 
 
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> LocalReranker:
+    """Reranker residente, carregado uma única vez por processo."""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = LocalReranker()
+    return _reranker
+
+
 def rerank_local_reranker(query: str, docs: List[Document], top_k: int = 5) -> List[Document]:
-    reranker = LocalReranker()
-    return reranker.rerank(query, docs, top_k=top_k)
+    return get_reranker().rerank(query, docs, top_k=top_k)
@@ -0,0 +1,59 @@
+# rag/retrieval_cache.py
+
+import re
+import threading
+from collections import OrderedDict
+
+from settings import RETRIEVAL_CACHE_SIZE
+from rag.normalizador import normalizar
+
+# (pergunta normalizada, versões dos índices, k, híbrida, filtro) -> [(índice, id no docstore, pontuações)]
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def normalize_text(query: str) -> str:
+    return re.sub(r"\s+", " ", normalizar(query)).strip()
+
+
+def retrieval_key(query, versions, k, hybrid, filtro):
+    """Chave determinística da recuperação; a versão de cada índice invalida a entrada após reindexação."""
+    filtro_key = tuple(sorted((campo, tuple(sorted(valores))) for campo, valores in (filtro or {}).items()))
+    return (normalize_text(query), tuple(versions), k, hybrid, filtro_key)
+
+
+def get(key):
+    with _lock:
+        value = _entries.get(key)
+        if value is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return value
+
+
+def put(key, value):
+    with _lock:
+        _entries[key] = value
+        _entries.move_to_end(key)
+        while len(_entries) > RETRIEVAL_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate_version(version):
+    """Remove as entradas que usaram a versão `version` de algum índice."""
+    with _lock:
+        for key in [k for k in _entries if version in k[1]]:
+            del _entries[key]
+
+
+def cache_stats():
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": _stats["hits"] / total if total else 0.0,
+            "entradas": len(_entries),
+        }
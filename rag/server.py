@@ -0,0 +1,297 @@
+# rag/server.py
+"""
+Servidor HTTP local do motor de perguntas (sem Streamlit).
+
+    python -m rag.server ./vectors/vectordb_multilingual_e5_large/indice --porta 8502
+
+Rotas:
+    GET  /saude                  -> {"status": "ok"}
+    GET  /metricas               -> caches, agrupadores de lotes e latência fria/quente do LLM
+    GET  /sessoes/<id>           -> histórico da sessão
+    POST /perguntar              -> {"pergunta": "...", "session_id": opcional,
+                                     "config": {campos de EngineConfig}, "stream": false}
+
+Com "stream": true a resposta é NDJSON, um evento por linha:
+{"tipo": "fontes"}, {"tipo": "token"}, ..., {"tipo": "resultado"}; se a
+pergunta falhar depois do início do stream, o último evento é {"tipo": "erro"}.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import EMBEDDING_OPTIONS, VECTORS_FOLDER, SERVER_MAX_SESSIONS, SERVER_SESSION_TTL
+from rag.engine import get_engine, EngineConfig, ChatSession
+from rag.chat_history import load_chat, valid_session_id
+from rag.coalescer import batcher_stats
+from rag.answer_cache import get_answer_cache
+from rag.retrieval_cache import cache_stats
+from rag.llm_loader import warm_up, llm_report
+
+# Campos de EngineConfig que o cliente pode alterar por pergunta
+_CONFIG_FIELDS = {
+    "indices", "embedding_model", "modelo_llm", "temperature", "max_tokens", "k",
+    "prompt_name", "filtro", "usar_reranker", "usar_cache", "context_budget",
+}
+
+# Tipo e faixa aceitos de cada campo escalar: (tipos, mínimo, máximo, aceita null)
+_CONFIG_TIPOS = {
+    "modelo_llm": (str, None, None, False),
+    "prompt_name": (str, None, None, False),
+    "filtro": (str, None, None, False),
+    "temperature": ((int, float), 0.0, 2.0, False),
+    "k": (int, 1, 100, False),
+    "max_tokens": (int, 1, None, True),
+    "context_budget": (int, 1, None, True),
+    "usar_reranker": (bool, None, None, False),
+    "usar_cache": (bool, None, None, False),
+}
+
+
+def _check_field(campo, valor):
+    tipos, minimo, maximo, anulavel = _CONFIG_TIPOS[campo]
+    if valor is None and anulavel:
+        return
+    # bool é subclasse de int: true/false não valem como número
+    if not isinstance(valor, tipos) or (tipos is not bool and isinstance(valor, bool)):
+        raise ValueError(f"'{campo}' com tipo inválido: {valor!r}")
+    if (minimo is not None and valor < minimo) or (maximo is not None and valor > maximo):
+        faixa = f"entre {minimo} e {maximo}" if maximo is not None else f">= {minimo}"
+        raise ValueError(f"'{campo}' deve ser {faixa}: {valor!r}")
+
+
+def request_config(base_config: EngineConfig, extras) -> EngineConfig:
+    """
+    Configuração da pergunta: a do servidor com os campos permitidos trocados.
+    Índices só dentro de VECTORS_FOLDER (o carregamento lê o index.pkl da pasta),
+    embeddings só entre os modelos conhecidos e os demais campos com tipo e
+    faixa conferidos, para que um valor inválido seja um 400 e não um erro do motor.
+    """
+    if not isinstance(extras, dict):
+        raise ValueError("Campo 'config' deve ser um objeto.")
+    desconhecidos = set(extras) - _CONFIG_FIELDS
+    if desconhecidos:
+        raise ValueError(f"Campos de configuração não permitidos: {sorted(desconhecidos)}")
+    for campo in set(extras) & set(_CONFIG_TIPOS):
+        _check_field(campo, extras[campo])
+    if "indices" in extras:
+        raiz = os.path.realpath(VECTORS_FOLDER)
+        indices = extras["indices"]
+        if not isinstance(indices, list) or not all(isinstance(p, str) for p in indices):
+            raise ValueError("'indices' deve ser uma lista de pastas.")
+        for path in indices:
+            if os.path.commonpath([raiz, os.path.realpath(path)]) != raiz:
+                raise ValueError(f"Índice fora de {VECTORS_FOLDER}: {path}")
+    if "embedding_model" in extras and extras["embedding_model"] not in EMBEDDING_OPTIONS.values():
+        raise ValueError(f"Modelo de embeddings desconhecido: {extras['embedding_model']}")
+    return replace(base_config, **extras)
+
+
+def doc_to_json(doc):
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def result_to_json(session, result):
+    return {
+        "session_id": session.session_id,
+        "resposta": result.resposta,
+        "fontes": [doc_to_json(d) for d in result.fontes],
+        "elapsed": result.elapsed,
+        "metricas": result.metricas,
+        "cache": bool(result.cache),
+    }
+
+
+class SessionStore:
+    """
+    Sessões abertas no servidor, em LRU com expiração por inatividade; uma
+    sessão só responde uma pergunta por vez. Sessões descartadas continuam no
+    disco e são recarregadas na próxima pergunta.
+    """
+
+    def __init__(self, max_sessions=SERVER_MAX_SESSIONS, ttl=SERVER_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()   # session_id -> [sessão, lock, último uso]
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id):
+        entrada = self._sessions.get(session_id)
+        if entrada is not None:
+            entrada[2] = time.time()
+            self._sessions.move_to_end(session_id)
+        return entrada
+
+    def _evict(self, atual):
+        agora = time.time()
+        for session_id in list(self._sessions):
+            _, lock, uso = self._sessions[session_id]
+            if len(self._sessions) <= self.max_sessions and agora - uso <= self.ttl:
+                break
+            # A sessão que acabou de ser pedida e as que estão respondendo ficam
+            if session_id != atual and not lock.locked():
+                del self._sessions[session_id]
+
+    def get(self, session_id=None):
+        """Sessão e seu lock; abre (ou recarrega do disco) se ainda não estiver em memória."""
+        if session_id is not None and not valid_session_id(session_id):
+            raise ValueError("session_id inválido (use letras, dígitos, '_' e '-').")
+        if session_id:
+            with self._lock:
+                entrada = self._touch(session_id)
+            if entrada is not None:
+                return entrada[0], entrada[1]
+            salvo = load_chat(session_id)   # leitura do disco fora do lock global
+            history = [tuple(turno) for turno in salvo.get("chat_history", [])]
+            session = ChatSession(session_id=session_id, history=history)
+        else:
+            session = ChatSession()
+
+        with self._lock:
+            # Outra thread pode ter aberto a mesma sessão enquanto esta lia o disco
+            entrada = self._touch(session.session_id)
+            if entrada is None:
+                entrada = self._sessions[session.session_id] = [session, threading.Lock(), time.time()]
+            self._evict(session.session_id)
+            return entrada[0], entrada[1]
+
+    def history(self, session_id):
+        """Histórico de uma sessão existente sem abri-la (None se ela não existe)."""
+        with self._lock:
+            entrada = self._sessions.get(session_id)
+        if entrada is not None:
+            return entrada[0].history
+        salvo = load_chat(session_id)
+        return salvo.get("chat_history") if salvo else None
+
+
+def make_handler(base_config: EngineConfig, sessions: SessionStore):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/saude":
+                return self._json(200, {"status": "ok"})
+            if self.path == "/metricas":
+                return self._json(200, {
+                    "agrupadores": batcher_stats(),
+                    "cache_respostas": get_answer_cache().stats(),
+                    "cache_recuperacao": cache_stats(),
+                    "llm": llm_report(),
+                })
+            if self.path.startswith("/sessoes/"):
+                session_id = self.path[len("/sessoes/"):]
+                if not valid_session_id(session_id):
+                    return self._json(400, {"erro": "session_id inválido"})
+                history = sessions.history(session_id)
+                if history is None:
+                    return self._json(404, {"erro": "sessão não encontrada"})
+                return self._json(200, {"session_id": session_id, "chat_history": history})
+            self._json(404, {"erro": "rota não encontrada"})
+
+        def do_POST(self):
+            if self.path != "/perguntar":
+                return self._json(404, {"erro": "rota não encontrada"})
+            try:
+                tamanho = int(self.headers.get("Content-Length", 0))
+                pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+                pergunta = (pedido.get("pergunta") or "").strip()
+                if not pergunta:
+                    raise ValueError("Campo 'pergunta' é obrigatório.")
+                config = request_config(base_config, pedido.get("config") or {})
+                session, session_lock = sessions.get(pedido.get("session_id"))
+            except (ValueError, TypeError) as e:
+                return self._json(400, {"erro": str(e)})
+
+            with session_lock:
+                try:
+                    if pedido.get("stream"):
+                        self._stream(session, config, pergunta)
+                    else:
+                        result = get_engine().ask(session, config, pergunta)
+                        self._json(200, result_to_json(session, result))
+                except ValueError as e:
+                    self._json(400, {"erro": str(e)})
+                except Exception as e:
+                    logging.exception("Falha ao responder pergunta")
+                    self._json(500, {"erro": str(e)})
+
+        def _stream(self, session, config, pergunta):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.end_headers()
+
+            def enviar(evento):
+                linha = json.dumps(evento, ensure_ascii=False, default=str) + "\n"
+                self.wfile.write(linha.encode("utf-8"))
+                self.wfile.flush()
+
+            # Os cabeçalhos 200 já foram enviados: erros viram o último evento do stream
+            try:
+                result = get_engine().ask(
+                    session, config, pergunta,
+                    on_sources=lambda docs: enviar({"tipo": "fontes", "fontes": [doc_to_json(d) for d in docs]}),
+                    on_token=lambda token: enviar({"tipo": "token", "texto": token}),
+                )
+            except (BrokenPipeError, ConnectionResetError):
+                logging.warning("Cliente desconectou durante o stream")
+                return
+            except Exception as e:
+                logging.exception("Falha ao responder pergunta")
+                enviar({"tipo": "erro", "status": 400 if isinstance(e, ValueError) else 500, "erro": str(e)})
+                return
+            enviar({"tipo": "resultado", **result_to_json(session, result)})
+
+        def log_message(self, format, *args):
+            logging.info("HTTP " + format % args)
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor HTTP do PPA Inteligente")
+    parser.add_argument("indices", nargs="+", help="pastas dos índices FAISS usados por padrão")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--embedding", default=EMBEDDING_OPTIONS["E5 (multilingual)"])
+    parser.add_argument("--llm", default="Ollama (servidor)")
+    parser.add_argument("--prompt", default="teste")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    config = EngineConfig(indices=args.indices, embedding_model=args.embedding,
+                          modelo_llm=args.llm, prompt_name=args.prompt)
+    # Carrega modelos e índices e aquece o LLM antes de aceitar conexões
+    get_engine().prepare(config)
+    try:
+        warm_up(config.modelo_llm)
+    except Exception as e:
+        logging.error(f"Falha ao aquecer LLM {config.modelo_llm}: {e}")
+
+    server = ThreadingHTTPServer((args.host, args.porta), make_handler(config, SessionStore()))
+    logging.info(f"🌐 Servidor em http://{args.host}:{args.porta}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
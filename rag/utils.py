@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 from settings import DOCS_PATH, INDEXED_LIST_PATH
 
 def save_uploaded_files(uploaded_files):
@@ -7,13 +8,55 @@ def save_uploaded_files(uploaded_files):
         with open(os.path.join(DOCS_PATH, file.name), "wb") as f:
             f.write(file.getvalue())
 
-def save_indexed_files(file_list):
-    with open(INDEXED_LIST_PATH, "w", encoding="utf-8") as f:
-        json.dump(file_list, f, ensure_ascii=False, indent=2)
+def file_hash(path, block_size=1024 * 1024):
+    """Hash SHA-256 do conteúdo do arquivo, lido em blocos."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-def load_indexed_files():
+def load_manifest():
+    """
+    Manifesto de indexação: para cada índice, o hash de cada arquivo e os
+    chunk_ids que ele gerou. A lista simples do formato antigo é descartada.
+    """
     if os.path.exists(INDEXED_LIST_PATH):
         with open(INDEXED_LIST_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+            data = json.load(f)
+        if isinstance(data, dict) and "indices" in data:
+            return data
+    return {"versao": 2, "indices": {}}
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(INDEXED_LIST_PATH), exist_ok=True)
+    tmp_path = INDEXED_LIST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, INDEXED_LIST_PATH)
+
+def get_index_manifest(index_name):
+    """Registro de um índice: {"modelo", "tipo_indice", "arquivos": {nome: {"hash", "chunk_ids"}}}."""
+    return load_manifest()["indices"].get(index_name, {})
 
+def save_index_manifest(index_name, model_name, arquivos, tipo_indice):
+    manifest = load_manifest()
+    manifest["indices"][index_name] = {"modelo": model_name, "tipo_indice": tipo_indice, "arquivos": arquivos}
+    save_manifest(manifest)
+
+def diff_manifest(anteriores, hashes):
+    """
+    Compara o registro anterior de um índice com os hashes atuais dos arquivos.
+    Retorna (arquivos inalterados, chunk_ids a remover, nomes a (re)indexar).
+    """
+    manifesto = {nome: info for nome, info in anteriores.items() if hashes.get(nome) == info["hash"]}
+    obsoletos = [cid for nome, info in anteriores.items() if nome not in manifesto for cid in info["chunk_ids"]]
+    pendentes = [nome for nome in hashes if nome not in manifesto]
+    return manifesto, obsoletos, pendentes
+
+def load_indexed_files():
+    manifest = load_manifest()
+    nomes = set()
+    for indice in manifest["indices"].values():
+        nomes.update(nome for nome, info in indice.get("arquivos", {}).items() if info.get("hash"))
+    return sorted(nomes)
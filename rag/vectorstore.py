@@ -5,19 +5,23 @@ import logging
 import time
 import json
 import asyncio
+import hashlib
 import streamlit as st
 
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import (
-    TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader,
-    UnstructuredExcelLoader, UnstructuredHTMLLoader
-)
-from langchain.schema import Document
 from transformers import AutoTokenizer
 
-from settings import DOCS_PATH, CHUNK_SIZE, CHUNK_OVERLAP, VECTORS_FOLDER
+from settings import (
+    DOCS_PATH, CHUNK_SIZE, CHUNK_OVERLAP, VECTORS_FOLDER, INDEX_TYPE, IVF_NPROBE, HNSW_EF_SEARCH
+)
 from rag.embeddings import load_embeddings
-from rag.utils import save_indexed_files
+from rag.utils import file_hash, get_index_manifest, save_index_manifest, diff_manifest
+from rag.index_registry import get_vectorstore, invalidate
+from rag.embedding_stage import embed_stream, clear_checkpoint
+from rag.loaders import iter_loaded_files
+from rag.docstore import open_for_build, new_build_docstore, save_faiss
+from rag.ann_index import IN_PLACE_REMOVAL, training_size, build_index, tune_index, recall_report
 from langchain.text_splitter import TokenTextSplitter
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -39,9 +43,33 @@ def get_tokenizer(model_name):
 async def load_tokenizer_async(model_name):
     return AutoTokenizer.from_pretrained(model_name)
 
-def create_vectorstore(model_name):
+def split_file_docs(docs, splitter, file_digest, filename):
+    """
+    Divide os documentos de um arquivo, um a um, atribuindo chunk_ids
+    determinísticos. O id combina o hash do conteúdo com o do nome, para que
+    cópias idênticas com nomes diferentes não colidam no docstore.
+    """
+    name_digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:8]
+    n = 0
+    for doc in docs:
+        if not (doc.page_content and doc.page_content.strip()):
+            continue
+        for chunk in splitter.split_documents([doc]):
+            chunk.page_content = f"passage: {chunk.page_content.strip()}"
+            chunk.metadata["chunk_id"] = f"{file_digest[:16]}-{name_digest}-{n}"
+            n += 1
+            yield chunk
+
+def create_vectorstore(model_name, index_type=INDEX_TYPE, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """
+    Reindexa incrementalmente: só arquivos novos ou alterados (pelo hash do
+    conteúdo) são lidos e vetorizados; os vetores de arquivos alterados ou
+    removidos são apagados do índice com FAISS.delete. Mudar o tipo de índice,
+    ou remover vetores de um índice IVF/HNSW, reconstrói o índice do zero.
+    """
     start_time = time.time()
     vectordb_path = get_vectordb_path(model_name)
+    index_name = os.path.basename(vectordb_path)
 
     sidebar_status = st.sidebar.empty()
     sidebar_progress = st.sidebar.progress(0)
@@ -52,152 +80,175 @@ def create_vectorstore(model_name):
         log_lines.append(msg)
         log_display.text("\n".join(log_lines[-20:]))
 
-    log_to_streamlit("🔄 Iniciando reindexação de documentos...")
+    log_to_streamlit(f"🔄 Iniciando reindexação de documentos (índice {index_type})...")
     logging.info("Iniciando reindexação...")
 
-    docs = []
-    files = sorted(glob.glob(f"{DOCS_PATH}/*"))
-    total = len(files)
-    sucesso, falha = 0, 0
+    files = [f for f in sorted(glob.glob(f"{DOCS_PATH}/*")) if os.path.isfile(f)]
+    hashes = {os.path.basename(f): file_hash(f) for f in files}
 
-    for i, file in enumerate(files):
-        ext = os.path.splitext(file)[1].lower()
-        filename = os.path.basename(file)
-        sidebar_progress.markdown(f"📄 Processando: `{filename}`")
-
-        try:
-            if ext == ".pdf":
-                loader = PyPDFLoader(file)
-                docs.extend(loader.load())
-
-            elif ext == ".txt":
-                loader = TextLoader(file, encoding="utf-8")
-                docs.extend(loader.load())
-
-            elif ext == ".docx":
-                loader = UnstructuredWordDocumentLoader(file)
-                docs.extend(loader.load())
-
-            elif ext == ".xlsx":
-                loader = UnstructuredExcelLoader(file)
-                docs.extend(loader.load())
-
-            elif ext == ".html":
-                loader = UnstructuredHTMLLoader(file)
-                docs.extend(loader.load())
-
-            elif ext in [".json", ".jsonl"]:
-                sidebar_status.markdown(f"📑 Lendo `{filename}`...")
-                with open(file, 'r', encoding='utf-8') as f:
-                    try:
-                        content = json.load(f)
-                        if isinstance(content, list):
-                            for linha in content:
-                                texto = linha.get("text", "")
-                                if not texto:
-                                    texto = " ".join(str(v) for v in linha.values() if isinstance(v, (str, int, float)))
-                                metadados = linha.get("metadata", {})
-                                docs.append(Document(page_content=texto, metadata=metadados))
-                        elif isinstance(content, dict):
-                            texto = content.get("text", "")
-                            metadados = content.get("metadata", {})
-                            docs.append(Document(page_content=texto, metadata=metadados))
-                    except json.JSONDecodeError:
-                        f.seek(0)
-                        for idx, line in enumerate(f, 1):
-                            if line.strip():
-                                try:
-                                    linha = json.loads(line)
-                                    texto = linha.get("text", "")
-                                    if not texto:
-                                        texto = " ".join(str(v) for v in linha.values() if isinstance(v, (str, int, float)))
-                                    metadados = linha.get("metadata", {})
-                                    docs.append(Document(page_content=texto, metadata=metadados))
-                                except Exception as e:
-                                    msg = f"⚠️ Linha {idx} inválida em `{filename}`: {e}"
-                                    sidebar_status.markdown(msg)
-                                    log_to_streamlit(msg)
-                sucesso += 1
-                continue
-            else:
-                continue
-
-            sucesso += 1
-        except Exception as e:
-            falha += 1
-            msg = f"⚠️ Erro ao processar `{filename}`: {e}"
-            sidebar_status.markdown(msg)
-            log_to_streamlit(msg)
-            logging.error(msg)
-            logging.debug(traceback.format_exc())
-
-        sidebar_progress.progress((i + 1) / total)
-
-    if not docs:
-        sidebar_status.markdown("❌ Nenhum documento válido.")
-        log_to_streamlit("Nenhum documento válido.")
-        sidebar_progress.empty()
-        st.stop()
-        return None, {}
+    embeddings = load_embeddings(model_name)
+    db = None
+    anteriores = {}
+    if os.path.exists(os.path.join(vectordb_path, "index.faiss")):
+        registro = get_index_manifest(index_name)
+        anteriores = registro.get("arquivos", {})
+        if not anteriores:
+            log_to_streamlit("ℹ️ Índice sem manifesto: reconstruindo do zero.")
+        elif registro.get("tipo_indice", "Flat") != index_type:
+            log_to_streamlit(f"ℹ️ Tipo de índice mudou para {index_type}: reconstruindo do zero.")
+            anteriores = {}
+        elif index_type not in IN_PLACE_REMOVAL and any(hashes.get(n) != i["hash"] for n, i in anteriores.items()):
+            log_to_streamlit(f"ℹ️ Índice {index_type} não remove vetores: reconstruindo do zero.")
+            anteriores = {}
+
+    manifesto, obsoletos, _ = diff_manifest(anteriores, hashes)
+    pendentes = [f for f in files if os.path.basename(f) not in manifesto]
+
+    if anteriores and (pendentes or obsoletos):
+        # Cópia própria: o índice do registro é compartilhado pelas sessões em uso
+        db = open_for_build(vectordb_path, embeddings)
+        tune_index(db.index, nprobe, ef_search)
+    elif anteriores:
+        # Nada a fazer: usa o índice em uso, sem copiar o docstore para construção
+        db = get_vectorstore(vectordb_path, embeddings, model_name)
+    chunks_reaproveitados = sum(len(info["chunk_ids"]) for info in manifesto.values())
+
+    log_to_streamlit(
+        f"📋 {len(pendentes)} arquivo(s) novo(s)/alterado(s), {len(manifesto)} inalterado(s), "
+        f"{len(obsoletos)} chunk(s) a remover."
+    )
 
-    log_to_streamlit("✂️ Tokenizando documentos...")
-    sidebar_status.markdown(f"✂️ Fazendo o splitting com o tokenizer do modelo `{model_name}`.")
     tokenizer = get_tokenizer(model_name)
-
     splitter = TokenTextSplitter.from_huggingface_tokenizer(
         tokenizer=tokenizer,
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP
     )
 
+    total = len(pendentes)
+    sucesso, falha = 0, 0
 
-        # Filtrar documentos com conteúdo vazio
-    docs = [d for d in docs if d.page_content and d.page_content.strip()]
-    log_to_streamlit(f"📄 Documentos válidos após limpeza: {len(docs)}")
-    logging.info(f"Documentos válidos após limpeza: {len(docs)}")
-
-    if not docs:
-        log_to_streamlit("❌ Nenhum documento com conteúdo válido após limpeza.")
-        sidebar_status.markdown("❌ Nenhum documento com conteúdo válido após limpeza.")
-        st.stop()
-
-    chunks = splitter.split_documents(docs)
+    def iter_chunks():
+        """Lê os arquivos pendentes sob demanda; nada do corpus fica inteiro em memória."""
+        nonlocal sucesso, falha
+        for i, (file, docs, erro) in enumerate(iter_loaded_files(pendentes, log_to_streamlit)):
+            filename = os.path.basename(file)
+            sidebar_status.markdown(f"📄 Processando: `{filename}`")
+            chunk_ids = []
+
+            try:
+                if erro is not None:
+                    raise erro
+                if docs is not None:
+                    for chunk in split_file_docs(docs, splitter, hashes[filename], filename):
+                        chunk_ids.append(chunk.metadata["chunk_id"])
+                        yield chunk
+                    manifesto[filename] = {"hash": hashes[filename], "chunk_ids": chunk_ids}
+                    sucesso += 1
+            except Exception as e:
+                falha += 1
+                if chunk_ids:
+                    # Sem hash válido: os chunks parciais serão removidos na próxima reindexação
+                    manifesto[filename] = {"hash": None, "chunk_ids": chunk_ids}
+                msg = f"⚠️ Erro ao processar `{filename}`: {e}"
+                sidebar_status.markdown(msg)
+                log_to_streamlit(msg)
+                logging.error(msg)
+                logging.debug(traceback.format_exc())
+
+            sidebar_progress.progress((i + 1) / total)
+
+    if obsoletos:
+        log_to_streamlit(f"🗑️ Removendo {len(obsoletos)} vetores obsoletos...")
+        db.delete(obsoletos)
 
-    if not chunks:
+    log_to_streamlit(f"📦 Gerando embeddings com modelo {model_name}...")
+    chunks_gerados = 0
+
+    def on_progress(feitos, taxa):
+        log_display.text("\n".join(log_lines[-19:] + [f"📦 {feitos} chunks — {taxa:.1f} chunks/s"]))
+
+    # Índices que precisam de treino (IVF) só são criados após acumular vetores suficientes
+    em_espera = []
+    a_treinar = training_size(index_type)
+
+    def add_batch(batch, vectors):
+        text_embeddings = list(zip([c.page_content for c in batch], vectors.tolist()))
+        metadatas = [c.metadata for c in batch]
+        ids = [c.metadata["chunk_id"] for c in batch]
+        db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+    def create_db():
+        amostra = np.vstack([v for _, v in em_espera])
+        index = build_index(index_type, amostra, nprobe=nprobe, ef_search=ef_search)
+        return FAISS(embeddings, index, new_build_docstore(vectordb_path), {})
+
+    embed_start = time.time()
+    for batch, vectors in embed_stream(iter_chunks(), embeddings, model_name, vectordb_path, on_progress=on_progress):
+        chunks_gerados += len(batch)
+        if db is not None:
+            add_batch(batch, vectors)
+            continue
+        em_espera.append((batch, vectors))
+        if chunks_gerados >= a_treinar:
+            db = create_db()
+            for b, v in em_espera:
+                add_batch(b, v)
+            em_espera = []
+
+    if db is None and em_espera:
+        db = create_db()
+        for b, v in em_espera:
+            add_batch(b, v)
+        em_espera = []
+    throughput = chunks_gerados / max(time.time() - embed_start, 1e-6)
+
+    if db is None:
         log_to_streamlit("❌ Nenhum chunk foi gerado — verifique o conteúdo dos documentos.")
-        sidebar_status.markdown("❌ Nenhum chunk foi gerado.")
+        sidebar_status.markdown("❌ Nenhum documento válido.")
+        sidebar_progress.empty()
         st.stop()
+        return None, {}
 
-
-    for chunk in chunks:
-        chunk.page_content = f"passage: {chunk.page_content.strip()}"
-
-    log_to_streamlit(f"📦 Gerando embeddings com modelo {model_name}...")
-    sidebar_status.markdown(f"📦 Gerando embeddings com modelo {model_name}...")
-    embeddings = load_embeddings(model_name)
-
-    for i, chunk in enumerate(chunks):
-        sidebar_progress.progress((i + 1) / len(chunks))
-
-    log_to_streamlit("💾 Criando e salvando base FAISS...")
-    db = FAISS.from_documents(chunks, embeddings)
-    db.save_local(vectordb_path)
-
-    indexed_files = [os.path.basename(f) for f in files]
+    log_to_streamlit(f"⚡ {chunks_gerados} chunks vetorizados a {throughput:.1f} chunks/s")
+
+    relatorio = {}
+    if chunks_gerados or obsoletos:
+        log_to_streamlit("📏 Medindo recall e latência do índice...")
+        relatorio = recall_report(db.index)
+        with open(os.path.join(vectordb_path, "relatorio_indice.json"), "w", encoding="utf-8") as f:
+            json.dump({"tipo_indice": index_type, **relatorio}, f, ensure_ascii=False, indent=2)
+        log_to_streamlit(f"📏 {relatorio}")
+        log_to_streamlit("💾 Salvando base FAISS...")
+        invalidate(vectordb_path)
+        save_faiss(db, vectordb_path)
+    clear_checkpoint(vectordb_path)
+    save_index_manifest(index_name, model_name, manifesto, index_type)
+
+    indexed_files = sorted(nome for nome, info in manifesto.items() if info["hash"])
     st.session_state["indexed_files"] = indexed_files
-    save_indexed_files(indexed_files)
 
     sidebar_status.markdown("✅ Documentos indexados com sucesso!")
     sidebar_progress.empty()
 
     metrics = {
         "tempo_total": time.time() - start_time,
-        "arquivos_processados": len(files),
+        "arquivos_processados": len(pendentes),
+        "arquivos_ignorados": len(files) - len(pendentes),
         "sucesso": sucesso,
         "falha": falha,
-        "chunks_gerados": len(chunks),
+        "chunks_gerados": chunks_gerados,
+        "chunks_reaproveitados": chunks_reaproveitados,
+        "chunks_removidos": len(obsoletos),
+        "chunks_por_segundo": throughput,
+        "tipo_indice": index_type,
+        "relatorio_indice": relatorio,
         "arquivos": indexed_files
     }
+    log_to_streamlit(
+        f"⏭️ Reaproveitados: {metrics['arquivos_ignorados']} arquivo(s), "
+        f"{chunks_reaproveitados} chunk(s) sem reprocessamento."
+    )
 
     return db, metrics
 
@@ -215,4 +266,4 @@ def load_vectorstore(model_name):
     st.sidebar.text(log_msg)
 
     embeddings = load_embeddings(model_name)
-    return FAISS.load_local(vectordb_path, embeddings, allow_dangerous_deserialization=True)
+    return get_vectorstore(vectordb_path, embeddings, model_name)
@@ -1,25 +1,127 @@
 # settings.py
 
 RETRIEVER_TOP_K = 2
+RETRIEVER_MAX_WORKERS = 8   # buscas simultâneas nos índices FAISS
+RETRIEVER_TIMEOUT = 10.0    # segundos por índice antes de ignorá-lo
+HYBRID_SEARCH = True        # combina BM25 e busca densa por reciprocal rank fusion
+RRF_K = 60
+RETRIEVAL_CACHE_SIZE = 2000  # consultas com o ranking (chunk_ids) guardado por versão dos índices
+
+# Event loop compartilhado do pipeline assíncrono
+ASYNC_MAX_WORKERS = 32   # threads de E/S do loop (buscas e leituras do docstore)
+ASYNC_CPU_WORKERS = 2    # threads de CPU (reranker, vetorização da pergunta)
+
+# Campos de metadados com índice invertido para filtros (colunas das planilhas podem ser incluídas)
+METADATA_INDEX_FIELDS = ["origem", "aba", "Órgão", "Programa"]
+FILTER_EXACT_MAX = 4096     # até esse nº de chunks permitidos, calcula as distâncias só deles
+FILTER_EXACT_CHUNK = 1024   # vetores reconstruídos por bloco nesse cálculo (memória limitada por consulta)
 CHUNK_SIZE = 2000
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 64   # chunks por lote na geração de embeddings
+EMBED_WORKERS = 1       # lotes vetorizados em paralelo
+# Perguntas simultâneas de várias sessões são vetorizadas num único lote
+EMBED_QUERY_MAX_BATCH = 32
+EMBED_QUERY_MAX_WAIT_MS = 5
+LOADER_WORKERS = None   # processos de leitura de PDF/DOCX/XLSX/HTML (None = nº de núcleos)
+LOADER_TIMEOUT = 300    # segundos por arquivo antes de contá-lo como falha
+
+# Tipo de índice FAISS (Flat, IVF-Flat ou HNSW) e parâmetros de busca aproximada
+INDEX_TYPE = "Flat"
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+INDEX_REPORT_QUERIES = 100   # consultas do relatório de recall/latência
+INDEX_REPORT_K = 10
 TEMPERATURE = 0.0
 
+# Teto de tokens do contexto enviado ao LLM, por modo de execução. O orçamento
+# efetivo é o menor entre o teto e o que sobra da janela do modelo
+# (CONTEXT_WINDOW) depois do template, da pergunta/histórico e da resposta.
+CONTEXT_TOKEN_BUDGET = {
+    "Ollama (servidor)": 6000,
+    "OpenAI (API)": 24000,
+    "GGUF (offline)": 3000,
+}
+CONTEXT_TOKEN_BUDGET_DEFAULT = 4000
+CONTEXT_ANSWER_RESERVE = 1024   # tokens reservados à resposta quando LLM_MAX_TOKENS é None
+CHARS_PER_TOKEN = 3.0           # estimativa conservadora p/ português quando não há tokenizador do modelo
+# Pergunta de busca independente do histórico e histórico limitado no prompt
+STANDALONE_MODE = "heuristica"   # "heuristica" ou "llm" (reescrita pelo próprio LLM)
+SUMMARY_MAX_LINES = 8            # trocas mantidas no resumo acumulado da sessão
+SUMMARY_ANSWER_CHARS = 200       # trecho de cada resposta guardado no resumo
+HISTORY_LAST_TURN_CHARS = 600    # limite da última troca repetida no prompt
+MMR_LAMBDA = 0.7            # peso da relevância contra a redundância na escolha dos trechos
+DUPLICATE_THRESHOLD = 0.8   # similaridade a partir da qual um trecho é considerado duplicado
+
 EMBEDDING_OPTIONS = {
     "E5 (multilingual)": "intfloat/multilingual-e5-large",
     "BGE (small EN)": "BAAI/bge-small-en-v1.5",
     "MiniLM (leve)": "sentence-transformers/all-MiniLM-L6-v2"
 }
 
+# Modelos de embeddings carregados na inicialização (nomes de EMBEDDING_OPTIONS)
+EMBEDDING_PRELOAD = ["intfloat/multilingual-e5-large"]
+
+# Reranker local (cross-encoder) residente
+RERANKER_MODEL = "BAAI/bge-reranker-large"
+RERANKER_BATCH_SIZE = 16
+RERANKER_CACHE_SIZE = 10000
+RERANKER_MAX_WAIT_MS = 5    # espera por pares de outras sessões antes de rodar o lote
+
 LLM_MODEL = "llama3.2"  # usado para ollama
+OLLAMA_KEEP_ALIVE = 1800   # segundos que o Ollama mantém o modelo carregado após a última chamada
+OLLAMA_NUM_CTX = 8192      # janela de contexto pedida ao servidor (o padrão dele é 2048/4096)
+LLM_MAX_TOKENS = None      # limite de tokens gerados por resposta (None = padrão do servidor)
+LLM_WARMUP = ["Ollama (servidor)"]   # modos aquecidos na inicialização
 OPENAI_MODEL = "gpt-4.1"  # pode trocar para gpt-4
 
 LLM_GGUF = "./.models/mistral-7b-instruct-v0.1.Q4_K_M.gguf" 
+# Backend GGUF em processo (llama.cpp)
+GGUF_N_CTX = 4096
+GGUF_N_BATCH = 512          # tokens do prompt processados por passo
+GGUF_N_THREADS = None       # None = escolha do llama.cpp (núcleos físicos)
+GGUF_N_GPU_LAYERS = 0
+GGUF_USE_MMAP = True        # pesos mapeados do arquivo, compartilhados entre processos
+GGUF_USE_MLOCK = False      # trava os pesos na RAM (evita swap; exige limite de memlock)
+GGUF_PROMPT_CACHE_MB = 512  # cache de KV por prefixo de prompt (0 desliga)
+
+# Janela de contexto (tokens) de cada modo de execução
+CONTEXT_WINDOW = {
+    "Ollama (servidor)": OLLAMA_NUM_CTX,
+    "OpenAI (API)": 128000,
+    "GGUF (offline)": GGUF_N_CTX,
+}
 PROMPT_FILE = "./config/saved_prompt.txt"
 VECTORS_FOLDER = "./vectors"
 DOCS_PATH = "./chunks"
 INDEXED_LIST_PATH = "./chunks/indexed/indexed_files.json"
 
+# Cache semântico de respostas (perguntas parecidas reaproveitam a resposta)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = "./cache/respostas.sqlite"
+ANSWER_CACHE_THRESHOLD = 0.97   # similaridade mínima sem calibração (ver rag.calibrate_cache)
+ANSWER_CACHE_CALIBRATION_PATH = "./cache/limiares_respostas.json"
+ANSWER_CACHE_TTL_HOURS = 24 * 7
+ANSWER_CACHE_MAX_ENTRIES = 5000
+
+# Log das sessões de chat (JSONL só de acréscimo): fsync a cada N turnos ou a
+# cada X segundos, e compactação em snapshot a partir de um mínimo de registros
+CHAT_FSYNC_EVERY = 8
+CHAT_FSYNC_INTERVAL = 2.0
+CHAT_COMPACT_MIN_RECORDS = 64
+CHAT_MAX_OPEN_LOGS = 64      # logs com descritor aberto ao mesmo tempo (LRU)
+
+# Sessões mantidas em memória pelo servidor HTTP (rag.server)
+SERVER_MAX_SESSIONS = 1000
+SERVER_SESSION_TTL = 3600    # segundos de inatividade até a sessão sair da memória
+
+# Cache de índices FAISS compartilhado pelo processo (orçamento aproximado em MB)
+INDEX_CACHE_MAX_MB = 4096
+# Mapeia o index.faiss em memória (somente leitura), compartilhado entre processos
+FAISS_MMAP = True
+
 
 # Meta-Llama-3-8B-Instruct.Q5_K_M
 # multilingual-e5-large-instruct-q8_0.gguf 
@@ -0,0 +1,92 @@
+import json
+import time
+
+import pytest
+
+import rag.chat_history as chat_history
+
+
+@pytest.fixture
+def chat_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_history, "CHAT_DIR", str(tmp_path))
+    yield tmp_path
+    chat_history.close_all()
+
+
+def _linhas(path):
+    return [json.loads(linha) for linha in path.read_text(encoding="utf-8").splitlines() if linha.strip()]
+
+
+def test_append_and_replay(chat_dir):
+    chat_history.append_turn("s1", "p1", "r1", {"modelo_llm": "a"})
+    chat_history.append_turn("s1", "p2", "r2", {"modelo_llm": "b"})
+
+    sessao = chat_history.load_chat("s1")
+    assert sessao["chat_history"] == [["user", "p1"], ["bot", "r1"], ["user", "p2"], ["bot", "r2"]]
+    assert sessao["metadata"] == {"modelo_llm": "b"}
+    assert [r["tipo"] for r in _linhas(chat_dir / "s1.jsonl")] == ["turno", "turno"]
+
+
+def test_compaction_keeps_every_turn(chat_dir, monkeypatch):
+    monkeypatch.setattr(chat_history, "CHAT_COMPACT_MIN_RECORDS", 3)
+    for i in range(20):
+        chat_history.append_turn("s1", f"p{i}", f"r{i}", {"i": i})
+
+    registros = _linhas(chat_dir / "s1.jsonl")
+    assert registros[0]["tipo"] == "snapshot"
+    assert len(registros) < 20
+
+    sessao = chat_history.load_chat("s1")
+    assert len(sessao["chat_history"]) == 40
+    assert sessao["chat_history"][-1] == ["bot", "r19"]
+    assert [t["i"] for t in sessao["turnos"]] == list(range(20))
+    assert not list(chat_dir.glob("*.tmp"))
+
+
+def test_truncated_last_line_is_ignored(chat_dir):
+    chat_history.append_turn("s1", "p1", "r1")
+    chat_history.close_all()
+    with open(chat_dir / "s1.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"tipo": "turno", "pergunta": "p2"')
+
+    assert chat_history.load_chat("s1")["chat_history"] == [["user", "p1"], ["bot", "r1"]]
+
+
+def test_legacy_session_is_read_and_continued(chat_dir):
+    antigo = {"session_id": "velha", "chat_history": [["user", "a"], ["bot", "b"]], "metadata": {"x": 1}}
+    (chat_dir / "velha.json").write_text(json.dumps(antigo), encoding="utf-8")
+
+    assert chat_history.load_chat("velha") == antigo
+    chat_history.append_turn("velha", "c", "d")
+    assert chat_history.load_chat("velha")["chat_history"] == [["user", "a"], ["bot", "b"], ["user", "c"], ["bot", "d"]]
+    assert chat_history.list_sessions() == ["velha"]
+
+
+def test_open_logs_are_bounded(chat_dir, monkeypatch):
+    monkeypatch.setattr(chat_history, "CHAT_MAX_OPEN_LOGS", 2)
+    for rodada in range(3):
+        for s in ("s1", "s2", "s3"):
+            chat_history.append_turn(s, f"p{rodada}", "r")
+
+    assert len(chat_history._logs) == 2
+    for s in ("s1", "s2", "s3"):
+        assert len(chat_history.load_chat(s)["chat_history"]) == 6
+
+
+@pytest.mark.parametrize("session_id", ["../fora", "a/b", "", "sessão", None])
+def test_invalid_session_ids_are_rejected(chat_dir, session_id):
+    assert not chat_history.valid_session_id(session_id)
+    with pytest.raises(ValueError):
+        chat_history.append_turn(session_id, "p", "r")
+
+
+def test_quiet_session_is_fsynced_in_background(chat_dir, monkeypatch):
+    monkeypatch.setattr(chat_history, "CHAT_FSYNC_EVERY", 1000)
+    monkeypatch.setattr(chat_history, "CHAT_FSYNC_INTERVAL", 0.05)
+    chat_history.append_turn("s1", "p1", "r1")
+    log = chat_history._logs["s1"]
+
+    prazo = time.monotonic() + 5
+    while log.unsynced and time.monotonic() < prazo:
+        time.sleep(0.05)
+    assert log.unsynced == 0
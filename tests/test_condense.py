@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+from rag.condense import is_follow_up, standalone_question, update_summary, prompt_question
+
+
+def _session(history):
+    return SimpleNamespace(history=history, summary="", summarized_turns=0)
+
+
+@pytest.mark.parametrize("pergunta", [
+    "E a meta dele?",
+    "E o orçamento?",
+    "E quanto isso custa?",
+    "E o órgão responsável por ele?",
+    "E para 2025?",
+])
+def test_short_questions_with_reference_are_follow_ups(pergunta):
+    assert is_follow_up(pergunta)
+
+
+@pytest.mark.parametrize("pergunta", [
+    "Programa 1144?",
+    "Quais são os programas?",
+    "Qual o órgão responsável pelo programa mesmo?",
+    "Quais as metas deste programa de saúde para educação básica?",
+    "E o programa 2035?",
+])
+def test_standalone_questions_are_not_follow_ups(pergunta):
+    assert not is_follow_up(pergunta)
+
+
+def test_standalone_question_adds_previous_terms_only_to_follow_ups():
+    history = [("user", "Quais as metas do programa de saneamento básico?"), ("bot", "As metas são...")]
+    busca = standalone_question("E o orçamento dele?", history)
+    assert busca.startswith("E o orçamento dele?")
+    assert "saneamento" in busca
+
+    assert standalone_question("Programa 1144?", history) == "Programa 1144?"
+    assert standalone_question("E o orçamento dele?", []) == "E o orçamento dele?"
+
+
+def test_summary_is_incremental_and_bounded(monkeypatch):
+    import rag.condense as condense
+    monkeypatch.setattr(condense, "SUMMARY_MAX_LINES", 2)
+    session = _session([])
+    for i in range(3):
+        session.history += [("user", f"pergunta {i}"), ("bot", f"Resposta {i}. Detalhes.")]
+        update_summary(session)
+
+    assert session.summary.splitlines() == ["- pergunta 1 → Resposta 1.", "- pergunta 2 → Resposta 2."]
+    assert session.summarized_turns == len(session.history)
+
+
+def test_prompt_question_without_history_is_the_question():
+    assert prompt_question("Qual a meta?", _session([])) == "Qual a meta?"
+    texto = prompt_question("E dele?", _session([("user", "Programa 1144?"), ("bot", "É da saúde.")]))
+    assert texto.endswith("Nova pergunta:\nE dele?")
+    assert "Programa 1144?" in texto
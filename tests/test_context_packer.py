@@ -0,0 +1,61 @@
+import pytest
+
+Document = pytest.importorskip("langchain.schema").Document
+pytest.importorskip("langchain_core")
+
+from rag.context_packer import pack_context, count_tokens, token_budget  # noqa: E402
+
+
+def _doc(texto, score):
+    return Document(page_content=texto, metadata={"score": score})
+
+
+def test_budget_is_respected_and_order_follows_relevance():
+    docs = [_doc("orçamento do programa de saúde " * 20, 0.9),
+            _doc("metas de educação básica " * 20, 0.8),
+            _doc("indicadores de segurança pública " * 20, 0.7)]
+    por_trecho = count_tokens(None, docs[0].page_content)
+
+    escolhidos, stats = pack_context(docs, None, budget=2 * por_trecho + 10)
+    assert len(escolhidos) == 2
+    assert stats["tokens_contexto"] <= 2 * por_trecho + 10
+    assert [d.metadata["score"] for d in escolhidos] == sorted((d.metadata["score"] for d in escolhidos), reverse=True)
+
+
+def test_near_duplicates_are_dropped():
+    texto = "o programa 1144 tem como meta ampliar o atendimento da atenção básica " * 10
+    docs = [_doc(texto, 0.9), _doc(texto + " fim", 0.85), _doc("outro assunto totalmente diferente " * 10, 0.5)]
+
+    escolhidos, stats = pack_context(docs, None, budget=10_000)
+    assert stats["trechos_duplicados"] == 1
+    assert [d.page_content for d in escolhidos] == [docs[0].page_content, docs[2].page_content]
+
+
+def test_smaller_chunk_still_fits_after_a_large_one_is_skipped():
+    docs = [_doc("a " * 2000, 0.9), _doc("texto curto sobre metas", 0.5)]
+    escolhidos, _ = pack_context(docs, None, budget=50)
+    assert [d.page_content for d in escolhidos] == ["texto curto sobre metas"]
+
+
+def test_empty_input():
+    assert pack_context([], None, budget=100) == ([], {
+        "tokens_recuperados": 0, "tokens_contexto": 0, "tokens_economizados": 0,
+        "trechos_recuperados": 0, "trechos_usados": 0,
+    })
+
+
+def test_budget_leaves_room_for_prompt_and_answer():
+    sobra = token_budget("GGUF (offline)", None, overhead="x" * 3000, max_tokens=512)
+    assert 0 < sobra <= 4096 - 512 - 1000
+
+
+def test_top_chunk_is_truncated_when_no_chunk_fits():
+    docs = [_doc("programa de saúde " * 500, 0.6), _doc("metas de educação básica " * 500, 0.9)]
+
+    escolhidos, stats = pack_context(docs, None, budget=100)
+    assert len(escolhidos) == 1
+    assert escolhidos[0].page_content.startswith("metas de educação")
+    assert escolhidos[0].metadata["truncado"]
+    assert count_tokens(None, escolhidos[0].page_content) <= 100
+    assert stats["trechos_truncados"] == 1
+    assert stats["trechos_grandes_demais"] == 1
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("faiss")
+Document = pytest.importorskip("langchain.schema").Document
+
+from multi_faiss import MultiFAISSRetriever  # noqa: E402
+
+
+def _store(docs):
+    return SimpleNamespace(docstore=SimpleNamespace(search=lambda doc_id: docs.get(doc_id, f"{doc_id} ausente")))
+
+
+def _retriever(docs, k=3):
+    return MultiFAISSRetriever(vectorstores=[_store(docs)], k=k)
+
+
+def test_dense_and_lexical_hits_fuse_on_docstore_id():
+    # Índice migrado: ids UUID no docstore e nenhum chunk_id nos metadados
+    docs = {f"uuid-{n}": Document(page_content=f"trecho {n}", metadata={}) for n in range(4)}
+    dense = {0: [(0.9, Document(page_content="trecho 0", metadata={"score": 0.9}), "uuid-0"),
+                 (0.8, Document(page_content="trecho 1", metadata={"score": 0.8}), "uuid-1")]}
+    lexical = {0: [("uuid-1", 5.0), ("uuid-2", 3.0)]}
+
+    ranked = _retriever(docs)._fuse(dense, lexical)
+    ids = [doc_id for _, doc_id, _ in ranked]
+    assert ids == ["uuid-1", "uuid-0", "uuid-2"]
+    assert len(set(ids)) == len(ids)
+    assert ranked[0][2].metadata["rrf"] > ranked[1][2].metadata["rrf"]
+
+
+def test_lexical_only_hits_are_read_from_docstore_only_in_top_k():
+    lidos = []
+    docs = {f"id-{n}": Document(page_content=f"trecho {n}", metadata={}) for n in range(5)}
+    store = SimpleNamespace(docstore=SimpleNamespace(search=lambda i: lidos.append(i) or docs[i]))
+    retriever = MultiFAISSRetriever(vectorstores=[store], k=2)
+
+    ranked = retriever._fuse({0: []}, {0: [(f"id-{n}", 1.0) for n in range(5)]})
+    assert [doc_id for _, doc_id, _ in ranked] == ["id-0", "id-1"]
+    assert lidos == ["id-0", "id-1"]
+
+
+def test_without_lexical_results_the_dense_ranking_is_kept():
+    dense = {0: [(0.5, Document(page_content="b", metadata={}), "b")],
+             1: [(0.7, Document(page_content="a", metadata={}), "a")]}
+    retriever = MultiFAISSRetriever(vectorstores=[_store({}), _store({})], k=2)
+    assert [(i, doc_id) for i, doc_id, _ in retriever._fuse(dense, {})] == [(1, "a"), (0, "b")]
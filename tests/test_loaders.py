@@ -0,0 +1,47 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+import rag.loaders as loaders  # noqa: E402
+
+
+@pytest.mark.parametrize("bloco", [1, 3, 7, 64])
+def test_iter_json_array_across_block_boundaries(monkeypatch, bloco):
+    monkeypatch.setattr(loaders, "READ_BLOCK", bloco)
+    itens = [{"text": "a" * n, "metadata": {"n": n, "lista": [1, 2, {"x": "]"}]}} for n in range(12)]
+    itens += [1234567, "texto com , e ]", [1, [2]], None]
+
+    assert list(loaders._iter_json_array(io.StringIO(json.dumps(itens)))) == itens
+
+
+def test_iter_json_array_empty_and_whitespace(monkeypatch):
+    monkeypatch.setattr(loaders, "READ_BLOCK", 2)
+    assert list(loaders._iter_json_array(io.StringIO("[ \n ]"))) == []
+    assert list(loaders._iter_json_array(io.StringIO('[ {"a": 1} ,\n {"b": 2} ]'))) == [{"a": 1}, {"b": 2}]
+
+
+def test_iter_json_array_truncated_raises(monkeypatch):
+    monkeypatch.setattr(loaders, "READ_BLOCK", 4)
+    with pytest.raises(json.JSONDecodeError):
+        list(loaders._iter_json_array(io.StringIO('[{"a": 1}, {"b": ')))
+
+
+def test_jsonl_with_malformed_first_line_keeps_other_lines(tmp_path):
+    path = tmp_path / "dados.jsonl"
+    path.write_text('{"text": "a", quebrado\n{"text": "b"}\n{"text": "c"}\n', encoding="utf-8")
+    avisos = []
+
+    docs = list(loaders.iter_json_documents(str(path), avisos.append))
+    assert [d.page_content for d in docs] == ["b", "c"]
+    assert len(avisos) == 1
+
+
+def test_pretty_printed_object_is_read_whole(tmp_path):
+    path = tmp_path / "dados.json"
+    path.write_text(json.dumps({"text": "inteiro", "metadata": {"a": 1}}, indent=2), encoding="utf-8")
+
+    docs = list(loaders.iter_json_documents(str(path), print))
+    assert [(d.page_content, d.metadata) for d in docs] == [("inteiro", {"a": 1})]
@@ -0,0 +1,48 @@
+import pytest
+
+from rag.utils import diff_manifest
+
+
+def test_diff_manifest():
+    anteriores = {
+        "igual.pdf": {"hash": "h1", "chunk_ids": ["a-0", "a-1"]},
+        "mudou.pdf": {"hash": "h2", "chunk_ids": ["b-0"]},
+        "removido.pdf": {"hash": "h3", "chunk_ids": ["c-0", "c-1"]},
+    }
+    hashes = {"igual.pdf": "h1", "mudou.pdf": "h2-novo", "novo.pdf": "h4"}
+
+    manifesto, obsoletos, pendentes = diff_manifest(anteriores, hashes)
+    assert manifesto == {"igual.pdf": anteriores["igual.pdf"]}
+    assert sorted(obsoletos) == ["b-0", "c-0", "c-1"]
+    assert sorted(pendentes) == ["mudou.pdf", "novo.pdf"]
+
+
+def test_diff_manifest_without_previous_index():
+    manifesto, obsoletos, pendentes = diff_manifest({}, {"a.pdf": "h"})
+    assert (manifesto, obsoletos, pendentes) == ({}, [], ["a.pdf"])
+
+
+class _Splitter:
+    """Divide em pedaços de 5 caracteres, como um TextSplitter faria com tokens."""
+
+    def split_documents(self, docs):
+        from langchain.schema import Document
+        texto = docs[0].page_content
+        return [Document(page_content=texto[i:i + 5], metadata=dict(docs[0].metadata))
+                for i in range(0, len(texto), 5)]
+
+
+def test_split_file_docs_ids_are_deterministic_and_unique_per_file():
+    pytest.importorskip("streamlit")
+    pytest.importorskip("transformers")
+    Document = pytest.importorskip("langchain.schema").Document
+    from rag.vectorstore import split_file_docs
+
+    docs = [Document(page_content="abcdefghij", metadata={}), Document(page_content="  ", metadata={})]
+    ids = lambda nome: [c.metadata["chunk_id"] for c in split_file_docs(docs, _Splitter(), "f" * 64, nome)]
+
+    assert ids("a.pdf") == ids("a.pdf")
+    assert len(ids("a.pdf")) == 2
+    assert not set(ids("a.pdf")) & set(ids("copia de a.pdf"))
+    chunks = list(split_file_docs(docs, _Splitter(), "f" * 64, "a.pdf"))
+    assert all(c.page_content.startswith("passage: ") for c in chunks)
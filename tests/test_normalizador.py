@@ -0,0 +1,19 @@
+import pytest
+
+from rag.normalizador import stem, tokenizar
+
+
+@pytest.mark.parametrize("singular, plural", [
+    ("pais", "paises"),
+    ("jornal", "jornais"),
+    ("imovel", "imoveis"),
+    ("acao", "acoes"),
+    ("programa", "programas"),
+])
+def test_singular_and_plural_share_the_stem(singular, plural):
+    assert stem(singular) == stem(plural)
+
+
+def test_short_ais_words_are_not_treated_as_plurals():
+    assert stem("pais") != "pal"
+    assert tokenizar("País") == tokenizar("países")
@@ -4,15 +4,19 @@ import time
 import logging
 import streamlit as st
 from PIL import Image
-from settings import RETRIEVER_TOP_K, EMBEDDING_OPTIONS, TEMPERATURE
-from rag.llm_loader import load_llm
-from rag.qa_chain import build_qa_chain
+from settings import RETRIEVER_TOP_K, EMBEDDING_OPTIONS, TEMPERATURE, INDEX_TYPE, IVF_NPROBE, HNSW_EF_SEARCH
 from rag.prompt import get_saved_prompts, save_prompt
-from logic import process_query
+from logic import process_query, engine_config
 from handlers.file_handler import handle_upload_and_reindex, display_indexed_files
-from rag.embeddings import load_embeddings
-from langchain_community.vectorstores import FAISS
-from multi_faiss import MultiFAISSRetriever
+from rag.embeddings import loaded_embeddings_report
+from rag.index_registry import registry_stats
+from rag.ann_index import INDEX_TYPES
+from rag.engine import get_engine
+from rag.filtros import parse_filter
+from rag.answer_cache import get_answer_cache
+from rag.retrieval_cache import cache_stats as retrieval_cache_stats
+from rag.coalescer import batcher_stats
+from rag.llm_loader import llm_report
 
 def render_interface():
     render_header()
@@ -77,78 +81,175 @@ def render_sidebar():
         step=0.1
     )
 
-    modelo_llm = st.sidebar.radio("Modo de execução:", ["Ollama (servidor)", "OpenAI (API)"])
+    modelo_llm = st.sidebar.radio("Modo de execução:", ["Ollama (servidor)", "OpenAI (API)", "GGUF (offline)"])
     st.session_state["modelo_llm"] = modelo_llm
 
     embed_model_label = st.sidebar.selectbox("Escolha o modelo:", list(EMBEDDING_OPTIONS.keys()))
     embed_model_name = EMBEDDING_OPTIONS[embed_model_label]
     st.session_state["embedding_model"] = embed_model_name
 
+    index_type = st.sidebar.selectbox("Tipo de índice FAISS:", INDEX_TYPES, index=INDEX_TYPES.index(INDEX_TYPE))
+    st.session_state["index_type"] = index_type
+    if index_type == "IVF-Flat":
+        st.session_state["ivf_nprobe"] = st.sidebar.number_input("nprobe (IVF):", 1, 1024, IVF_NPROBE)
+    elif index_type == "HNSW":
+        st.session_state["hnsw_ef_search"] = st.sidebar.number_input("efSearch (HNSW):", 1, 2048, HNSW_EF_SEARCH)
+
     # Novidade: seleção de múltiplos índices FAISS
     st.sidebar.markdown("📂 **Índices FAISS disponíveis**")
     base_path = r"C:\SEPLAN\rag_ollama_home\vectors\vectordb_multilingual_e5_large"
-    faiss_list = [name for name in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, name))]
+    faiss_list = [
+        name for name in os.listdir(base_path)
+        if os.path.isdir(os.path.join(base_path, name)) and not name.startswith(".")
+    ]
     selecionados = st.sidebar.multiselect("Escolha os índices:", faiss_list)
     st.session_state["faiss_selecionados"] = [os.path.join(base_path, nome) for nome in selecionados]
 
+    st.session_state["filtro_metadados"] = st.sidebar.text_input(
+        "🏷️ Filtro de metadados:",
+        value=st.session_state.get("filtro_metadados", ""),
+        help="Ex.: origem=Programa.xls; aba=Plan1|Plan2 (';' = E, '|' = OU)"
+    )
+
     handle_upload_and_reindex(embed_model_name)
     display_indexed_files()
+    display_loaded_models()
+    display_cache_stats()
 
-def render_chat():
-    embed_model = st.session_state["embedding_model"]
-    modelo_llm = st.session_state["modelo_llm"]
-    faiss_paths = st.session_state.get("faiss_selecionados", [])
-    vectorstores = []
-
-    for path in faiss_paths:
-        index_file = os.path.join(path, "index.faiss")
-        if os.path.exists(index_file):
-            embeddings = load_embeddings(embed_model)
-            try:
-                store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
-                vectorstores.append(store)
-            except Exception as e:
-                st.warning(f"Erro ao carregar índice FAISS em {path}: {e}")
-
-    if not vectorstores:
-        st.warning("⚠️ Nenhum índice FAISS válido selecionado.")
-        st.stop()
+def display_cache_stats():
+    stats = get_answer_cache().stats()
+    st.sidebar.markdown("⚡ **Cache de respostas:**")
+    st.sidebar.caption(
+        f"{stats['hits']} acertos / {stats['misses']} falhas nesta execução "
+        f"(taxa {stats['hit_rate']:.0%}) — {stats['entradas']} respostas guardadas, "
+        f"{stats['acertos_acumulados']} reaproveitamentos no total"
+    )
+    busca = retrieval_cache_stats()
+    st.sidebar.caption(
+        f"🔎 Cache de recuperação: {busca['hits']} acertos / {busca['misses']} falhas "
+        f"(taxa {busca['hit_rate']:.0%}), {busca['entradas']} consultas guardadas"
+    )
 
-    retrievers = [
-        store.as_retriever(search_kwargs={"k": st.session_state["retriever_k"]})
-        for store in vectorstores
-    ]
+def display_loaded_models():
+    report = loaded_embeddings_report()
+    if report:
+        st.sidebar.markdown("🧠 **Modelos de embeddings carregados:**")
+        for item in report:
+            st.sidebar.caption(f"{item['modelo']} — {item['ram_mb']:.0f} MB")
+
+    llms = llm_report()
+    if llms:
+        st.sidebar.markdown("🔥 **LLM (primeiro token):**")
+        for item in llms:
+            partes = []
+            if item["aquecimento_s"] is not None:
+                partes.append(f"aquecimento {item['aquecimento_s']:.1f}s")
+            for tipo in ("fria", "quente"):
+                if item[f"chamadas_{tipo}s"]:
+                    partes.append(f"{tipo} {item[f'ttft_{tipo}_medio_s']:.2f}s ({item[f'chamadas_{tipo}s']}x)")
+            st.sidebar.caption(f"{item['modelo']} — " + ", ".join(partes))
+
+    lotes = [b for b in batcher_stats() if b["lotes"]]
+    if lotes:
+        st.sidebar.markdown("📦 **Agrupamento de pedidos:**")
+        for item in lotes:
+            tamanhos = ", ".join(f"{k}: {v}" for k, v in item["tamanho_lote"].items() if v)
+            esperas = ", ".join(f"{k} ms: {v}" for k, v in item["espera_ms"].items() if v)
+            st.sidebar.caption(
+                f"{item['nome']} — {item['lotes']} lotes, média de {item['media_por_lote']:.1f} itens  \n"
+                f"tamanho do lote: {tamanhos}  \nespera na fila: {esperas}"
+            )
 
-    retriever = MultiFAISSRetriever(retrievers=retrievers, k=st.session_state["retriever_k"])
+    indices = registry_stats()
+    if indices:
+        st.sidebar.markdown("🗂️ **Índices FAISS carregados:**")
+        for item in indices:
+            st.sidebar.caption(
+                f"{os.path.basename(item['caminho'])} — próprio {item['tamanho_mb']:.0f} MB, "
+                f"mapeado {item['mapeado_mb']:.0f} MB (residente {item['residente_mapeado_mb']:.0f} MB), "
+                f"docstore {item['docstore_cache_mb']:.0f} MB"
+            )
+
+def render_sources(docs):
+    for doc in docs:
+        source = doc.metadata.get("origem", "desconhecido")
+        nome = os.path.basename(source)
+        tipo = os.path.splitext(nome)[1].replace(".", "").upper()
+        st.markdown(f"**Fonte:** `{nome}` ({tipo})")
+        st.markdown(doc.page_content.strip())
+        st.markdown("---")
+
+def render_chat():
+    config = engine_config()
+    try:
+        parse_filter(config.filtro)
+    except ValueError as e:
+        st.sidebar.error(str(e))
+        config.filtro = ""
 
-    llm = load_llm(modelo_llm, temperature=st.session_state["llm_temperature"])
-    qa_chain = build_qa_chain(retriever, llm, st.session_state.get("prompt_name", "teste"))
+    try:
+        pipeline = get_engine().prepare(config)
+    except ValueError as e:
+        st.warning(f"⚠️ {e}")
+        st.stop()
+    for aviso in pipeline.avisos:
+        st.warning(aviso)
 
     with st.form("chat-form", clear_on_submit=True):
         user_input = st.text_input("Digite sua pergunta:", value="")
         submitted = st.form_submit_button("Enviar")
 
+    for role, msg in st.session_state.chat_history:
+        with st.chat_message("user" if role == "user" else "assistant"):
+            st.markdown(msg)
+
     if submitted and user_input:
-        resposta, fontes, elapsed = process_query(user_input, qa_chain)
-        st.sidebar.success(f"⏱️ Resposta em {elapsed:.2f} segundos")
+        with st.chat_message("user"):
+            st.markdown(user_input)
+        with st.chat_message("assistant"):
+            fontes_box = st.container()
+            resposta_box = st.empty()
+
+        partes = []
+
+        def on_sources(docs):
+            with fontes_box.expander("📚 Trechos usados na resposta"):
+                render_sources(docs)
+
+        def on_token(token):
+            partes.append(token)
+            resposta_box.markdown("".join(partes) + "▌")
+
+        resposta, fontes, elapsed, metricas = process_query(
+            user_input, pipeline, config, on_sources=on_sources, on_token=on_token
+        )
+        resposta_box.markdown(resposta)
+
+        velocidade = f", {metricas['tokens_por_segundo']:.1f} tokens/s" if metricas["tokens_por_segundo"] else ""
+        st.sidebar.success(
+            f"⏱️ Resposta em {elapsed:.2f} segundos (primeiro token em {metricas['ttft']:.2f}s{velocidade})"
+        )
+        if metricas["pergunta_busca"] != user_input:
+            st.sidebar.caption(f"🔎 Pergunta usada na busca: {metricas['pergunta_busca']}")
+        if metricas.get("trechos_recuperados"):
+            st.sidebar.caption(
+                f"📦 Contexto: {metricas['trechos_usados']}/{metricas['trechos_recuperados']} trechos, "
+                f"{metricas['tokens_contexto']} tokens ({metricas['tokens_economizados']} economizados)"
+            )
+        cached = st.session_state.get("last_cache_hit")
+        if cached:
+            st.info(
+                f"⚡ Resposta do cache (similaridade {cached['similaridade']:.2f} "
+                f"com: \"{cached['pergunta_original']}\")"
+            )
 
         with st.expander("🔌 Depuração: Chunks retornados pelo retriever"):
             for doc in fontes:
                 st.markdown(doc.page_content)
 
-    for role, msg in st.session_state.chat_history:
-        with st.chat_message("user" if role == "user" else "assistant"):
-            st.markdown(msg)
-
-    if "last_contexts" in st.session_state:
+    elif "last_contexts" in st.session_state:
         with st.expander("📚 Trechos usados na resposta"):
-            for doc in st.session_state.last_contexts:
-                source = doc.metadata.get("origem", "desconhecido")
-                nome = os.path.basename(source)
-                tipo = os.path.splitext(nome)[1].replace(".", "").upper()
-                st.markdown(f"**Fonte:** `{nome}` ({tipo})")
-                st.markdown(doc.page_content.strip())
-                st.markdown("---")
+            render_sources(st.session_state.last_contexts)
 
     if st.button("🧹 Limpar conversa"):
         st.session_state.chat_history = []